@@ -1,26 +1,274 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, url_for
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import requests
 import os
+import re
+
+from cache import CachedResponse, ResponseCache, body_etag
+from compresion import compression_stats, init_compression
+from metricas import PROMETHEUS_CONTENT_TYPE, gauges, init_metrics, prometheus_requested, render_prometheus, route_stats, upstream_stats
+from trazas import format_tree, init_tracing, merge_spans, trace_spans, trace_summaries
+from perfilado import (FOLDED_CONTENT_TYPE, PROFILING_SLOW_REQUEST_MS, authorize, background_profile, blocks_worker, folded,
+                       init_profiling, parse_seconds, retry_after, sample, save, slow_profiles, start_background)
+from upstream import UpstreamClient
 
 app = Flask(__name__)
+init_compression(app)
+init_metrics(app)
+init_tracing(app, 'gateway')
+init_profiling(app)
 
 # URLs de los microservicios
 PACIENTES_SERVICE_URL = os.getenv('PACIENTES_SERVICE_URL', 'http://localhost:5001')
 CITAS_SERVICE_URL = os.getenv('CITAS_SERVICE_URL', 'http://localhost:5002')
 
+# Clientes HTTP con pool de conexiones (uno por microservicio y por worker)
+pacientes_client = UpstreamClient('pacientes', PACIENTES_SERVICE_URL)
+citas_client = UpstreamClient('citas', CITAS_SERVICE_URL)
+
+# Caché de lectura para GET de pacientes y citas por id
+GATEWAY_CACHE_SIZE = int(os.getenv('GATEWAY_CACHE_SIZE', 1024))
+GATEWAY_CACHE_TTL = float(os.getenv('GATEWAY_CACHE_TTL', 30))
+response_cache = ResponseCache(GATEWAY_CACHE_SIZE, GATEWAY_CACHE_TTL)
+
+# Hilos para consultar varios microservicios en paralelo (rutas de agregación)
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', 8))
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix='fanout')
+
+# Modo passthrough: reenviar el cuerpo de los microservicios sin decodificarlo
+GATEWAY_PASSTHROUGH = os.getenv('GATEWAY_PASSTHROUGH', 'true').lower() == 'true'
+PASSTHROUGH_CHUNK_SIZE = int(os.getenv('PASSTHROUGH_CHUNK_SIZE', 64 * 1024))
+PASSTHROUGH_HEADERS = (
+    'Content-Type', 'Content-Length', 'Content-Encoding', 'ETag',
+    'Last-Modified', 'Cache-Control', 'Vary', 'Link', 'X-Next-Cursor', 'Set-Cookie'
+)
+# Sin passthrough el cuerpo se vuelve a serializar; se conservan los validadores y la paginación
+RELAY_HEADERS = ('ETag', 'Last-Modified', 'Link', 'X-Next-Cursor', 'Set-Cookie')
+
+# Cabeceras de GET condicional que se reenvían a los microservicios
+CONDITIONAL_HEADERS = ('If-None-Match', 'If-Modified-Since')
+
+# Cookies de los microservicios que el cliente devuelve (lecturas en la primaria tras una escritura)
+READ_COOKIE_PREFIX = 'leer_primaria'
+
+def conditional_headers():
+    """Cabeceras If-None-Match / If-Modified-Since de la petición del cliente"""
+    return {name: request.headers[name] for name in CONDITIONAL_HEADERS if name in request.headers}
+
+def read_cookie_headers():
+    """Cookie con solo las cookies de lectura del cliente (las demás no salen del gateway)"""
+    cookies = [f'{name}={value}' for name, value in request.cookies.items() if name.startswith(READ_COOKIE_PREFIX)]
+    return {'Cookie': '; '.join(cookies)} if cookies else {}
+
+def accept_encoding():
+    """Accept-Encoding del cliente para el microservicio
+
+    En modo passthrough las respuestas se reenvían sin descomprimir, así que
+    el microservicio solo puede usar las codificaciones que acepta el cliente.
+    """
+    return {'Accept-Encoding': request.headers.get('Accept-Encoding', 'identity')}
+
+def read_headers():
+    """Cabeceras que se reenvían en las lecturas: GET condicional, cookies de lectura y Accept-Encoding"""
+    return dict(conditional_headers(), **read_cookie_headers(), **accept_encoding())
+
+def forward_headers(response, names=PASSTHROUGH_HEADERS):
+    """Cabeceras del microservicio que se reenvían al cliente"""
+    headers = {name: response.headers[name] for name in names if name in response.headers}
+    if 'Link' in headers:
+        # Las rutas del gateway son las del microservicio con el prefijo /api
+        headers['Link'] = re.sub(r'<(/[^>]*)>', r'</api\1>', headers['Link'])
+    return headers
+
+def passthrough(response, on_close=None):
+    """Transmitir por bloques los bytes, el estado y las cabeceras del microservicio
+
+    on_close se ejecuta al terminar la transmisión, también si el cliente se desconecta.
+    """
+    headers = forward_headers(response)
+
+    def generate():
+        try:
+            for chunk in response.raw.stream(PASSTHROUGH_CHUNK_SIZE, decode_content=False):
+                yield chunk
+        finally:
+            response.close()
+            if on_close is not None:
+                on_close()
+
+    return Response(generate(), status=response.status_code, headers=headers)
+
+def relay(response):
+    """Devolver al cliente la respuesta de un microservicio"""
+    if GATEWAY_PASSTHROUGH or response.status_code == 304:
+        return passthrough(response)
+    try:
+        return jsonify(response.json()), response.status_code, forward_headers(response, RELAY_HEADERS)
+    finally:
+        response.close()
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({'status': 'API Gateway is running'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas del worker: latencia por ruta y por microservicio, pool de conexiones, caché y compresión
+
+    Devuelve JSON, o el formato de texto de Prometheus si Accept lo prefiere
+    (como hace Prometheus) o con ?format=prometheus.
+    """
+    upstreams = {client.name: client.stats() for client in (pacientes_client, citas_client)}
+    cache = response_cache.stats()
+    compresion = compression_stats()
+    if prometheus_requested(request.headers.get('Accept'), request.args.get('format')):
+        extra = gauges('gateway_cache', cache)
+        for name, stats in upstreams.items():
+            extra += gauges('upstream_pool', stats, upstream=name)
+        for algorithm, stats in compresion['algorithms'].items():
+            extra += gauges('compression', stats, algorithm=algorithm)
+        return Response(render_prometheus('gateway', extra), content_type=PROMETHEUS_CONTENT_TYPE)
+    return jsonify({
+        'pid': os.getpid(),
+        'rutas': route_stats(),
+        'llamadas': upstream_stats(),
+        'upstreams': upstreams,
+        'cache': cache,
+        'compresion': compresion
+    }), 200
+
+@app.route('/perfil', methods=['GET'])
+def get_perfil():
+    """Perfil por muestreo de los hilos del worker durante ?segundos=N, en formato collapsed
+
+    En un worker sync el muestreo corre en segundo plano y se responde 202 con
+    la URL del resultado en Location.
+    """
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'Unauthorized' if error == 401 else 'Not found'}), error
+    try:
+        seconds = parse_seconds(request.args.get('segundos'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not blocks_worker(request.environ):
+        counts = sample(seconds)
+        save('muestreo', counts)
+        return Response(folded(counts), content_type=FOLDED_CONTENT_TYPE)
+    profile = start_background(seconds)
+    if profile is None:
+        return jsonify({'error': 'This worker is already running a sampling'}), 409
+    url = url_for('get_perfil_resultado', id=profile['id'])
+    response = jsonify({'id': profile['id'], 'segundos': seconds, 'resultado': url})
+    response.headers['Location'] = url
+    response.headers['Retry-After'] = str(retry_after(profile))
+    return response, 202
+
+@app.route('/perfil/<id>', methods=['GET'])
+def get_perfil_resultado(id):
+    """Resultado de un muestreo en segundo plano (202 mientras sigue en curso)"""
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'Unauthorized' if error == 401 else 'Not found'}), error
+    profile = background_profile(id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found in this worker', 'pid': os.getpid()}), 404
+    if profile['counts'] is None:
+        response = jsonify({'id': id, 'segundos': profile['segundos'], 'resultado': request.path})
+        response.headers['Retry-After'] = str(retry_after(profile))
+        return response, 202
+    return Response(folded(profile['counts']), content_type=FOLDED_CONTENT_TYPE)
+
+@app.route('/perfil/lentas', methods=['GET'])
+def get_perfiles_lentos():
+    """Perfiles de las últimas peticiones lentas del worker (?ruta= filtra; ?formato=collapsed los une)"""
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'Unauthorized' if error == 401 else 'Not found'}), error
+    profiles = slow_profiles(request.args.get('ruta'))
+    if request.args.get('formato') == 'collapsed':
+        return Response(''.join(profile['folded'] for profile in profiles), content_type=FOLDED_CONTENT_TYPE)
+    return jsonify({'umbral_ms': PROFILING_SLOW_REQUEST_MS, 'pid': os.getpid(), 'perfiles': profiles}), 200
+
+@app.route('/trazas', methods=['GET'])
+def get_trazas():
+    """Trazas recientes registradas por este worker del gateway"""
+    return jsonify(trace_summaries()), 200
+
+@app.route('/trazas/<trace_id>', methods=['GET'])
+def get_traza(trace_id):
+    """Spans de una traza en el gateway y en los microservicios (?formato=texto para verlos como árbol)"""
+    groups = [trace_spans(trace_id)]
+    for client in (pacientes_client, citas_client):
+        try:
+            status, body = fetch_json(client, f'/trazas/{trace_id}')
+        except (requests.exceptions.RequestException, ValueError):
+            continue
+        if status == 200:
+            groups.append(body)
+    spans = merge_spans(*groups)
+    if request.args.get('formato') == 'texto':
+        return Response(format_tree(spans), mimetype='text/plain')
+    return jsonify(spans), 200
+
+def fetch_json(client, path, headers=None):
+    """Obtener el código de estado y el cuerpo JSON de un microservicio"""
+    response = client.get(path, headers=headers)
+    try:
+        return response.status_code, response.json()
+    finally:
+        response.close()
+
+def cached_get(client, key, path):
+    """GET con caché de lectura y soporte de ETag/If-None-Match
+
+    Solo se guardan respuestas 200; los errores siempre se piden al microservicio.
+    Un cliente que acaba de escribir (cookie de lectura) no usa la caché y
+    lee de la primaria.
+    """
+    cookie_headers = read_cookie_headers()
+    entry = response_cache.get(key) if response_cache.enabled and not cookie_headers else None
+    cache_status = 'HIT'
+    if entry is None:
+        cache_status = 'MISS'
+        # La caché guarda el cuerpo sin comprimir; se comprime para cada cliente al responder
+        response = client.get(path, headers={'Accept-Encoding': 'identity', **cookie_headers})
+        try:
+            body = response.content
+        finally:
+            response.close()
+        etag = response.headers.get('ETag') or body_etag(body)
+        headers = {name: response.headers[name] for name in ('Content-Type', 'Last-Modified') if name in response.headers}
+        entry = CachedResponse(response.status_code, body, headers, etag)
+        if response.status_code == 200 and not cookie_headers:
+            response_cache.set(key, entry)
+
+    headers = dict(entry.headers, ETag=entry.etag, **{'X-Cache': cache_status})
+    cached = Response(entry.body, status=entry.status, headers=headers)
+    if entry.status == 200:
+        # Responde 304 si coincide If-None-Match o If-Modified-Since
+        cached.make_conditional(request)
+    return cached
+
 # ==================== RUTAS PARA PACIENTES ====================
 
 @app.route('/api/pacientes', methods=['GET'])
 def get_pacientes():
-    """Obtener todos los pacientes"""
+    """Obtener todos los pacientes (admite limit, cursor, fields e ids)"""
+    try:
+        response = pacientes_client.get('/pacientes', params=request.query_string, headers=read_headers())
+        return relay(response)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
+
+@app.route('/api/pacientes/export', methods=['GET'])
+def export_pacientes():
+    """Exportar todos los pacientes por streaming (format=ndjson o json)"""
     try:
-        response = requests.get(f'{PACIENTES_SERVICE_URL}/pacientes')
-        return jsonify(response.json()), response.status_code
+        response = pacientes_client.get('/pacientes/export', params=request.query_string, headers=dict(read_cookie_headers(), **accept_encoding()))
+        return passthrough(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
 
@@ -28,21 +276,75 @@ def get_pacientes():
 def get_paciente(id):
     """Obtener un paciente por ID"""
     try:
-        response = requests.get(f'{PACIENTES_SERVICE_URL}/pacientes/{id}')
-        return jsonify(response.json()), response.status_code
+        return cached_get(pacientes_client, f'paciente:{id}', f'/pacientes/{id}')
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
 
+@app.route('/api/pacientes/<int:id>/expediente', methods=['GET'])
+def get_expediente(id):
+    """Obtener un paciente junto con sus citas
+
+    Ambos microservicios se consultan en paralelo. Si uno falla se devuelve
+    el resultado parcial con el detalle en "errores".
+    """
+    headers = read_cookie_headers()
+    # Cada hilo corre en una copia del contexto para que sus llamadas queden en la traza de la petición
+    futures = {
+        'paciente': (fanout_executor.submit(contextvars.copy_context().run, fetch_json, pacientes_client,
+                                            f'/pacientes/{id}', headers), 'Pacientes'),
+        'citas': (fanout_executor.submit(contextvars.copy_context().run, fetch_json, citas_client,
+                                         f'/citas/paciente/{id}', headers), 'Citas')
+    }
+    expediente = {}
+    errores = {}
+    for key, (future, service) in futures.items():
+        try:
+            status, body = future.result()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            expediente[key] = None
+            errores[key] = {'error': f'{service} service unavailable', 'details': str(e)}
+            continue
+        if key == 'paciente' and status == 404:
+            return jsonify(body), 404
+        if status != 200:
+            expediente[key] = None
+            errores[key] = {'error': f'{service} service error', 'status': status, 'details': body}
+            continue
+        expediente[key] = body
+    
+    if errores:
+        expediente['parcial'] = True
+        expediente['errores'] = errores
+    return jsonify(expediente), 503 if len(errores) == len(futures) else 200
+
 @app.route('/api/pacientes', methods=['POST'])
 def create_paciente():
     """Crear un nuevo paciente"""
     try:
-        response = requests.post(
-            f'{PACIENTES_SERVICE_URL}/pacientes',
+        response = pacientes_client.post(
+            '/pacientes',
             json=request.get_json(),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json', **accept_encoding()}
+        )
+        return relay(response)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
+
+@app.route('/api/pacientes/bulk', methods=['POST'])
+def import_pacientes():
+    """Importar pacientes en lote (JSON o CSV)"""
+    try:
+        response = pacientes_client.post(
+            '/pacientes/bulk',
+            params=request.query_string,
+            data=request.stream,
+            headers={'Content-Type': request.content_type or 'application/json', **accept_encoding()}
         )
-        return jsonify(response.json()), response.status_code
+        # Con on_conflict=update la importación puede modificar cualquier paciente. Sigue
+        # escribiendo mientras transmite el resultado: un GET concurrente puede guardar en la
+        # caché una versión vieja, así que se invalida otra vez al terminar
+        response_cache.invalidate_prefix('paciente:')
+        return passthrough(response, on_close=lambda: response_cache.invalidate_prefix('paciente:'))
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
 
@@ -50,12 +352,13 @@ def create_paciente():
 def update_paciente(id):
     """Actualizar un paciente"""
     try:
-        response = requests.put(
-            f'{PACIENTES_SERVICE_URL}/pacientes/{id}',
+        response = pacientes_client.put(
+            f'/pacientes/{id}',
             json=request.get_json(),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json', **accept_encoding()}
         )
-        return jsonify(response.json()), response.status_code
+        response_cache.invalidate(f'paciente:{id}')
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
 
@@ -63,8 +366,9 @@ def update_paciente(id):
 def delete_paciente(id):
     """Eliminar un paciente"""
     try:
-        response = requests.delete(f'{PACIENTES_SERVICE_URL}/pacientes/{id}')
-        return jsonify(response.json()), response.status_code
+        response = pacientes_client.delete(f'/pacientes/{id}', headers=accept_encoding())
+        response_cache.invalidate(f'paciente:{id}')
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Pacientes service unavailable', 'details': str(e)}), 503
 
@@ -72,10 +376,28 @@ def delete_paciente(id):
 
 @app.route('/api/citas', methods=['GET'])
 def get_citas():
-    """Obtener todas las citas"""
+    """Obtener todas las citas (admite limit, cursor, fields e ids)"""
+    try:
+        response = citas_client.get('/citas', params=request.query_string, headers=read_headers())
+        return relay(response)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
+
+@app.route('/api/citas/export', methods=['GET'])
+def export_citas():
+    """Exportar todas las citas por streaming (format=ndjson o json)"""
+    try:
+        response = citas_client.get('/citas/export', params=request.query_string, headers=dict(read_cookie_headers(), **accept_encoding()))
+        return passthrough(response)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
+
+@app.route('/api/citas/disponibilidad', methods=['GET'])
+def get_disponibilidad():
+    """Buscar horarios libres de un médico o especialidad"""
     try:
-        response = requests.get(f'{CITAS_SERVICE_URL}/citas')
-        return jsonify(response.json()), response.status_code
+        response = citas_client.get('/citas/disponibilidad', params=request.query_string, headers=dict(read_cookie_headers(), **accept_encoding()))
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
 
@@ -83,8 +405,7 @@ def get_citas():
 def get_cita(id):
     """Obtener una cita por ID"""
     try:
-        response = requests.get(f'{CITAS_SERVICE_URL}/citas/{id}')
-        return jsonify(response.json()), response.status_code
+        return cached_get(citas_client, f'cita:{id}', f'/citas/{id}')
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
 
@@ -92,8 +413,8 @@ def get_cita(id):
 def get_citas_by_paciente(paciente_id):
     """Obtener todas las citas de un paciente"""
     try:
-        response = requests.get(f'{CITAS_SERVICE_URL}/citas/paciente/{paciente_id}')
-        return jsonify(response.json()), response.status_code
+        response = citas_client.get(f'/citas/paciente/{paciente_id}', headers=read_headers())
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
 
@@ -101,12 +422,25 @@ def get_citas_by_paciente(paciente_id):
 def create_cita():
     """Crear una nueva cita"""
     try:
-        response = requests.post(
-            f'{CITAS_SERVICE_URL}/citas',
+        response = citas_client.post(
+            '/citas',
             json=request.get_json(),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json', **accept_encoding()}
+        )
+        return relay(response)
+    except requests.exceptions.RequestException as e:
+        return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
+
+@app.route('/api/citas/bulk', methods=['POST'])
+def create_citas_bulk():
+    """Crear un lote de citas"""
+    try:
+        response = citas_client.post(
+            '/citas/bulk',
+            data=request.get_data(),
+            headers={'Content-Type': 'application/json', **accept_encoding()}
         )
-        return jsonify(response.json()), response.status_code
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
 
@@ -114,12 +448,13 @@ def create_cita():
 def update_cita(id):
     """Actualizar una cita"""
     try:
-        response = requests.put(
-            f'{CITAS_SERVICE_URL}/citas/{id}',
+        response = citas_client.put(
+            f'/citas/{id}',
             json=request.get_json(),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json', **accept_encoding()}
         )
-        return jsonify(response.json()), response.status_code
+        response_cache.invalidate(f'cita:{id}')
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
 
@@ -127,8 +462,9 @@ def update_cita(id):
 def delete_cita(id):
     """Eliminar una cita"""
     try:
-        response = requests.delete(f'{CITAS_SERVICE_URL}/citas/{id}')
-        return jsonify(response.json()), response.status_code
+        response = citas_client.delete(f'/citas/{id}', headers=accept_encoding())
+        response_cache.invalidate(f'cita:{id}')
+        return relay(response)
     except requests.exceptions.RequestException as e:
         return jsonify({'error': 'Citas service unavailable', 'details': str(e)}), 503
 
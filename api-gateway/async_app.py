@@ -0,0 +1,489 @@
+"""API Gateway asíncrono (aiohttp)
+
+Expone las mismas rutas que app.py pero sin bloquear un hilo por cada
+petición a los microservicios: un solo proceso puede tener miles de
+peticiones en vuelo. Se selecciona con GATEWAY_RUNTIME=async (ver
+gunicorn.conf.py); la app Flask de app.py sigue siendo la opción por defecto.
+"""
+import asyncio
+import os
+import re
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+
+from cache import CachedResponse, ResponseCache, body_etag
+from compresion import COMPRESSION_ENABLED, COMPRESSION_MIN_SIZE, compress, compressible, compression_stats, negotiate
+from metricas import (
+    PROMETHEUS_CONTENT_TYPE, UNMATCHED_ROUTE, gauges, observe_request, observe_upstream,
+    prometheus_requested, render_prometheus, route_stats, upstream_stats
+)
+from trazas import (
+    TRACING_ENABLED, UNTRACED_PATHS, activate, current_span, deactivate, end_span, format_tree, merge_spans,
+    parse_traceparent, start_span, trace_spans, trace_summaries
+)
+from perfilado import authorize, folded, parse_seconds, sample, save
+
+# URLs de los microservicios
+PACIENTES_SERVICE_URL = os.getenv('PACIENTES_SERVICE_URL', 'http://localhost:5001')
+CITAS_SERVICE_URL = os.getenv('CITAS_SERVICE_URL', 'http://localhost:5002')
+
+# Configuración de las conexiones hacia los microservicios
+ASYNC_POOL_SIZE = int(os.getenv('ASYNC_POOL_SIZE', 1000))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+UPSTREAM_KEEP_ALIVE = os.getenv('UPSTREAM_KEEP_ALIVE', 'true').lower() == 'true'
+PASSTHROUGH_CHUNK_SIZE = int(os.getenv('PASSTHROUGH_CHUNK_SIZE', 64 * 1024))
+
+# Caché de lectura para GET de pacientes y citas por id
+GATEWAY_CACHE_SIZE = int(os.getenv('GATEWAY_CACHE_SIZE', 1024))
+GATEWAY_CACHE_TTL = float(os.getenv('GATEWAY_CACHE_TTL', 30))
+response_cache = ResponseCache(GATEWAY_CACHE_SIZE, GATEWAY_CACHE_TTL)
+
+# Cabeceras que se reenvían en cada sentido
+REQUEST_HEADERS = ('Content-Type', 'Accept', 'If-None-Match', 'If-Modified-Since')
+PASSTHROUGH_HEADERS = (
+    'Content-Type', 'Content-Length', 'Content-Encoding', 'ETag',
+    'Last-Modified', 'Cache-Control', 'Vary', 'Link', 'X-Next-Cursor'
+)
+
+# Cookies de los microservicios que el cliente devuelve (lecturas en la primaria tras una escritura)
+READ_COOKIE_PREFIX = 'leer_primaria'
+
+UPSTREAM_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class AsyncUpstream:
+    """Sesión aiohttp con pool de conexiones hacia un microservicio"""
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.label = name.capitalize()
+        self.session = None
+        self.counters = {'requests': 0, 'new_connections': 0, 'pool_hits': 0, 'in_flight': 0}
+
+    async def start(self, app):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_new_connection)
+        trace.on_connection_reuseconn.append(self._on_reused_connection)
+        trace.on_request_start.append(self._on_request_start)
+        trace.on_request_end.append(self._on_request_end)
+        trace.on_request_exception.append(self._on_request_exception)
+        connector = aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE, force_close=not UPSTREAM_KEEP_ALIVE)
+        timeout = aiohttp.ClientTimeout(sock_connect=UPSTREAM_CONNECT_TIMEOUT, sock_read=UPSTREAM_READ_TIMEOUT)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=timeout,
+            # La sesión es compartida por todos los clientes: no guarda cookies de los microservicios
+            cookie_jar=aiohttp.DummyCookieJar(),
+            trace_configs=[trace],
+            auto_decompress=False
+        )
+
+    async def close(self, app):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _on_new_connection(self, session, context, params):
+        self.counters['new_connections'] += 1
+
+    async def _on_reused_connection(self, session, context, params):
+        self.counters['pool_hits'] += 1
+
+    async def _on_request_start(self, session, context, params):
+        context.started = time.perf_counter()
+        # Span de cliente dentro de la traza de la petición en curso, propagado con traceparent
+        context.span = None
+        if current_span() is not None:
+            context.span = start_span(f'{params.method} {self.name}', 'client', attributes={
+                'http.method': params.method, 'http.url': str(params.url), 'peer.service': self.name})
+            traceparent = context.span.traceparent()
+            if traceparent:
+                params.headers['traceparent'] = traceparent
+
+    async def _on_request_end(self, session, context, params):
+        # Tiempo hasta recibir las cabeceras (el cuerpo se transmite después)
+        observe_upstream(self.name, params.method, params.response.status, time.perf_counter() - context.started)
+        if context.span is not None:
+            context.span.set('http.status_code', params.response.status)
+            end_span(context.span)
+
+    async def _on_request_exception(self, session, context, params):
+        observe_upstream(self.name, params.method, 'error', time.perf_counter() - context.started)
+        if context.span is not None:
+            end_span(context.span, params.exception)
+
+    def request(self, method, path, **kwargs):
+        self.counters['requests'] += 1
+        return self.session.request(method, f'{self.base_url}{path}', **kwargs)
+
+    def stats(self):
+        return {
+            'base_url': self.base_url,
+            'pool_size': ASYNC_POOL_SIZE,
+            'keep_alive': UPSTREAM_KEEP_ALIVE,
+            **self.counters
+        }
+
+
+pacientes = AsyncUpstream('pacientes', PACIENTES_SERVICE_URL)
+citas = AsyncUpstream('citas', CITAS_SERVICE_URL)
+
+
+def unavailable(upstream, error):
+    return web.json_response(
+        {'error': f'{upstream.label} service unavailable', 'details': str(error)},
+        status=503
+    )
+
+
+def forward_headers(headers):
+    """Cabeceras del microservicio que se reenvían al cliente"""
+    forwarded = CIMultiDict((name, headers[name]) for name in PASSTHROUGH_HEADERS if name in headers)
+    if 'Link' in forwarded:
+        # Las rutas del gateway son las del microservicio con el prefijo /api
+        forwarded['Link'] = re.sub(r'<(/[^>]*)>', r'</api\1>', forwarded['Link'])
+    for cookie in headers.getall('Set-Cookie', []):
+        forwarded.add('Set-Cookie', cookie)
+    return forwarded
+
+
+def read_cookie_headers(request):
+    """Cookie con solo las cookies de lectura del cliente (las demás no salen del gateway)"""
+    cookies = [f'{name}={value}' for name, value in request.cookies.items() if name.startswith(READ_COOKIE_PREFIX)]
+    return {'Cookie': '; '.join(cookies)} if cookies else {}
+
+
+def invalidate_entry(prefix):
+    """Invalidar la entrada de caché del id de la ruta (tras un PUT o DELETE)"""
+    return lambda request: response_cache.invalidate(f"{prefix}:{request.match_info['id']}")
+
+
+def invalidate_all(prefix):
+    """Invalidar todas las entradas de caché de un tipo"""
+    return lambda request: response_cache.invalidate_prefix(f'{prefix}:')
+
+
+def proxy(upstream, on_response=None):
+    """Handler que reenvía la petición al microservicio y transmite la respuesta por bloques
+
+    on_response (p. ej. para invalidar la caché) se ejecuta en cuanto responde el
+    microservicio y otra vez al terminar de transmitir la respuesta: una
+    importación por streaming sigue escribiendo mientras responde.
+    """
+
+    async def handler(request):
+        # Las rutas del microservicio son las del gateway sin el prefijo /api
+        path = request.path[len('/api'):]
+        headers = {name: request.headers[name] for name in REQUEST_HEADERS if name in request.headers}
+        headers.update(read_cookie_headers(request))
+        # El cuerpo se reenvía sin descomprimir, así que solo se aceptan las codificaciones del cliente
+        headers['Accept-Encoding'] = request.headers.get('Accept-Encoding', 'identity')
+        body = request.content if request.body_exists else None
+        stream = None
+        upstream.counters['in_flight'] += 1
+        try:
+            async with upstream.request(request.method, path, params=request.query_string,
+                                        data=body, headers=headers) as response:
+                if on_response is not None:
+                    on_response(request)
+                try:
+                    stream = web.StreamResponse(status=response.status, headers=forward_headers(response.headers))
+                    request_span = current_span()
+                    if request_span is not None and request_span.trace_id:
+                        stream.headers['X-Trace-Id'] = request_span.trace_id
+                    await stream.prepare(request)
+                    async for chunk in response.content.iter_chunked(PASSTHROUGH_CHUNK_SIZE):
+                        await stream.write(chunk)
+                    await stream.write_eof()
+                    return stream
+                finally:
+                    if on_response is not None:
+                        on_response(request)
+        except UPSTREAM_ERRORS as e:
+            if stream is None or not stream.prepared:
+                return unavailable(upstream, e)
+            # Las cabeceras ya se enviaron: cortar la conexión para que el cliente no tome
+            # el cuerpo truncado por completo (una respuesta nueva ya no se puede enviar)
+            request.transport.abort()
+            return stream
+        finally:
+            upstream.counters['in_flight'] -= 1
+
+    return handler
+
+
+def not_modified(request, entry):
+    """Si la petición condicional coincide con la respuesta guardada (como make_conditional en app.py)"""
+    if 'If-None-Match' in request.headers:
+        # Comparación débil: las respuestas comprimidas llevan el ETag como W/"..."
+        if_none_match = [tag.strip().removeprefix('W/') for tag in request.headers['If-None-Match'].split(',')]
+        return entry.etag in if_none_match or '*' in if_none_match
+    if request.if_modified_since is None or 'Last-Modified' not in entry.headers:
+        return False
+    try:
+        return parsedate_to_datetime(entry.headers['Last-Modified']) <= request.if_modified_since
+    except (TypeError, ValueError):
+        return False
+
+
+def cached(upstream, prefix):
+    """Handler GET por id con caché de lectura y soporte de ETag/If-None-Match e If-Modified-Since"""
+
+    async def handler(request):
+        key = f"{prefix}:{request.match_info['id']}"
+        # Un cliente que acaba de escribir no usa la caché y lee de la primaria
+        cookie_headers = read_cookie_headers(request)
+        entry = response_cache.get(key) if response_cache.enabled and not cookie_headers else None
+        cache_status = 'HIT'
+        if entry is None:
+            cache_status = 'MISS'
+            try:
+                async with upstream.request('GET', request.path[len('/api'):],
+                                            headers={'Accept-Encoding': 'identity', **cookie_headers}) as response:
+                    body = await response.read()
+            except UPSTREAM_ERRORS as e:
+                return unavailable(upstream, e)
+            etag = response.headers.get('ETag') or body_etag(body)
+            headers = {name: response.headers[name] for name in ('Content-Type', 'Last-Modified') if name in response.headers}
+            entry = CachedResponse(response.status, body, headers, etag)
+            if response.status == 200 and not cookie_headers:
+                response_cache.set(key, entry)
+
+        headers = dict(entry.headers, ETag=entry.etag, **{'X-Cache': cache_status})
+        if entry.status == 200 and not_modified(request, entry):
+            headers.pop('Content-Type', None)
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=entry.body, status=entry.status, headers=headers)
+
+    return handler
+
+
+@web.middleware
+async def record_metrics(request, handler):
+    """Registrar la latencia y el estado de cada petición por ruta (incluye el envío del cuerpo)"""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        resource = request.match_info.route.resource
+        route = resource.canonical if resource is not None else UNMATCHED_ROUTE
+        observe_request(route, request.method, status, time.perf_counter() - started)
+
+
+@web.middleware
+async def trace_requests(request, handler):
+    """Abrir un span de servidor por petición, continuando el traceparent recibido"""
+    if not TRACING_ENABLED or request.path.startswith(UNTRACED_PATHS):
+        return await handler(request)
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else request.path
+    request_span = start_span(f'{request.method} {route}', 'server',
+                              remote=parse_traceparent(request.headers.get('traceparent')),
+                              attributes={'http.method': request.method, 'http.route': route,
+                                          'http.target': request.path_qs},
+                              service='gateway')
+    token = activate(request_span)
+    error = None
+    try:
+        response = await handler(request)
+        request_span.set('http.status_code', response.status)
+        if not response.prepared:
+            response.headers['X-Trace-Id'] = request_span.trace_id
+        return response
+    except web.HTTPException as e:
+        request_span.set('http.status_code', e.status)
+        raise
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        deactivate(token)
+        end_span(request_span, error)
+
+
+@web.middleware
+async def compress_responses(request, handler):
+    """Comprimir las respuestas que genera el gateway (caché, expediente, errores)
+
+    Las del proxy ya se transmitieron con la codificación que eligió el microservicio.
+    """
+    response = await handler(request)
+    if not COMPRESSION_ENABLED or request.method == 'HEAD' or not isinstance(response, web.Response):
+        return response
+    body = response.body
+    if not isinstance(body, bytes) or not compressible(response.content_type, response.status,
+                                                       response.headers.get('Content-Encoding')):
+        return response
+    vary = response.headers.get('Vary')
+    response.headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+    algorithm = negotiate(request.headers.get('Accept-Encoding'))
+    if algorithm is None or len(body) < COMPRESSION_MIN_SIZE:
+        return response
+    response.body = compress(algorithm, body)
+    response.headers['Content-Encoding'] = algorithm
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = f'W/{etag}'
+    return response
+
+
+async def fetch_json(upstream, path, headers=None):
+    """Obtener el código de estado y el cuerpo JSON de un microservicio"""
+    async with upstream.request('GET', path, headers={'Accept-Encoding': 'identity', **(headers or {})}) as response:
+        return response.status, await response.json(content_type=None)
+
+
+async def health(request):
+    """Health check endpoint"""
+    return web.json_response({'status': 'API Gateway is running', 'runtime': 'async'})
+
+
+async def metrics(request):
+    """Métricas del proceso: latencia por ruta y por microservicio, conexiones, caché y compresión
+
+    Devuelve JSON, o el formato de texto de Prometheus si Accept lo prefiere
+    (como hace Prometheus) o con ?format=prometheus.
+    """
+    upstreams = {upstream.name: upstream.stats() for upstream in (pacientes, citas)}
+    cache = response_cache.stats()
+    compresion = compression_stats()
+    if prometheus_requested(request.headers.get('Accept'), request.query.get('format')):
+        extra = gauges('gateway_cache', cache)
+        for name, stats in upstreams.items():
+            extra += gauges('upstream_pool', stats, upstream=name)
+        for algorithm, stats in compresion['algorithms'].items():
+            extra += gauges('compression', stats, algorithm=algorithm)
+        return web.Response(body=render_prometheus('gateway', extra).encode(),
+                            headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+    return web.json_response({
+        'pid': os.getpid(),
+        'rutas': route_stats(),
+        'llamadas': upstream_stats(),
+        'upstreams': upstreams,
+        'cache': cache,
+        'compresion': compresion
+    })
+
+
+async def get_perfil(request):
+    """Perfil por muestreo de los hilos del proceso durante ?segundos=N, en formato collapsed
+
+    El muestreo corre en un hilo aparte: el event loop sigue atendiendo y sus
+    pilas quedan en el perfil. El perfil de peticiones lentas
+    (PROFILING_SLOW_REQUEST_MS) es solo del gateway Flask: aquí todas las
+    peticiones comparten el hilo del event loop.
+    """
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return web.json_response({'error': 'Unauthorized' if error == 401 else 'Not found'}, status=error)
+    try:
+        seconds = parse_seconds(request.query.get('segundos'))
+    except ValueError as e:
+        return web.json_response({'error': str(e)}, status=400)
+    counts = await asyncio.get_running_loop().run_in_executor(None, sample, seconds)
+    save('muestreo', counts)
+    return web.Response(body=folded(counts).encode(), content_type='text/plain', charset='utf-8')
+
+
+async def get_trazas(request):
+    """Trazas recientes registradas por este proceso del gateway"""
+    return web.json_response(trace_summaries())
+
+
+async def get_traza(request):
+    """Spans de una traza en el gateway y en los microservicios (?formato=texto para verlos como árbol)"""
+    trace_id = request.match_info['trace_id']
+    results = await asyncio.gather(*(fetch_json(upstream, f'/trazas/{trace_id}') for upstream in (pacientes, citas)),
+                                   return_exceptions=True)
+    spans = merge_spans(trace_spans(trace_id),
+                        *(result[1] for result in results if isinstance(result, tuple) and result[0] == 200))
+    if request.query.get('formato') == 'texto':
+        return web.Response(text=format_tree(spans))
+    return web.json_response(spans)
+
+
+async def get_expediente(request):
+    """Obtener un paciente junto con sus citas (ambos microservicios en paralelo)"""
+    id = request.match_info['id']
+    headers = read_cookie_headers(request)
+    calls = {
+        'paciente': (pacientes, fetch_json(pacientes, f'/pacientes/{id}', headers)),
+        'citas': (citas, fetch_json(citas, f'/citas/paciente/{id}', headers))
+    }
+    results = await asyncio.gather(*(call for _, call in calls.values()), return_exceptions=True)
+
+    expediente = {}
+    errores = {}
+    for (key, (upstream, _)), result in zip(calls.items(), results):
+        if isinstance(result, (*UPSTREAM_ERRORS, ValueError)):
+            expediente[key] = None
+            errores[key] = {'error': f'{upstream.label} service unavailable', 'details': str(result)}
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        status, body = result
+        if key == 'paciente' and status == 404:
+            return web.json_response(body, status=404)
+        if status != 200:
+            expediente[key] = None
+            errores[key] = {'error': f'{upstream.label} service error', 'status': status, 'details': body}
+            continue
+        expediente[key] = body
+
+    if errores:
+        expediente['parcial'] = True
+        expediente['errores'] = errores
+    return web.json_response(expediente, status=503 if len(errores) == len(calls) else 200)
+
+
+def create_app():
+    app = web.Application(middlewares=[record_metrics, trace_requests, compress_responses])
+    for upstream in (pacientes, citas):
+        app.on_startup.append(upstream.start)
+        app.on_cleanup.append(upstream.close)
+
+    app.router.add_get('/health', health)
+    app.router.add_get('/metrics', metrics)
+    app.router.add_get('/perfil', get_perfil)
+    app.router.add_get('/trazas', get_trazas)
+    app.router.add_get('/trazas/{trace_id}', get_traza)
+
+    # ==================== RUTAS PARA PACIENTES ====================
+    app.router.add_get('/api/pacientes', proxy(pacientes))
+    app.router.add_get('/api/pacientes/export', proxy(pacientes))
+    app.router.add_get(r'/api/pacientes/{id:\d+}', cached(pacientes, 'paciente'))
+    app.router.add_get(r'/api/pacientes/{id:\d+}/expediente', get_expediente)
+    app.router.add_post('/api/pacientes', proxy(pacientes))
+    app.router.add_post('/api/pacientes/bulk', proxy(pacientes, on_response=invalidate_all('paciente')))
+    app.router.add_put(r'/api/pacientes/{id:\d+}', proxy(pacientes, on_response=invalidate_entry('paciente')))
+    app.router.add_delete(r'/api/pacientes/{id:\d+}', proxy(pacientes, on_response=invalidate_entry('paciente')))
+
+    # ==================== RUTAS PARA CITAS ====================
+    app.router.add_get('/api/citas', proxy(citas))
+    app.router.add_get('/api/citas/export', proxy(citas))
+    app.router.add_get('/api/citas/disponibilidad', proxy(citas))
+    app.router.add_get(r'/api/citas/{id:\d+}', cached(citas, 'cita'))
+    app.router.add_get(r'/api/citas/paciente/{paciente_id:\d+}', proxy(citas))
+    app.router.add_post('/api/citas', proxy(citas))
+    app.router.add_post('/api/citas/bulk', proxy(citas))
+    app.router.add_put(r'/api/citas/{id:\d+}', proxy(citas, on_response=invalidate_entry('cita')))
+    app.router.add_delete(r'/api/citas/{id:\d+}', proxy(citas, on_response=invalidate_entry('cita')))
+    return app
+
+
+app = create_app()
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    web.run_app(app, host='0.0.0.0', port=port)
@@ -0,0 +1,15 @@
+# Configuración de gunicorn para el API Gateway
+# GATEWAY_RUNTIME=sync (Flask, por defecto) o async (aiohttp)
+import os
+
+runtime = os.getenv('GATEWAY_RUNTIME', 'sync')
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GATEWAY_WORKERS', 2))
+timeout = 120
+
+if runtime == 'async':
+    wsgi_app = 'async_app:app'
+    worker_class = 'aiohttp.GunicornWebWorker'
+else:
+    wsgi_app = 'app:app'
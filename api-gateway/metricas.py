@@ -0,0 +1,288 @@
+"""Métricas por ruta: peticiones, códigos de estado y latencia
+
+Cada proceso (worker de gunicorn) guarda sus histogramas en memoria y los
+expone en /metrics, como JSON (con p50/p95/p99 estimados) o en el formato de
+texto de Prometheus. Los servicios registran además las consultas SQL y su
+tiempo en cada petición, y el gateway el tiempo de sus llamadas a los
+microservicios. Cada observación es una búsqueda binaria y unas sumas bajo
+un lock, así el costo por petición es de unos microsegundos.
+"""
+import bisect
+import os
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, has_request_context, request
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+LATENCY_BUCKETS = tuple(float(value) for value in os.getenv(
+    'METRICS_LATENCY_BUCKETS', '0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10').split(','))
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUANTILES = (0.5, 0.95, 0.99)
+UNMATCHED_ROUTE = 'sin_ruta'
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Histograma con límites fijos, como los de Prometheus (el último intervalo es +Inf)"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Cuantil q interpolado dentro de su intervalo (igual que histogram_quantile)"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def summary(self, scale=1):
+        """Cantidad, media y cuantiles (multiplicados por scale, p. ej. 1000 para ms)"""
+        stats = {'count': self.count, 'mean': round(self.sum / self.count * scale, 3) if self.count else None}
+        for q in QUANTILES:
+            value = self.quantile(q)
+            stats[f'p{round(q * 100)}'] = None if value is None else round(value * scale, 3)
+        return stats
+
+
+class Registry:
+    """Contadores e histogramas del proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)           # (ruta, método, estado)
+        self.latency = {}                          # (ruta, método) -> segundos por petición
+        self.db_queries = {}                       # (ruta, método) -> consultas SQL por petición
+        self.db_seconds = {}                       # (ruta, método) -> segundos de SQL por petición
+        self.upstream_requests = defaultdict(int)  # (microservicio, método, estado)
+        self.upstream_latency = {}                 # (microservicio, método) -> segundos por llamada
+
+    @staticmethod
+    def _histogram(table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    def observe_request(self, route, method, status, seconds, queries=None, db_seconds=None):
+        key = (route, method)
+        with self._lock:
+            self.requests[(route, method, status)] += 1
+            self._histogram(self.latency, key, LATENCY_BUCKETS).observe(seconds)
+            if queries is not None:
+                self._histogram(self.db_queries, key, QUERY_COUNT_BUCKETS).observe(queries)
+                self._histogram(self.db_seconds, key, LATENCY_BUCKETS).observe(db_seconds)
+
+    def observe_upstream(self, upstream, method, status, seconds):
+        with self._lock:
+            self.upstream_requests[(upstream, method, status)] += 1
+            self._histogram(self.upstream_latency, (upstream, method), LATENCY_BUCKETS).observe(seconds)
+
+
+registry = Registry()
+
+
+def observe_upstream(upstream, method, status, seconds):
+    """Registrar una llamada del gateway a un microservicio ('error' si no hubo respuesta)"""
+    if METRICS_ENABLED:
+        registry.observe_upstream(upstream, method, status, seconds)
+
+
+def observe_request(route, method, status, seconds, queries=None, db_seconds=None):
+    if METRICS_ENABLED:
+        registry.observe_request(route, method, status, seconds, queries, db_seconds)
+
+
+# ==================== FLASK Y SQLALCHEMY ====================
+
+_queries_tracked = False
+
+
+def _track_queries():
+    """Contar las consultas SQL y su tiempo en la petición en curso (todas las engines)"""
+    global _queries_tracked
+    if _queries_tracked:
+        return
+    _queries_tracked = True
+    # Solo los servicios usan SQLAlchemy; el gateway no tiene sentencias.py
+    from sentencias import on_query
+
+    def end_query(conn, cursor, statement, parameters, context, executemany, seconds):
+        if has_request_context() and 'db_queries' in g:
+            g.db_queries += 1
+            g.db_seconds += seconds
+
+    on_query(after=end_query)
+
+
+def init_metrics(app, database=False):
+    """Registrar latencia, estado y (con database=True) consultas SQL de cada petición
+
+    La petición se mide hasta que termina su contexto, así las respuestas
+    por streaming (exportaciones) incluyen el envío completo.
+    """
+    if not METRICS_ENABLED:
+        return
+    if database:
+        _track_queries()
+
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        if database:
+            g.db_queries = 0
+            g.db_seconds = 0.0
+
+    @app.after_request
+    def keep_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else UNMATCHED_ROUTE
+        observe_request(route, request.method, g.get('metrics_status', 500), time.perf_counter() - started,
+                        g.get('db_queries'), g.get('db_seconds'))
+
+
+# ==================== EXPOSICIÓN ====================
+
+def prometheus_requested(accept, format_arg=None):
+    """Si /metrics debe responder en texto de Prometheus en lugar de JSON
+
+    Prometheus pide text/plain u OpenMetrics en Accept; también se puede forzar con ?format=prometheus.
+    """
+    if format_arg is not None:
+        return format_arg == 'prometheus'
+    qualities = {}
+    for part in (accept or '').split(','):
+        media_type, _, params = part.strip().partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.strip().lower()
+        qualities[media_type] = max(quality, qualities.get(media_type, 0.0))
+    text = max(qualities.get('text/plain', 0.0), qualities.get('application/openmetrics-text', 0.0))
+    return text > qualities.get('application/json', 0.0)
+
+
+def route_stats():
+    """Resumen por ruta para el JSON de /metrics (latencias en ms)"""
+    with registry._lock:
+        routes = {}
+        for (route, method, status), count in registry.requests.items():
+            routes.setdefault(f'{method} {route}', {'status': {}})['status'][str(status)] = count
+        for (route, method), histogram in registry.latency.items():
+            stats = routes[f'{method} {route}']
+            stats['latency_ms'] = histogram.summary(1000)
+            if (route, method) in registry.db_queries:
+                stats['db'] = {
+                    'queries': round(registry.db_queries[(route, method)].sum),
+                    'queries_per_request': registry.db_queries[(route, method)].summary(),
+                    'time_ms': registry.db_seconds[(route, method)].summary(1000)
+                }
+        return routes
+
+
+def upstream_stats():
+    """Resumen de las llamadas del gateway por microservicio y método (latencias en ms)"""
+    with registry._lock:
+        calls = {}
+        for (upstream, method, status), count in registry.upstream_requests.items():
+            calls.setdefault(f'{method} {upstream}', {'status': {}})['status'][str(status)] = count
+        for (upstream, method), histogram in registry.upstream_latency.items():
+            calls[f'{method} {upstream}']['latency_ms'] = histogram.summary(1000)
+        return calls
+
+
+def gauges(prefix, stats, **labels):
+    """Valores numéricos de primer nivel de un diccionario de estadísticas como gauges"""
+    return [(f'{prefix}_{name}', float(value), labels) for name, value in stats.items()
+            if isinstance(value, (int, float))]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _histogram_lines(name, histogram, labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(dict(labels, le=f"{bound:g}"))} {cumulative}')
+    lines.append(f'{name}_bucket{_labels(dict(labels, le="+Inf"))} {histogram.count}')
+    lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+    lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+    return lines
+
+
+def render_prometheus(app_name, extra_gauges=()):
+    """Métricas del proceso en el formato de texto de Prometheus"""
+    app = {'app': app_name}
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        if not samples:
+            return
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+
+    with registry._lock:
+        family('http_requests_total', 'counter', 'Peticiones atendidas por ruta, método y estado', [
+            f'http_requests_total{_labels(dict(app, route=route, method=method, status=status))} {count}'
+            for (route, method, status), count in registry.requests.items()])
+        for name, table, help_text in (
+                ('http_request_duration_seconds', registry.latency, 'Latencia de las peticiones por ruta'),
+                ('db_queries_per_request', registry.db_queries, 'Consultas SQL por petición'),
+                ('db_query_duration_seconds', registry.db_seconds, 'Tiempo total de SQL por petición')):
+            family(name, 'histogram', help_text, [
+                line for (route, method), histogram in table.items()
+                for line in _histogram_lines(name, histogram, dict(app, route=route, method=method))])
+        family('upstream_requests_total', 'counter', 'Llamadas a los microservicios por estado', [
+            f'upstream_requests_total{_labels(dict(app, upstream=upstream, method=method, status=status))} {count}'
+            for (upstream, method, status), count in registry.upstream_requests.items()])
+        family('upstream_request_duration_seconds', 'histogram', 'Tiempo hasta la respuesta del microservicio', [
+            line for (upstream, method), histogram in registry.upstream_latency.items()
+            for line in _histogram_lines('upstream_request_duration_seconds', histogram,
+                                         dict(app, upstream=upstream, method=method))])
+
+    samples = defaultdict(list)
+    for name, value, labels in extra_gauges:
+        samples[name].append(f'{name}{_labels(dict(app, **labels))} {value}')
+    for name, values in samples.items():
+        family(name, 'gauge', 'Estadística del proceso (ver el JSON de /metrics)', values)
+    return '\n'.join(lines) + '\n'
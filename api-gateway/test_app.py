@@ -0,0 +1,339 @@
+import pytest
+import sys
+import os
+import asyncio
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+# Agregar el directorio del gateway al path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Microservicio simulado: los dos clientes del gateway apuntan a él antes de importar las apps
+stub = Flask('stub')
+stub_server = make_server('127.0.0.1', 0, stub, threaded=True)
+threading.Thread(target=stub_server.serve_forever, daemon=True).start()
+os.environ['PACIENTES_SERVICE_URL'] = os.environ['CITAS_SERVICE_URL'] = f'http://127.0.0.1:{stub_server.server_port}'
+
+import aiohttp
+from aiohttp.test_utils import TestClient, TestServer
+
+import app as gateway
+import async_app
+
+pacientes = {}
+citas = {}
+# Servicio -> código de error con que responde ('pacientes' o 'citas'), o 'lento' para responder
+# después del timeout de lectura del gateway; 'cortar' corta la exportación
+fallas = {}
+llamadas = Counter()
+# Si está en la lista, la importación se detiene después de la primera fila hasta que se active
+pausas = []
+
+
+def paciente_response(paciente):
+    response = jsonify(paciente)
+    response.set_etag(f"{paciente['id']}-{paciente['version']}")
+    response.last_modified = paciente['updated_at']
+    return response
+
+
+@stub.before_request
+def simular_falla():
+    llamadas[f'{request.method} {request.path}'] += 1
+    servicio = request.path.split('/')[1]
+    if fallas.get(servicio) == 'lento':
+        time.sleep(0.5)
+    elif servicio in fallas:
+        return jsonify({'error': 'Error interno'}), fallas[servicio]
+
+
+@stub.route('/pacientes/<int:id>', methods=['GET'])
+def stub_get_paciente(id):
+    if id not in pacientes:
+        return jsonify({'error': 'Paciente no encontrado'}), 404
+    return paciente_response(pacientes[id])
+
+
+@stub.route('/pacientes/<int:id>', methods=['PUT'])
+def stub_update_paciente(id):
+    pacientes[id].update(request.get_json(), version=pacientes[id]['version'] + 1, updated_at=datetime.utcnow())
+    return paciente_response(pacientes[id])
+
+
+@stub.route('/pacientes/<int:id>', methods=['DELETE'])
+def stub_delete_paciente(id):
+    del pacientes[id]
+    return jsonify({'message': 'Paciente eliminado exitosamente'})
+
+
+@stub.route('/pacientes/bulk', methods=['POST'])
+def stub_import_pacientes():
+    rows = request.get_json()
+    por_cedula = {paciente['cedula']: paciente for paciente in pacientes.values()}
+
+    def generate():
+        for fila, row in enumerate(rows):
+            if fila == 1 and pausas:
+                pausas[0].wait(5)
+            paciente = por_cedula[row['cedula']]
+            paciente.update(row, version=paciente['version'] + 1, updated_at=datetime.utcnow())
+            yield f'{{"fila": {fila}, "id": {paciente["id"]}, "resultado": "actualizado"}}\n'
+        yield f'{{"resumen": {{"actualizados": {len(rows)}}}}}\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@stub.route('/citas/paciente/<int:paciente_id>', methods=['GET'])
+def stub_get_citas_paciente(paciente_id):
+    return jsonify([cita for cita in citas.values() if cita['paciente_id'] == paciente_id])
+
+
+@stub.route('/citas/export', methods=['GET'])
+def stub_export_citas():
+    def generate():
+        yield '{"id": 1}\n' * 1000
+        if fallas.get('cortar'):
+            raise RuntimeError('Conexión con la base de datos perdida')
+        yield '{"id": 2}\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+@pytest.fixture(autouse=True)
+def stub_state():
+    """Datos del microservicio simulado y cachés vacías en cada test"""
+    pacientes.clear()
+    citas.clear()
+    fallas.clear()
+    llamadas.clear()
+    pausas.clear()
+    pacientes[1] = {'id': 1, 'nombre': 'Juan', 'cedula': '1234567890', 'telefono': '3001234567',
+                    'version': 1, 'updated_at': datetime(2026, 1, 5, 10, 0)}
+    pacientes[2] = {'id': 2, 'nombre': 'María', 'cedula': '0987654321', 'telefono': '3009876543',
+                    'version': 1, 'updated_at': datetime(2026, 1, 5, 10, 0)}
+    citas[1] = {'id': 1, 'paciente_id': 1, 'medico': 'Dr. López'}
+    for cache in (gateway.response_cache, async_app.response_cache):
+        cache.invalidate_prefix('')
+    yield
+
+
+@pytest.fixture
+def client():
+    """Cliente de prueba del gateway Flask"""
+    gateway.app.config['TESTING'] = True
+    with gateway.app.test_client() as client:
+        yield client
+
+
+def run_async(test):
+    """Ejecutar test(cliente) contra el gateway asíncrono"""
+    async def main():
+        async with TestClient(TestServer(async_app.create_app())) as async_client:
+            await test(async_client)
+    asyncio.run(main())
+
+
+def test_async_export_cortado():
+    """Test que una exportación cortada por el microservicio no llega al cliente como completa"""
+    fallas['cortar'] = True
+
+    async def test(async_client):
+        response = await async_client.get('/api/citas/export')
+        assert response.status == 200
+        with pytest.raises(aiohttp.ClientPayloadError):
+            await response.read()
+
+    run_async(test)
+
+
+def test_cache_hit_miss_ttl(client, monkeypatch):
+    """Test de la caché de lectura: MISS, HIT sin llamar al microservicio y expiración por TTL"""
+    response = client.get('/api/pacientes/1')
+    assert response.status_code == 200
+    assert response.headers['X-Cache'] == 'MISS'
+    assert client.get('/api/pacientes/1').headers['X-Cache'] == 'HIT'
+    assert llamadas['GET /pacientes/1'] == 1
+
+    monkeypatch.setattr(gateway.response_cache, 'ttl', 0.05)
+    gateway.response_cache.invalidate_prefix('')
+    client.get('/api/pacientes/1')
+    time.sleep(0.1)
+    assert client.get('/api/pacientes/1').headers['X-Cache'] == 'MISS'
+    assert gateway.response_cache.stats()['expirations'] == 1
+
+    # Los errores no se guardan
+    assert client.get('/api/pacientes/3').status_code == 404
+    assert client.get('/api/pacientes/3').headers['X-Cache'] == 'MISS'
+
+
+def test_cache_invalidacion(client):
+    """Test que PUT y DELETE por el gateway invalidan la entrada del id"""
+    client.get('/api/pacientes/1')
+    client.put('/api/pacientes/1', json={'telefono': '3000000000'})
+    response = client.get('/api/pacientes/1')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['telefono'] == '3000000000'
+
+    client.delete('/api/pacientes/1')
+    assert client.get('/api/pacientes/1').status_code == 404
+
+
+def test_cache_condicional(client):
+    """Test de 304 con If-None-Match e If-Modified-Since, desde la caché y sin ella"""
+    response = client.get('/api/pacientes/1')
+    etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+    for headers in ({'If-None-Match': etag}, {'If-None-Match': f'W/{etag}'}, {'If-Modified-Since': last_modified}):
+        response = client.get('/api/pacientes/1', headers=headers)
+        assert response.status_code == 304
+        assert response.headers['X-Cache'] == 'HIT'
+    assert client.get('/api/pacientes/1', headers={'If-None-Match': '"otro"'}).status_code == 200
+    assert client.get('/api/pacientes/1', headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}).status_code == 200
+
+    client.put('/api/pacientes/1', json={'telefono': '3000000000'})
+    response = client.get('/api/pacientes/1', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_async_cache(monkeypatch):
+    """Test de la caché del gateway asíncrono: MISS/HIT, TTL, invalidación y 304"""
+    async def test(async_client):
+        response = await async_client.get('/api/pacientes/1')
+        assert response.headers['X-Cache'] == 'MISS'
+        etag, last_modified = response.headers['ETag'], response.headers['Last-Modified']
+        assert (await async_client.get('/api/pacientes/1')).headers['X-Cache'] == 'HIT'
+        assert llamadas['GET /pacientes/1'] == 1
+
+        for headers in ({'If-None-Match': etag}, {'If-Modified-Since': last_modified}):
+            response = await async_client.get('/api/pacientes/1', headers=headers)
+            assert response.status == 304
+            assert response.headers['X-Cache'] == 'HIT'
+        response = await async_client.get('/api/pacientes/1', headers={'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+        assert response.status == 200
+
+        await async_client.put('/api/pacientes/1', json={'telefono': '3000000000'})
+        response = await async_client.get('/api/pacientes/1', headers={'If-None-Match': etag})
+        assert response.status == 200
+        assert response.headers['X-Cache'] == 'MISS'
+        assert (await response.json())['telefono'] == '3000000000'
+
+        monkeypatch.setattr(async_app.response_cache, 'ttl', 0.05)
+        async_app.response_cache.invalidate_prefix('')
+        await async_client.get('/api/pacientes/1')
+        await asyncio.sleep(0.1)
+        assert (await async_client.get('/api/pacientes/1')).headers['X-Cache'] == 'MISS'
+
+        await async_client.delete('/api/pacientes/1')
+        assert (await async_client.get('/api/pacientes/1')).status == 404
+
+    run_async(test)
+
+
+IMPORTACION = [{'cedula': '0987654321', 'telefono': '3100000000'}, {'cedula': '1234567890', 'telefono': '3200000000'}]
+
+
+def test_importacion_invalida_cache(client):
+    """Test que un GET durante la importación no deja en la caché la versión anterior"""
+    client.get('/api/pacientes/1')
+    pausas.append(threading.Event())
+    response = client.post('/api/pacientes/bulk?on_conflict=update', json=IMPORTACION, buffered=False)
+    assert response.status_code == 200
+    # La importación sigue en curso: este GET vuelve a guardar el paciente 1 sin actualizar
+    assert client.get('/api/pacientes/1').get_json()['telefono'] == '3001234567'
+    pausas[0].set()
+    assert b'"resumen"' in response.get_data()
+    response.close()
+
+    response = client.get('/api/pacientes/1')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert response.get_json()['telefono'] == '3200000000'
+
+
+def test_async_importacion_invalida_cache():
+    """Test que el gateway asíncrono invalida la caché también al terminar la importación"""
+    async def test(async_client):
+        await async_client.get('/api/pacientes/1')
+        pausas.append(threading.Event())
+        response = await async_client.post('/api/pacientes/bulk?on_conflict=update', json=IMPORTACION)
+        assert response.status == 200
+        assert (await (await async_client.get('/api/pacientes/1')).json())['telefono'] == '3001234567'
+        pausas[0].set()
+        assert b'"resumen"' in await response.read()
+
+        response = await async_client.get('/api/pacientes/1')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert (await response.json())['telefono'] == '3200000000'
+
+    run_async(test)
+
+
+def test_expediente(client):
+    """Test del expediente completo y del 404 si el paciente no existe"""
+    data = client.get('/api/pacientes/1/expediente').get_json()
+    assert data['paciente']['telefono'] == '3001234567'
+    assert data['citas'] == [citas[1]]
+    assert 'parcial' not in data
+
+    response = client.get('/api/pacientes/3/expediente')
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Paciente no encontrado'
+
+
+def test_expediente_parcial(client, monkeypatch):
+    """Test del resultado parcial con un microservicio en error o sin responder a tiempo"""
+    fallas['citas'] = 500
+    response = client.get('/api/pacientes/1/expediente')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['parcial'] is True
+    assert data['paciente']['id'] == 1
+    assert data['citas'] is None
+    assert data['errores']['citas']['error'] == 'Citas service error'
+    assert data['errores']['citas']['status'] == 500
+
+    fallas['citas'] = 'lento'
+    monkeypatch.setattr(gateway.citas_client, 'timeout', (1, 0.1))
+    data = client.get('/api/pacientes/1/expediente').get_json()
+    assert data['parcial'] is True
+    assert data['paciente']['id'] == 1
+    assert data['errores']['citas']['error'] == 'Citas service unavailable'
+
+    # Si fallan los dos no hay nada que devolver
+    fallas['pacientes'] = 503
+    response = client.get('/api/pacientes/1/expediente')
+    assert response.status_code == 503
+    assert set(response.get_json()['errores']) == {'paciente', 'citas'}
+
+
+def test_async_expediente(monkeypatch):
+    """Test del expediente en el gateway asíncrono: completo, parcial, timeout y 404"""
+    monkeypatch.setattr(async_app, 'UPSTREAM_READ_TIMEOUT', 0.1)
+
+    async def test(async_client):
+        data = await (await async_client.get('/api/pacientes/1/expediente')).json()
+        assert data['citas'] == [citas[1]]
+        assert 'parcial' not in data
+        assert (await async_client.get('/api/pacientes/3/expediente')).status == 404
+
+        fallas['citas'] = 500
+        response = await async_client.get('/api/pacientes/1/expediente')
+        assert response.status == 200
+        data = await response.json()
+        assert data['parcial'] is True
+        assert data['paciente']['id'] == 1
+        assert data['errores']['citas']['status'] == 500
+
+        fallas['citas'] = 'lento'
+        data = await (await async_client.get('/api/pacientes/1/expediente')).json()
+        assert data['paciente']['id'] == 1
+        assert data['errores']['citas']['error'] == 'Citas service unavailable'
+
+        fallas['pacientes'] = 503
+        assert (await async_client.get('/api/pacientes/1/expediente')).status == 503
+
+    run_async(test)
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metricas import observe_upstream
+from trazas import current_span, end_span, start_span
+
+# Configuración del pool de conexiones hacia los microservicios
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 10))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))
+UPSTREAM_KEEP_ALIVE = os.getenv('UPSTREAM_KEEP_ALIVE', 'true').lower() == 'true'
+
+
+class UpstreamClient:
+    """Cliente HTTP con pool de conexiones keep-alive hacia un microservicio.
+
+    Cada proceso (worker de gunicorn) mantiene su propia sesión: si el
+    proceso hace fork después de crear el cliente, la sesión se recrea
+    para no compartir sockets entre workers.
+    """
+
+    def __init__(self, name, base_url, pool_size=UPSTREAM_POOL_SIZE,
+                 connect_timeout=UPSTREAM_CONNECT_TIMEOUT,
+                 read_timeout=UPSTREAM_READ_TIMEOUT,
+                 keep_alive=UPSTREAM_KEEP_ALIVE):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    def _new_session(self):
+        session = requests.Session()
+        # La sesión es compartida por todos los clientes del worker: nunca guarda
+        # cookies de los microservicios (el gateway reenvía las de cada cliente)
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=False)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    self._session = self._new_session()
+                    self._pid = os.getpid()
+        return self._session
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        # El cuerpo se lee bajo demanda; quien llama debe consumirlo o cerrar la respuesta
+        kwargs.setdefault('stream', True)
+        url = f'{self.base_url}{path}'
+        # Span de cliente dentro de la traza de la petición en curso, propagado con traceparent
+        client_span = None
+        if current_span() is not None:
+            client_span = start_span(f'{method} {self.name}', 'client', attributes={
+                'http.method': method, 'http.url': url, 'peer.service': self.name})
+            traceparent = client_span.traceparent()
+            if traceparent:
+                kwargs['headers'] = dict(kwargs.get('headers') or {}, traceparent=traceparent)
+        # Tiempo hasta recibir las cabeceras (el cuerpo se transmite después)
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException as e:
+            observe_upstream(self.name, method, 'error', time.perf_counter() - started)
+            if client_span is not None:
+                end_span(client_span, e)
+            raise
+        observe_upstream(self.name, method, response.status_code, time.perf_counter() - started)
+        if client_span is not None:
+            client_span.set('http.status_code', response.status_code)
+            end_span(client_span)
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    def stats(self):
+        """Estadísticas del pool: peticiones servidas y conexiones nuevas"""
+        requests_total = 0
+        connections_total = 0
+        idle = 0
+        if self._session is not None and self._pid == os.getpid():
+            adapter = self._session.get_adapter(self.base_url)
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                requests_total += pool.num_requests
+                connections_total += pool.num_connections
+                if pool.pool is not None:
+                    idle += sum(1 for conn in list(pool.pool.queue) if conn is not None)
+        return {
+            'base_url': self.base_url,
+            'pool_size': self.pool_size,
+            'requests': requests_total,
+            'new_connections': connections_total,
+            'pool_hits': max(requests_total - connections_total, 0),
+            'idle_connections': idle,
+            'keep_alive': self.keep_alive,
+            'timeout': {'connect': self.timeout[0], 'read': self.timeout[1]}
+        }
@@ -0,0 +1,105 @@
+"""
+Prueba de estrés de reservas concurrentes
+
+N clientes en paralelo intentan reservar (estado confirmada) los mismos
+horarios de unos pocos médicos. Al terminar se descargan las citas creadas
+y se verifica que ningún médico tenga dos citas confirmadas solapadas.
+
+Uso:
+    python benchmarks/booking_stress.py --url http://localhost:5000/api --clientes 32 --reservas 2000
+"""
+import argparse
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000/api', help='URL base (gateway /api o servicio de citas)')
+    parser.add_argument('--clientes', type=int, default=32, help='Clientes en paralelo')
+    parser.add_argument('--reservas', type=int, default=2000, help='Total de intentos de reserva')
+    parser.add_argument('--medicos', type=int, default=4, help='Médicos distintos')
+    parser.add_argument('--horarios', type=int, default=20, help='Horarios por médico')
+    parser.add_argument('--duracion', type=int, default=30, help='Duración de cada cita (minutos)')
+    return parser.parse_args()
+
+
+def build_attempts(args, run_id):
+    """Intentos de reserva: muchos más que horarios, para forzar la contención"""
+    base = (datetime.utcnow() + timedelta(days=30)).replace(hour=8, minute=0, second=0, microsecond=0)
+    medicos = [f'Dr. Estrés {run_id} #{n}' for n in range(args.medicos)]
+    # Los inicios se desplazan media duración para que también haya solapes parciales
+    inicios = [base + timedelta(minutes=args.duracion * n // 2) for n in range(args.horarios)]
+    return [
+        {
+            'paciente_id': random.randint(1, 1000),
+            'fecha_hora': random.choice(inicios).strftime('%Y-%m-%d %H:%M:%S'),
+            'especialidad': 'Medicina General',
+            'medico': random.choice(medicos),
+            'duracion_minutos': args.duracion,
+            'estado': 'confirmada'
+        }
+        for _ in range(args.reservas)
+    ], set(medicos)
+
+
+def main():
+    args = parse_args()
+    run_id = uuid.uuid4().hex[:8]
+    attempts, medicos = build_attempts(args, run_id)
+    session = requests.Session()
+    session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=args.clientes))
+
+    def book(cita):
+        started = time.perf_counter()
+        try:
+            status = session.post(f'{args.url}/citas', json=cita, timeout=30).status_code
+        except requests.exceptions.RequestException:
+            status = 'error'
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clientes) as executor:
+        results = list(executor.map(book, attempts))
+    elapsed = time.perf_counter() - started
+
+    statuses = Counter(status for status, _ in results)
+    latencies = sorted(latency for _, latency in results)
+
+    # Citas confirmadas de los médicos de esta ejecución
+    response = session.get(f'{args.url}/citas/export', params={'format': 'ndjson'}, stream=True, timeout=300)
+    booked = {}
+    for line in response.iter_lines():
+        cita = json.loads(line)
+        if cita['medico'] in medicos and cita['estado'] == 'confirmada':
+            start = datetime.fromisoformat(cita['fecha_hora'])
+            booked.setdefault(cita['medico'], []).append((start, start + timedelta(minutes=cita['duracion_minutos'])))
+
+    double_bookings = 0
+    for intervals in booked.values():
+        intervals.sort()
+        for (_, previous_end), (start, _) in zip(intervals, intervals[1:]):
+            if start < previous_end:
+                double_bookings += 1
+
+    print('=' * 60)
+    print(f'Clientes en paralelo:  {args.clientes}')
+    print(f'Intentos de reserva:   {len(attempts)} en {elapsed:.2f} s ({len(attempts) / elapsed:.0f} req/s)')
+    print(f'Latencia p50 / p99:    {latencies[len(latencies) // 2] * 1000:.1f} ms / '
+          f'{latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms')
+    print(f'Respuestas:            {dict(statuses)}')
+    print(f'Citas confirmadas:     {sum(len(intervals) for intervals in booked.values())}')
+    print(f'Reservas solapadas:    {double_bookings}')
+    print('=' * 60)
+    return 1 if double_bookings else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,562 @@
+"""
+Prueba de carga reproducible del stack completo
+
+Tres pasos:
+
+    sembrar   crea el esquema (migraciones) y carga N pacientes y M citas
+              directamente en la base de datos, en lotes y con una semilla
+              fija, así dos corridas parten de los mismos datos.
+    ejecutar  lanza una mezcla de lecturas y escrituras contra el gateway o
+              contra un servicio, con cada nivel de concurrencia durante un
+              tiempo fijo, y escribe throughput y percentiles de latencia
+              (totales y por operación) como JSON.
+    comparar  compara dos resultados de `ejecutar` y termina con código 1 si
+              el throughput baja o la latencia p95/p99 sube más que la
+              tolerancia.
+
+Funciona con PostgreSQL o con SQLite como sustituto local. Con --levantar,
+`ejecutar` arranca los servicios y el gateway con gunicorn sobre esa base
+de datos y los detiene al terminar.
+
+Cada cliente espera su respuesta antes de enviar la siguiente petición
+(lazo cerrado), así la concurrencia es el número de peticiones en vuelo.
+
+Uso:
+    python benchmarks/carga.py sembrar --database-url sqlite:////tmp/carga.db --pacientes 100000 --citas 1000000
+    python benchmarks/carga.py ejecutar --levantar --database-url sqlite:////tmp/carga.db \\
+        --pacientes 100000 --citas 1000000 --mezcla mixta --concurrencia 1,8,32 --salida actual.json
+    python benchmarks/carga.py ejecutar --objetivo citas --url http://localhost:5002 --citas 1000000
+    python benchmarks/carga.py comparar base.json actual.json --tolerancia 10
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ESPECIALIDADES = ['Medicina General', 'Cardiología', 'Pediatría', 'Dermatología',
+                  'Ginecología', 'Traumatología', 'Oftalmología', 'Neurología']
+CITAS_POR_MEDICO = 5000
+MEDICO = 'Dr. Carga #{:04d}'
+
+DEFAULT_URLS = {
+    'gateway': 'http://localhost:5000/api',
+    'pacientes': 'http://localhost:5001',
+    'citas': 'http://localhost:5002'
+}
+
+# Pesos de cada operación en las mezclas (solo se usan las que atiende el objetivo)
+MEZCLAS = {
+    'lectura': {
+        'listar_pacientes': 10, 'ver_paciente': 25, 'listar_citas': 10, 'ver_cita': 25,
+        'citas_paciente': 15, 'disponibilidad': 5, 'expediente': 10,
+        'crear_cita': 3, 'actualizar_cita': 1, 'crear_paciente': 1
+    },
+    'mixta': {
+        'listar_pacientes': 8, 'ver_paciente': 20, 'listar_citas': 8, 'ver_cita': 20,
+        'citas_paciente': 10, 'disponibilidad': 4, 'expediente': 10,
+        'crear_cita': 10, 'actualizar_cita': 5, 'crear_paciente': 3, 'actualizar_paciente': 2
+    },
+    'escritura': {
+        'ver_paciente': 15, 'ver_cita': 15, 'citas_paciente': 10, 'expediente': 10,
+        'crear_cita': 25, 'actualizar_cita': 10, 'crear_paciente': 10, 'actualizar_paciente': 5
+    }
+}
+
+# ==================== SIEMBRA ====================
+
+SEED_PACIENTES = '''
+import json, random, sys, time
+from datetime import date, datetime, timedelta
+import app
+
+params = json.loads(sys.argv[1])
+rng = random.Random(params['semilla'])
+nombres = ['Ana', 'Luis', 'María', 'Carlos', 'Lucía', 'Jorge', 'Sofía', 'Andrés', 'Valentina', 'Diego']
+apellidos = ['García', 'Rodríguez', 'Martínez', 'López', 'Gómez', 'Pérez', 'Sánchez', 'Ramírez', 'Torres', 'Díaz']
+ahora = datetime.utcnow().replace(microsecond=0)
+started = time.perf_counter()
+with app.app.app_context():
+    table = app.Paciente.__table__
+    if params['reiniciar']:
+        if app.db.engine.dialect.name == 'postgresql':
+            app.db.session.execute(app.db.text(f'TRUNCATE TABLE {table.name} RESTART IDENTITY'))
+        else:
+            app.db.session.execute(table.delete())
+        app.db.session.commit()
+    for inicio in range(0, params['total'], params['lote']):
+        app.db.session.execute(app.db.insert(table), [{
+            'nombre': rng.choice(nombres),
+            'apellido': rng.choice(apellidos),
+            'cedula': f'{n + 1:010d}',
+            'fecha_nacimiento': date(1940, 1, 1) + timedelta(days=rng.randrange(365 * 80)),
+            'telefono': f'300{rng.randrange(10 ** 7):07d}',
+            'email': f'paciente{n + 1}@example.com',
+            'direccion': f'Calle {rng.randrange(1, 200)} # {rng.randrange(1, 100)}-{rng.randrange(1, 100)}',
+            'created_at': ahora,
+            'updated_at': ahora
+        } for n in range(inicio, min(inicio + params['lote'], params['total']))])
+        app.db.session.commit()
+print(json.dumps({'filas': params['total'], 'segundos': time.perf_counter() - started}))
+'''
+
+SEED_CITAS = '''
+import json, random, sys, time
+from datetime import datetime, timedelta
+import app
+
+params = json.loads(sys.argv[1])
+rng = random.Random(params['semilla'])
+ahora = datetime.utcnow().replace(microsecond=0)
+medicos = params['medicos']
+# Cada médico atiende de lunes a viernes de 08:00 a 18:00 en turnos de 30 minutos, desde 90 días atrás
+dia = (ahora - timedelta(days=90)).replace(hour=8, minute=0, second=0)
+turnos = []
+while len(turnos) * len(medicos) < params['total']:
+    if dia.weekday() < 5:
+        turnos.extend(dia + timedelta(minutes=30 * k) for k in range(20))
+    dia += timedelta(days=1)
+
+
+def estado(fecha_hora):
+    if fecha_hora < ahora:
+        return 'completada' if rng.random() < 0.85 else 'cancelada'
+    value = rng.random()
+    return 'confirmada' if value < 0.7 else 'pendiente' if value < 0.95 else 'cancelada'
+
+
+def filas():
+    # Turno a turno y médico a médico: las confirmadas de un médico nunca se solapan
+    n = 0
+    for fecha_hora in turnos:
+        for medico, especialidad in medicos:
+            if n == params['total']:
+                return
+            n += 1
+            yield {
+                'paciente_id': rng.randint(1, params['pacientes']),
+                'fecha_hora': fecha_hora,
+                'especialidad': especialidad,
+                'medico': medico,
+                'duracion_minutos': 30,
+                'motivo': 'Control',
+                'estado': estado(fecha_hora),
+                'observaciones': None,
+                'created_at': ahora,
+                'updated_at': ahora
+            }
+
+
+started = time.perf_counter()
+with app.app.app_context():
+    table = app.Cita.__table__
+    if params['reiniciar']:
+        if app.db.engine.dialect.name == 'postgresql':
+            app.db.session.execute(app.db.text(f'TRUNCATE TABLE {table.name} RESTART IDENTITY'))
+        else:
+            app.db.session.execute(table.delete())
+        app.db.session.commit()
+    lote = []
+    for fila in filas():
+        lote.append(fila)
+        if len(lote) == params['lote']:
+            app.db.session.execute(app.db.insert(table), lote)
+            app.db.session.commit()
+            lote = []
+    if lote:
+        app.db.session.execute(app.db.insert(table), lote)
+        app.db.session.commit()
+print(json.dumps({'filas': params['total'], 'segundos': time.perf_counter() - started}))
+'''
+
+
+def seed_doctors(citas):
+    """Médicos de la siembra (nombre, especialidad): uno por cada CITAS_POR_MEDICO citas, al menos 10"""
+    return [(MEDICO.format(n), ESPECIALIDADES[n % len(ESPECIALIDADES)])
+            for n in range(max(10, -(-citas // CITAS_POR_MEDICO)))]
+
+
+def service_env(database_url, **extra):
+    return dict(os.environ, DATABASE_URL=database_url, DB_AUTO_CREATE='false', **extra)
+
+
+def migrate(servicio, database_url):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrar'],
+                   cwd=os.path.join(ROOT, servicio), env=service_env(database_url),
+                   check=True, capture_output=True)
+
+
+def run_seed(servicio, code, database_url, params):
+    output = subprocess.run(
+        [sys.executable, '-c', code, json.dumps(params)], cwd=os.path.join(ROOT, servicio),
+        env=service_env(database_url, TRACING_ENABLED='false', METRICS_ENABLED='false'),
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def sembrar(args):
+    for servicio in ('pacientes-service', 'citas-service'):
+        migrate(servicio, args.database_url)
+    common = {'semilla': args.semilla, 'lote': args.lote, 'reiniciar': args.reiniciar}
+    pacientes = run_seed('pacientes-service', SEED_PACIENTES, args.database_url,
+                         dict(common, total=args.pacientes))
+    print(f"Pacientes: {pacientes['filas']} en {pacientes['segundos']:.1f} s")
+    citas = run_seed('citas-service', SEED_CITAS, args.database_url,
+                     dict(common, total=args.citas, pacientes=args.pacientes, medicos=seed_doctors(args.citas)))
+    print(f"Citas:     {citas['filas']} en {citas['segundos']:.1f} s ({len(seed_doctors(args.citas))} médicos)")
+    return 0
+
+# ==================== OPERACIONES ====================
+
+class Workload:
+    """Peticiones de cada operación sobre los datos sembrados"""
+
+    def __init__(self, url, pacientes, citas, semilla):
+        self.url = url.rstrip('/')
+        self.pacientes = pacientes
+        self.citas = citas
+        self.medicos = seed_doctors(citas)
+        self.run_id = uuid.uuid4().hex[:8]
+        self.semilla = semilla
+        self._counter = iter(range(1, 10 ** 12))
+        self._counter_lock = threading.Lock()
+
+    def _next(self):
+        with self._counter_lock:
+            return next(self._counter)
+
+    # Cada operación devuelve (método, ruta, cuerpo JSON o None)
+    def listar_pacientes(self, rng):
+        return 'GET', '/pacientes?limit=50', None
+
+    def ver_paciente(self, rng):
+        return 'GET', f'/pacientes/{rng.randint(1, self.pacientes)}', None
+
+    def expediente(self, rng):
+        return 'GET', f'/pacientes/{rng.randint(1, self.pacientes)}/expediente', None
+
+    def listar_citas(self, rng):
+        return 'GET', '/citas?limit=50', None
+
+    def ver_cita(self, rng):
+        return 'GET', f'/citas/{rng.randint(1, self.citas)}', None
+
+    def citas_paciente(self, rng):
+        return 'GET', f'/citas/paciente/{rng.randint(1, self.pacientes)}', None
+
+    def disponibilidad(self, rng):
+        return 'GET', f'/citas/disponibilidad?especialidad={rng.choice(ESPECIALIDADES)}&limite=20', None
+
+    def crear_cita(self, rng):
+        # Pendientes en fechas lejanas: no chocan con las confirmadas ni entre sí
+        medico, especialidad = rng.choice(self.medicos)
+        fecha_hora = datetime(2090, 1, 1) + timedelta(minutes=30 * self._next())
+        return 'POST', '/citas', {
+            'paciente_id': rng.randint(1, self.pacientes),
+            'fecha_hora': fecha_hora.strftime('%Y-%m-%d %H:%M:%S'),
+            'especialidad': especialidad,
+            'medico': medico,
+            'motivo': 'Prueba de carga'
+        }
+
+    def actualizar_cita(self, rng):
+        return 'PUT', f'/citas/{rng.randint(1, self.citas)}', {'observaciones': f'Carga {self.run_id}'}
+
+    def crear_paciente(self, rng):
+        n = self._next()
+        return 'POST', '/pacientes', {
+            'nombre': 'Carga',
+            'apellido': self.run_id,
+            'cedula': f'C{self.run_id}{n:08d}',
+            'fecha_nacimiento': '1990-01-01',
+            'email': f'carga{n}@example.com'
+        }
+
+    def actualizar_paciente(self, rng):
+        return 'PUT', f'/pacientes/{rng.randint(1, self.pacientes)}', {'telefono': f'301{rng.randrange(10 ** 7):07d}'}
+
+
+OPERACIONES = {
+    'gateway': set(MEZCLAS['mixta']),
+    'pacientes': {'listar_pacientes', 'ver_paciente', 'crear_paciente', 'actualizar_paciente'},
+    'citas': {'listar_citas', 'ver_cita', 'citas_paciente', 'disponibilidad', 'crear_cita', 'actualizar_cita'}
+}
+
+
+def operations(objetivo, mezcla):
+    """(nombres, pesos) de las operaciones de la mezcla que atiende el objetivo"""
+    weights = {name: weight for name, weight in MEZCLAS[mezcla].items() if name in OPERACIONES[objetivo]}
+    return list(weights), list(weights.values())
+
+# ==================== EJECUCIÓN ====================
+
+def percentiles(latencies):
+    """Media, percentiles y máximo en ms de una lista de latencias en segundos"""
+    if not latencies:
+        return {'mean': None, 'p50': None, 'p90': None, 'p95': None, 'p99': None, 'max': None}
+    values = sorted(latencies)
+    stats = {'mean': round(sum(values) / len(values) * 1000, 3)}
+    for q in (50, 90, 95, 99):
+        stats[f'p{q}'] = round(values[min(len(values) - 1, int(len(values) * q / 100))] * 1000, 3)
+    stats['max'] = round(values[-1] * 1000, 3)
+    return stats
+
+
+def is_error(status):
+    return status == 'error' or status >= 500
+
+
+def run_level(workload, names, weights, concurrencia, duracion, calentamiento, timeout):
+    """Ejecutar la mezcla con `concurrencia` clientes: calentamiento sin medir y luego `duracion` segundos"""
+    results = []
+    results_lock = threading.Lock()
+    measure_from = time.perf_counter() + calentamiento
+    deadline = measure_from + duracion
+
+    def client(index):
+        rng = random.Random(workload.semilla * 1000 + index)
+        session = requests.Session()
+        samples = []
+        while True:
+            operation = rng.choices(names, weights)[0]
+            method, path, body = getattr(workload, operation)(rng)
+            started = time.perf_counter()
+            if started >= deadline:
+                break
+            try:
+                response = session.request(method, f'{workload.url}{path}', json=body, timeout=timeout)
+                response.content
+                status = response.status_code
+            except requests.exceptions.RequestException:
+                status = 'error'
+            if started >= measure_from:
+                samples.append((operation, status, time.perf_counter() - started))
+        session.close()
+        with results_lock:
+            results.extend(samples)
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrencia)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    by_operation = defaultdict(list)
+    for operation, status, latency in results:
+        by_operation[operation].append((status, latency))
+    return {
+        'concurrencia': concurrencia,
+        'peticiones': len(results),
+        'errores': sum(1 for _, status, _ in results if is_error(status)),
+        'throughput': round(len(results) / duracion, 2),
+        'latencia_ms': percentiles([latency for _, _, latency in results]),
+        'operaciones': {
+            operation: {
+                'peticiones': len(samples),
+                'estados': dict(Counter(str(status) for status, _ in samples)),
+                'latencia_ms': percentiles([latency for _, latency in samples])
+            }
+            for operation, samples in sorted(by_operation.items())
+        }
+    }
+
+
+def wait_healthy(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{url} no respondió en {timeout} s')
+
+
+@contextmanager
+def local_stack(args):
+    """Servicios y gateway con gunicorn sobre --database-url, en puertos desde --puerto"""
+    ports = {'gateway': args.puerto, 'pacientes': args.puerto + 1, 'citas': args.puerto + 2}
+    for servicio in ('pacientes-service', 'citas-service'):
+        migrate(servicio, args.database_url)
+    processes = []
+    try:
+        for name in ('pacientes', 'citas'):
+            processes.append(subprocess.Popen(
+                [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{ports[name]}',
+                 '--workers', str(args.workers), '--timeout', '120', 'app:app'],
+                cwd=os.path.join(ROOT, f'{name}-service'), env=service_env(args.database_url),
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        processes.append(subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{ports['gateway']}"],
+            cwd=os.path.join(ROOT, 'api-gateway'),
+            env=dict(os.environ, PACIENTES_SERVICE_URL=f"http://127.0.0.1:{ports['pacientes']}",
+                     CITAS_SERVICE_URL=f"http://127.0.0.1:{ports['citas']}",
+                     GATEWAY_RUNTIME=args.runtime, GATEWAY_WORKERS=str(args.workers)),
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        for name, port in ports.items():
+            wait_healthy(f'http://127.0.0.1:{port}/health')
+        yield {'gateway': f"http://127.0.0.1:{ports['gateway']}/api",
+               'pacientes': f"http://127.0.0.1:{ports['pacientes']}",
+               'citas': f"http://127.0.0.1:{ports['citas']}"}
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_levels(args, url):
+    workload = Workload(url, args.pacientes, args.citas, args.semilla)
+    names, weights = operations(args.objetivo, args.mezcla)
+    levels = []
+    for concurrencia in (int(value) for value in args.concurrencia.split(',')):
+        level = run_level(workload, names, weights, concurrencia, args.duracion, args.calentamiento, args.timeout)
+        latency = level['latencia_ms']
+        print(f"concurrencia {concurrencia:>4}: {level['throughput']:>9.1f} req/s  p50 {latency['p50']} ms  "
+              f"p95 {latency['p95']} ms  p99 {latency['p99']} ms  errores {level['errores']}", file=sys.stderr)
+        levels.append(level)
+    return levels
+
+
+def ejecutar(args):
+    meta = {
+        'fecha': datetime.utcnow().replace(microsecond=0).isoformat(),
+        'commit': git_commit(),
+        'etiqueta': args.etiqueta,
+        'python': platform.python_version(),
+        'objetivo': args.objetivo,
+        'mezcla': args.mezcla,
+        'pesos': dict(zip(*operations(args.objetivo, args.mezcla))),
+        'duracion': args.duracion,
+        'calentamiento': args.calentamiento,
+        'pacientes': args.pacientes,
+        'citas': args.citas,
+        'semilla': args.semilla
+    }
+    if args.levantar:
+        if not args.database_url:
+            sys.exit('--levantar requiere --database-url')
+        meta.update(base_de_datos=args.database_url.split(':', 1)[0], workers=args.workers, runtime=args.runtime)
+        with local_stack(args) as urls:
+            meta['url'] = urls[args.objetivo]
+            levels = run_levels(args, meta['url'])
+    else:
+        meta['url'] = args.url or DEFAULT_URLS[args.objetivo]
+        levels = run_levels(args, meta['url'])
+
+    output = json.dumps({'meta': meta, 'niveles': levels}, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+    return 1 if any(level['errores'] for level in levels) else 0
+
+# ==================== COMPARACIÓN ====================
+
+def compare_levels(base, actual, tolerancia):
+    """Filas (concurrencia, métrica, base, actual, cambio %, regresión) de los niveles presentes en ambos"""
+    base_levels = {level['concurrencia']: level for level in base['niveles']}
+    rows = []
+    for level in actual['niveles']:
+        previous = base_levels.get(level['concurrencia'])
+        if previous is None:
+            continue
+        metrics = [('throughput', previous['throughput'], level['throughput'], -1)]
+        metrics += [(name, previous['latencia_ms'][name], level['latencia_ms'][name], 1) for name in ('p50', 'p95', 'p99')]
+        for name, before, after, worse in metrics:
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            # p50 se muestra pero no cuenta como regresión: varía mucho entre corridas cortas
+            regression = name != 'p50' and change * worse > tolerancia
+            rows.append((level['concurrencia'], name, before, after, change, regression))
+    return rows
+
+
+def comparar(args):
+    with open(args.base, encoding='utf-8') as file:
+        base = json.load(file)
+    with open(args.actual, encoding='utf-8') as file:
+        actual = json.load(file)
+    for key in ('objetivo', 'mezcla'):
+        if base['meta'].get(key) != actual['meta'].get(key):
+            print(f"Aviso: {key} distinto ({base['meta'].get(key)} / {actual['meta'].get(key)})", file=sys.stderr)
+
+    rows = compare_levels(base, actual, args.tolerancia)
+    print(f"{base['meta'].get('etiqueta') or base['meta'].get('commit')} -> "
+          f"{actual['meta'].get('etiqueta') or actual['meta'].get('commit')}, tolerancia {args.tolerancia}%")
+    print(f"{'concurrencia':>12}{'métrica':>12}{'base':>12}{'actual':>12}{'cambio':>10}")
+    for concurrencia, name, before, after, change, regression in rows:
+        print(f"{concurrencia:>12}{name:>12}{before:>12.1f}{after:>12.1f}{change:>+9.1f}%"
+              f"{'  REGRESIÓN' if regression else ''}")
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='comando', required=True)
+
+    seed = commands.add_parser('sembrar', help='Crear el esquema y cargar pacientes y citas')
+    seed.add_argument('--database-url', required=True)
+    seed.add_argument('--pacientes', type=int, default=10000)
+    seed.add_argument('--citas', type=int, default=100000)
+    seed.add_argument('--lote', type=int, default=5000, help='Filas por INSERT')
+    seed.add_argument('--semilla', type=int, default=42)
+    seed.add_argument('--reiniciar', action='store_true', help='Vaciar las tablas antes de cargar')
+
+    run = commands.add_parser('ejecutar', help='Medir throughput y latencia por nivel de concurrencia')
+    run.add_argument('--objetivo', choices=sorted(OPERACIONES), default='gateway')
+    run.add_argument('--url', help='URL base (por defecto la local del objetivo)')
+    run.add_argument('--mezcla', choices=sorted(MEZCLAS), default='mixta')
+    run.add_argument('--concurrencia', default='1,8,32', help='Clientes en paralelo por nivel, separados por coma')
+    run.add_argument('--duracion', type=float, default=30, help='Segundos medidos por nivel')
+    run.add_argument('--calentamiento', type=float, default=5, help='Segundos sin medir al inicio de cada nivel')
+    run.add_argument('--timeout', type=float, default=30)
+    run.add_argument('--pacientes', type=int, default=10000, help='Pacientes sembrados (rango de ids)')
+    run.add_argument('--citas', type=int, default=100000, help='Citas sembradas (rango de ids y médicos)')
+    run.add_argument('--semilla', type=int, default=42)
+    run.add_argument('--etiqueta', help='Nombre de la corrida en el JSON')
+    run.add_argument('--salida', help='Archivo JSON de resultados (por defecto stdout)')
+    run.add_argument('--levantar', action='store_true', help='Arrancar servicios y gateway con gunicorn')
+    run.add_argument('--database-url', help='Base de datos de --levantar')
+    run.add_argument('--puerto', type=int, default=15000, help='Puerto del gateway de --levantar (servicios: +1, +2)')
+    run.add_argument('--workers', type=int, default=2, help='Workers de gunicorn por proceso con --levantar')
+    run.add_argument('--runtime', choices=['sync', 'async'], default='sync', help='GATEWAY_RUNTIME con --levantar')
+
+    compare = commands.add_parser('comparar', help='Detectar regresiones entre dos resultados')
+    compare.add_argument('base')
+    compare.add_argument('actual')
+    compare.add_argument('--tolerancia', type=float, default=10, help='Cambio máximo aceptado (%%)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    return {'sembrar': sembrar, 'ejecutar': ejecutar, 'comparar': comparar}[args.comando](args)
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
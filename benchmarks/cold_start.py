@@ -0,0 +1,92 @@
+"""
+Tiempo de arranque en frío de un worker
+
+Mide en procesos nuevos lo que hace cada worker de gunicorn al arrancar:
+importar app.py y atender su primera petición que usa la base de datos.
+Compara DB_AUTO_CREATE=true (db.create_all() al importar) con
+DB_AUTO_CREATE=false (esquema creado antes con `flask --app app migrar`).
+
+--latencia-ms agrega una espera a cada consulta SQL para simular la
+latencia de red hacia un PostgreSQL remoto cuando se mide contra SQLite.
+
+Uso:
+    python benchmarks/cold_start.py --servicio citas-service --database-url sqlite:////tmp/citas.db --latencia-ms 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = '''
+import json, sys, time
+started = time.perf_counter()
+import sqlalchemy as sa
+latency = {latency} / 1000
+queries = []
+
+@sa.event.listens_for(sa.engine.Engine, 'before_cursor_execute')
+def simulate_latency(*args):
+    queries.append(1)
+    if latency:
+        time.sleep(latency)
+
+import app
+imported = time.perf_counter()
+import_queries = len(queries)
+response = app.app.test_client().get('{path}')
+assert response.status_code == 200, response.status_code
+print(json.dumps({{
+    'import': imported - started,
+    'total': time.perf_counter() - started,
+    'import_queries': import_queries
+}}))
+'''
+
+FIRST_REQUEST = {'citas-service': '/citas?limit=1', 'pacientes-service': '/pacientes?limit=1'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servicio', choices=sorted(FIRST_REQUEST), default='citas-service')
+    parser.add_argument('--database-url', required=True, help='Base de datos ya migrada')
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--latencia-ms', type=float, default=0, help='Latencia simulada por consulta SQL')
+    return parser.parse_args()
+
+
+def run_worker(args, auto_create):
+    env = dict(os.environ, DATABASE_URL=args.database_url, DB_AUTO_CREATE=auto_create)
+    code = WORKER.format(latency=args.latencia_ms, path=FIRST_REQUEST[args.servicio])
+    output = subprocess.run(
+        [sys.executable, '-c', code], cwd=os.path.join(ROOT, args.servicio),
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    subprocess.run(
+        [sys.executable, '-m', 'flask', '--app', 'app', 'migrar'], cwd=os.path.join(ROOT, args.servicio),
+        env=dict(os.environ, DATABASE_URL=args.database_url, DB_AUTO_CREATE='false'),
+        check=True, capture_output=True
+    )
+
+    print('=' * 72)
+    print(f'{args.servicio}, {args.repeticiones} arranques por modo, latencia simulada {args.latencia_ms} ms')
+    print(f"{'DB_AUTO_CREATE':<16}{'importar (ms)':>16}{'1ª petición (ms)':>20}{'consultas al importar':>22}")
+    for auto_create in ('true', 'false'):
+        runs = [run_worker(args, auto_create) for _ in range(args.repeticiones)]
+        import_ms = statistics.median(run['import'] for run in runs) * 1000
+        total_ms = statistics.median(run['total'] for run in runs) * 1000
+        print(f"{auto_create:<16}{import_ms:>16.1f}{total_ms:>20.1f}{runs[0]['import_queries']:>22}")
+    print('=' * 72)
+    print('Valores: mediana. "1ª petición" incluye la importación.')
+
+
+if __name__ == '__main__':
+    main()
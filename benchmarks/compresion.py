@@ -0,0 +1,82 @@
+"""
+Costo y beneficio de la compresión de respuestas por tamaño
+
+Para listados de citas de distinto tamaño (mismo JSON que GET /citas)
+muestra, con cada algoritmo disponible y su nivel configurado, los bytes
+ahorrados y el tiempo de CPU de comprimir una respuesta. Sirve para elegir
+COMPRESSION_MIN_SIZE y los niveles COMPRESSION_*_LEVEL.
+
+Uso:
+    python benchmarks/compresion.py --filas 1,5,20,100,1000,10000
+    COMPRESSION_ZSTD_LEVEL=6 python benchmarks/compresion.py
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'citas-service'))
+
+import compresion  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', default='1,5,20,100,1000,10000', help='Filas por respuesta, separadas por coma')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    return parser.parse_args()
+
+
+def payload(filas):
+    """Cuerpo de un listado de citas con el formato de to_dict()"""
+    base = datetime(2030, 1, 7, 8, 0)
+    return json.dumps([{
+        'id': n + 1,
+        'paciente_id': n % 500 + 1,
+        'fecha_hora': (base + timedelta(minutes=30 * n)).isoformat(),
+        'especialidad': 'Cardiología',
+        'medico': f'Dr. Benchmark #{n % 20}',
+        'duracion_minutos': 30,
+        'motivo': 'Control de rutina',
+        'estado': 'confirmada',
+        'observaciones': None,
+        'created_at': base.isoformat(),
+        'updated_at': base.isoformat()
+    } for n in range(filas)], sort_keys=True, separators=(',', ':')).encode()
+
+
+def measure(algorithm, body, repeticiones):
+    """Tamaño comprimido y mediana de CPU (ms) por respuesta"""
+    times = []
+    for _ in range(repeticiones):
+        started = time.process_time()
+        compressed = compresion.compress(algorithm, body)
+        times.append(time.process_time() - started)
+    times.sort()
+    return len(compressed), times[len(times) // 2] * 1000
+
+
+def main():
+    args = parse_args()
+    algorithms = compresion.available_algorithms()
+    print('=' * 78)
+    print(f"Algoritmos: {', '.join(f'{name} (nivel {compresion.COMPRESSION_LEVELS[name]})' for name in algorithms)}")
+    print(f'COMPRESSION_MIN_SIZE actual: {compresion.COMPRESSION_MIN_SIZE} bytes')
+    print(f"{'filas':>7}{'bytes':>10}{'algoritmo':>11}{'comprimido':>12}{'ahorro':>10}{'%':>7}{'CPU (ms)':>10}{'MB/s':>9}")
+    for filas in (int(value) for value in args.filas.split(',')):
+        body = payload(filas)
+        for algorithm in algorithms:
+            size, cpu_ms = measure(algorithm, body, args.repeticiones)
+            saved = len(body) - size
+            throughput = len(body) / 1e6 / (cpu_ms / 1000) if cpu_ms else float('inf')
+            print(f'{filas:>7}{len(body):>10}{algorithm:>11}{size:>12}{saved:>10}'
+                  f'{saved / len(body) * 100:>6.0f}%{cpu_ms:>10.3f}{throughput:>9.0f}')
+    print('=' * 78)
+    print('CPU: mediana por respuesta. Un ahorro negativo indica que conviene no comprimir ese tamaño.')
+
+
+if __name__ == '__main__':
+    main()
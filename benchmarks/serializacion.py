@@ -0,0 +1,104 @@
+"""
+Micro-benchmark de serialización de listados
+
+Compara filas por segundo al leer y serializar a JSON un listado de citas:
+
+- orm+to_dict+std: objetos del modelo, to_dict() y el json de Flask (camino anterior)
+- tuplas+std: filas como tuplas y el proveedor json de la biblioteca estándar
+- tuplas+orjson: filas como tuplas y el proveedor orjson (si está instalado)
+
+Usa una base SQLite temporal, así mide la aplicación y no la red.
+
+Uso:
+    python benchmarks/serializacion.py --filas 20000 --repeticiones 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=20000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    return parser.parse_args()
+
+
+def load_app(path):
+    os.environ['DATABASE_URL'] = f'sqlite:///{path}'
+    sys.path.insert(0, os.path.join(ROOT, 'citas-service'))
+    import app
+    return app
+
+
+def seed(app, filas):
+    base = datetime(2030, 1, 7, 8, 0)
+    with app.app.app_context():
+        app.db.session.execute(app.db.insert(app.Cita), [{
+            'paciente_id': n % 500 + 1,
+            'fecha_hora': base + timedelta(minutes=30 * n),
+            'especialidad': 'Cardiología',
+            'medico': f'Dr. Benchmark #{n % 20}',
+            'duracion_minutos': 30,
+            'motivo': 'Control',
+            'estado': 'confirmada',
+            'observaciones': None,
+            'created_at': base,
+            'updated_at': base
+        } for n in range(filas)])
+        app.db.session.commit()
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        app = load_app(os.path.join(tmp, 'citas.db'))
+        from flask.json.provider import DefaultJSONProvider
+        from serializacion import IsoJSONProvider, OrjsonProvider, orjson
+        seed(app, args.filas)
+
+        def orm_to_dict():
+            rows = app.db.session.scalars(app.db.select(app.Cita).order_by(app.Cita.id)).all()
+            return DefaultJSONProvider(app.app).dumps([row.to_dict() for row in rows])
+
+        def tuples(provider):
+            def run():
+                stmt = app.db.select(*app.table_columns(app.Cita)).order_by(app.Cita.id)
+                return provider.dumps(app.row_dicts(app.db.session.execute(stmt)))
+            return run
+
+        paths = [('orm+to_dict+std', orm_to_dict), ('tuplas+std', tuples(IsoJSONProvider(app.app)))]
+        if orjson is not None:
+            paths.append(('tuplas+orjson', tuples(OrjsonProvider(app.app))))
+
+        print('=' * 60)
+        print(f'{args.filas} filas, {args.repeticiones} repeticiones por camino')
+        print(f"{'camino':<20}{'mediana (ms)':>16}{'filas/s':>16}{'vs actual':>10}")
+        baseline = None
+        with app.app.app_context():
+            outputs = []
+            for name, run in paths:
+                times = []
+                for _ in range(args.repeticiones):
+                    app.db.session.expunge_all()
+                    started = time.perf_counter()
+                    output = run()
+                    times.append(time.perf_counter() - started)
+                outputs.append(json.loads(output))
+                median = statistics.median(times)
+                baseline = baseline or median
+                print(f'{name:<20}{median * 1000:>16.1f}{args.filas / median:>16,.0f}{baseline / median:>9.1f}x')
+        print('=' * 60)
+        same = all(output == outputs[0] for output in outputs)
+        print('Mismo JSON en todos los caminos' if same else 'ADVERTENCIA: los caminos producen JSON distinto')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,27 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, json, stream_with_context, url_for
+import click
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import hashlib
 import os
+import threading
+
+from disponibilidad import AvailabilityIndex, IntervalIndex, working_hours
+from esquema import compare_indexes, explain
+from conexiones import engine_options, pool_stats
+import migraciones
+from replicas import RoutingSession, init_read_routing, read_stats, replica_binds
+from serializacion import json_provider
+from compresion import compression_stats, init_compression
+from metricas import PROMETHEUS_CONTENT_TYPE, gauges, init_metrics, prometheus_requested, render_prometheus, route_stats
+from trazas import format_tree, init_tracing, trace_spans, trace_summaries
+from perfilado import (FOLDED_CONTENT_TYPE, PROFILING_SLOW_REQUEST_MS, authorize, background_profile, blocks_worker, folded,
+                       init_profiling, parse_seconds, retry_after, sample, save, slow_profiles, start_background)
+from consultas import init_query_profiling, query_budget, query_stats
 
 app = Flask(__name__)
+app.json = json_provider(app)
 
 # Configuración de la base de datos
 DATABASE_URL = os.getenv(
@@ -12,18 +30,70 @@ DATABASE_URL = os.getenv(
 )
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
+app.config['SQLALCHEMY_BINDS'] = replica_binds()
+DB_AUTO_CREATE = os.getenv('DB_AUTO_CREATE', 'true').lower() == 'true'
+
+# Paginación por cursor (keyset sobre id)
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+MAX_IDS = int(os.getenv('MAX_IDS', 500))
+
+# Exportación completa por streaming (filas leídas por lotes con cursor del servidor)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+
+# Creación masiva de citas
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 500))
+MAX_BULK_SIZE = int(os.getenv('MAX_BULK_SIZE', 10000))
+
+# Duración de las citas (minutos)
+DURACION_CITA_MINUTOS = int(os.getenv('DURACION_CITA_MINUTOS', 30))
+MAX_DURACION_MINUTOS = int(os.getenv('MAX_DURACION_MINUTOS', 480))
+CONFLICTO_HORARIO = 'Ya existe una cita confirmada para ese médico en ese horario'
+CONFLICTO_CONCURRENTE = 'Otra reserva concurrente ocupó ese horario, intente de nuevo'
+
+# Espacio de nombres de los advisory locks de agenda (primer argumento de pg_advisory_xact_lock)
+AGENDA_LOCK_NAMESPACE = int(os.getenv('AGENDA_LOCK_NAMESPACE', 7301))
+
+# Búsqueda de horarios libres
+HORARIO_INICIO = os.getenv('HORARIO_INICIO', '08:00')
+HORARIO_FIN = os.getenv('HORARIO_FIN', '18:00')
+DIAS_ATENCION = {int(dia) for dia in os.getenv('DIAS_ATENCION', '0,1,2,3,4').split(',')}
+DISPONIBILIDAD_TTL = float(os.getenv('DISPONIBILIDAD_TTL', 60))
+DISPONIBILIDAD_MAX_DIAS = int(os.getenv('DISPONIBILIDAD_MAX_DIAS', 180))
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+init_read_routing(app, cookie_name='leer_primaria_citas')
+init_compression(app)
+init_metrics(app, database=True)
+init_tracing(app, 'citas', database=True)
+init_query_profiling(app)
+init_profiling(app)
 
-db = SQLAlchemy(app)
+# Condición de los índices parciales sobre citas confirmadas
+CONFIRMADA = "estado = 'confirmada'"
 
 # Modelo de Cita
 class Cita(db.Model):
     __tablename__ = 'citas'
+    __table_args__ = (
+        # Verificación de solapes: citas confirmadas de un médico en un rango de fechas
+        db.Index('idx_citas_medico_fecha_confirmadas', 'medico', 'fecha_hora',
+                 postgresql_where=db.text(CONFIRMADA), sqlite_where=db.text(CONFIRMADA)),
+        # Carga del índice de disponibilidad: citas confirmadas desde una fecha
+        db.Index('idx_citas_fecha_confirmadas', 'fecha_hora',
+                 postgresql_where=db.text(CONFIRMADA), sqlite_where=db.text(CONFIRMADA)),
+        # Citas de un paciente ordenadas por fecha
+        db.Index('idx_citas_paciente_fecha', 'paciente_id', 'fecha_hora'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     paciente_id = db.Column(db.Integer, nullable=False)
     fecha_hora = db.Column(db.DateTime, nullable=False)
     especialidad = db.Column(db.String(100), nullable=False)
     medico = db.Column(db.String(100), nullable=False)
+    duracion_minutos = db.Column(db.Integer, nullable=False, default=DURACION_CITA_MINUTOS)
     motivo = db.Column(db.Text)
     estado = db.Column(db.String(20), default='pendiente')  # pendiente, confirmada, cancelada, completada
     observaciones = db.Column(db.Text)
@@ -37,6 +107,7 @@ class Cita(db.Model):
             'fecha_hora': self.fecha_hora.isoformat() if self.fecha_hora else None,
             'especialidad': self.especialidad,
             'medico': self.medico,
+            'duracion_minutos': self.duracion_minutos,
             'motivo': self.motivo,
             'estado': self.estado,
             'observaciones': self.observaciones,
@@ -44,94 +115,655 @@ class Cita(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-# Crear tablas automáticamente al iniciar
-with app.app_context():
-    db.create_all()
+def table_columns(model, fields=None):
+    """Columnas a seleccionar como tuplas: las de fields o la tabla completa"""
+    table = model.__table__
+    return [table.c[name] for name in fields] if fields else [table]
+
+def row_dicts(rows):
+    """Filas de la consulta como diccionarios, sin crear objetos del modelo
+
+    Las fechas quedan como date/datetime y el proveedor JSON de la app las
+    codifica en ISO 8601, igual que to_dict().
+    """
+    return [row._asdict() for row in rows]
+
+def parse_list_args(model):
+    """Leer los parámetros limit, cursor y fields de un listado"""
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    fields = request.args.get('fields')
+
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            raise ValueError(f'El parámetro limit debe ser un entero entre 1 y {MAX_PAGE_SIZE}')
+        limit = int(limit)
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise ValueError('El parámetro cursor debe ser un entero')
+        cursor = int(cursor)
+        if limit is None:
+            limit = DEFAULT_PAGE_SIZE
+    if fields is not None:
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        invalid = [name for name in fields if name not in model.__table__.columns]
+        if not fields:
+            raise ValueError('El parámetro fields no puede estar vacío')
+        if invalid:
+            raise ValueError(f'Campos inválidos: {", ".join(invalid)}')
+        # El id siempre se incluye porque es la clave del cursor
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+    return limit, cursor, fields
+
+def list_page(model):
+    """Listar filas con paginación keyset sobre id y proyección de columnas en SQL
+
+    Devuelve la lista de diccionarios y el cursor de la siguiente página
+    (None si no hay más filas o si no se pidió paginación).
+    """
+    limit, cursor, fields = parse_list_args(model)
+
+    query = db.select(*table_columns(model, fields))
+    if cursor is not None:
+        query = query.where(model.id > cursor)
+    if limit is not None:
+        query = query.order_by(model.id).limit(limit + 1)
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return row_dicts(rows), next_cursor
+
+def parse_ids():
+    """Leer el parámetro ids=1,2,3 como lista de enteros sin repetidos"""
+    value = request.args.get('ids')
+    if value is None:
+        return None
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part.isdigit():
+            raise ValueError('El parámetro ids debe ser una lista de enteros separados por coma')
+        if int(part) not in ids:
+            ids.append(int(part))
+    if not 1 <= len(ids) <= MAX_IDS:
+        raise ValueError(f'El parámetro ids debe tener entre 1 y {MAX_IDS} valores')
+    return ids
+
+def list_by_ids(model, ids):
+    """Obtener varias filas por id con una sola consulta WHERE id IN (...)
+
+    Devuelve las filas en el orden pedido y los ids que no existen.
+    """
+    fields = parse_list_args(model)[2]
+    rows = db.session.execute(db.select(*table_columns(model, fields)).where(model.id.in_(ids))).all()
+    found = {item['id']: item for item in row_dicts(rows)}
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
+
+def make_etag(*parts):
+    """ETag fuerte a partir de los valores que identifican la versión de un recurso"""
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def row_validators(row):
+    """ETag y Last-Modified de una fila a partir de su id y updated_at"""
+    return make_etag(row.id, row.updated_at), row.updated_at
+
+def list_validators(model, *criteria, paginated=True):
+    """ETag de un listado a partir de count y max(updated_at)
+
+    Se calcula sobre las mismas filas que devolvería el listado (filtros,
+    ids o página pedida), sin cargarlas ni serializarlas. Los listados no
+    llevan Last-Modified: max(updated_at) no cambia al borrar una fila y
+    If-Modified-Since daría 304 con datos viejos; el count del ETag sí.
+    """
+    stmt = db.select(model.id, model.updated_at).where(*criteria)
+    if paginated:
+        ids = parse_ids()
+        limit, cursor, _ = parse_list_args(model)
+        if ids is not None:
+            stmt = stmt.where(model.id.in_(ids))
+        else:
+            if cursor is not None:
+                stmt = stmt.where(model.id > cursor)
+            if limit is not None:
+                stmt = stmt.order_by(model.id).limit(limit + 1)
+    rows = stmt.subquery()
+    count, last_modified = db.session.execute(
+        db.select(db.func.count(), db.func.max(rows.c.updated_at))
+    ).one()
+    return make_etag(count, last_modified, request.query_string.decode())
+
+def not_modified(etag, last_modified=None):
+    """Respuesta 304 si la petición condicional coincide con la versión actual, si no None"""
+    if request.if_none_match:
+        # Comparación débil: las respuestas comprimidas llevan el ETag como W/"..."
+        matches = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        matches = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        matches = False
+    if not matches:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
+
+def set_validators(response, etag, last_modified=None):
+    """Agregar ETag y Last-Modified a la respuesta"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+def paginated_response(items, next_cursor):
+    """Respuesta JSON con enlace a la siguiente página en la cabecera Link"""
+    response = jsonify(items)
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+def export_response(model):
+    """Exportar toda la tabla como NDJSON o arreglo JSON por bloques
+
+    Las filas se leen con yield_per, así la memoria no depende del tamaño de la tabla.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Formato inválido. Use {" o ".join(EXPORT_FORMATS)}'}), 400
+
+    def generate():
+        stmt = db.select(*table_columns(model)).order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        partitions = db.session.execute(stmt).partitions()
+        if fmt == 'ndjson':
+            for rows in partitions:
+                yield ''.join(json.dumps(item) + '\n' for item in row_dicts(rows))
+            return
+        separator = ''
+        yield '['
+        for rows in partitions:
+            yield separator + ','.join(json.dumps(item) for item in row_dicts(rows))
+            separator = ','
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt])
+
+def validate_cita(data):
+    """Validar los datos de una cita nueva
+
+    Devuelve (valores de las columnas, None) o (None, mensaje de error).
+    """
+    if not isinstance(data, dict):
+        return None, 'Los datos de la cita deben ser un objeto JSON'
+    
+    required_fields = ['paciente_id', 'fecha_hora', 'especialidad', 'medico']
+    for field in required_fields:
+        if field not in data:
+            return None, f'Campo {field} es requerido'
+    
+    # Convertir fecha y hora
+    try:
+        fecha_hora = datetime.strptime(data['fecha_hora'], '%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError):
+        return None, 'Formato de fecha inválido. Use YYYY-MM-DD HH:MM:SS'
+    
+    # Validar que la fecha sea futura
+    if fecha_hora < datetime.utcnow():
+        return None, 'La fecha de la cita debe ser futura'
+    
+    duracion, error = parse_duracion(data.get('duracion_minutos', DURACION_CITA_MINUTOS))
+    if error:
+        return None, error
+    
+    return {
+        'paciente_id': data['paciente_id'],
+        'fecha_hora': fecha_hora,
+        'especialidad': data['especialidad'],
+        'medico': data['medico'],
+        'duracion_minutos': duracion,
+        'motivo': data.get('motivo'),
+        'estado': data.get('estado', 'pendiente'),
+        'observaciones': data.get('observaciones')
+    }, None
+
+def parse_duracion(value):
+    """Validar la duración de una cita en minutos"""
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= MAX_DURACION_MINUTOS:
+        return None, f'duracion_minutos debe ser un entero entre 1 y {MAX_DURACION_MINUTOS}'
+    return value, None
+
+def interval(values):
+    """Intervalo [inicio, fin) que ocupa una cita"""
+    return values['fecha_hora'], values['fecha_hora'] + timedelta(minutes=values['duracion_minutos'])
+
+def booked_query(medicos, desde, hasta, exclude_id=None):
+    """Consulta de las citas confirmadas de unos médicos que empiezan en [desde, hasta)"""
+    stmt = db.select(Cita.id, Cita.medico, Cita.fecha_hora, Cita.duracion_minutos).where(
+        Cita.estado == 'confirmada',
+        Cita.medico.in_(medicos),
+        Cita.fecha_hora >= desde,
+        Cita.fecha_hora < hasta
+    )
+    if exclude_id is not None:
+        stmt = stmt.where(Cita.id != exclude_id)
+    return stmt
+
+def booked_intervals(citas, exclude_id=None):
+    """Citas confirmadas de los médicos dados que pueden solaparse con las citas dadas
+
+    Una sola consulta por el rango que cubren todas las citas; como ninguna
+    cita dura más de MAX_DURACION_MINUTOS, basta con mirar las que empiezan
+    desde ese margen antes del primer inicio. Devuelve un IntervalIndex por médico.
+    """
+    if not citas:
+        return {}
+    intervals = [interval(values) for values in citas]
+    desde = min(start for start, _ in intervals) - timedelta(minutes=MAX_DURACION_MINUTOS)
+    hasta = max(end for _, end in intervals)
+    stmt = booked_query({values['medico'] for values in citas}, desde, hasta, exclude_id)
+    booked = {}
+    for id, medico, fecha_hora, duracion in db.session.execute(stmt):
+        booked.setdefault(medico, IntervalIndex()).add(
+            fecha_hora, fecha_hora + timedelta(minutes=duracion), id)
+    return booked
+
+def lock_schedules(medicos):
+    """Serializar las reservas concurrentes de los médicos dados hasta el fin de la transacción
+
+    En PostgreSQL toma un advisory lock por médico (en orden, para evitar
+    interbloqueos entre lotes) antes de verificar la disponibilidad, así dos
+    workers no pueden pasar la verificación a la vez para el mismo médico.
+    Las reservas de médicos distintos no se bloquean entre sí.
+
+    Con otros motores (SQLite en desarrollo) se usa un lock del proceso,
+    que solo protege frente a los hilos del mismo worker.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        if not db.session.info.get('agenda_lock'):
+            local_schedule_lock.acquire()
+            db.session.info['agenda_lock'] = True
+        return
+    for medico in sorted(set(medicos)):
+        db.session.execute(
+            db.text('SELECT pg_advisory_xact_lock(:namespace, hashtext(:medico))'),
+            {'namespace': AGENDA_LOCK_NAMESPACE, 'medico': medico}
+        )
+
+local_schedule_lock = threading.Lock()
+
+@db.event.listens_for(db.session, 'after_transaction_end')
+def release_schedule_lock(session, transaction):
+    """Liberar el lock local de agenda al terminar la transacción (commit o rollback)"""
+    if transaction.parent is None and session.info.pop('agenda_lock', False):
+        local_schedule_lock.release()
+
+def overlap_violation(error):
+    """Indica si el error es la restricción de exclusión citas_sin_solape de PostgreSQL"""
+    return getattr(error.orig, 'pgcode', None) == '23P01'
+
+def has_conflict(booked, values):
+    """Indica si la cita se solapa con alguna cita confirmada del mismo médico"""
+    index = booked.get(values['medico'])
+    return index is not None and bool(index.overlapping(*interval(values)))
+
+def booked_slots_query(desde):
+    """Consulta de las citas confirmadas que empiezan desde una fecha"""
+    return db.select(Cita.id, Cita.medico, Cita.especialidad, Cita.fecha_hora, Cita.duracion_minutos).where(
+        Cita.estado == 'confirmada',
+        Cita.fecha_hora >= desde
+    )
+
+def load_booked_slots():
+    """Citas confirmadas vigentes con su intervalo ocupado, para el índice de disponibilidad"""
+    desde = datetime.utcnow() - timedelta(minutes=MAX_DURACION_MINUTOS)
+    rows = db.session.execute(booked_slots_query(desde)).all()
+    return [(id, medico, especialidad, fecha_hora, fecha_hora + timedelta(minutes=duracion))
+            for id, medico, especialidad, fecha_hora, duracion in rows]
+
+def load_doctors():
+    """Médicos de todas las citas con sus especialidades (no hay otro registro de médicos)"""
+    return db.session.execute(db.select(Cita.medico, Cita.especialidad).distinct()).all()
+
+availability = AvailabilityIndex(load_booked_slots, DISPONIBILIDAD_TTL, load_doctors)
+jornada = working_hours(HORARIO_INICIO, HORARIO_FIN, DIAS_ATENCION)
+
+def sync_availability(id, values):
+    """Reflejar en el índice de disponibilidad el estado actual de una cita"""
+    if values is not None and values['estado'] == 'confirmada':
+        availability.add(id, values['medico'], values['especialidad'], *interval(values))
+    else:
+        availability.discard(id)
+        if values is not None:
+            availability.add_doctor(values['medico'], values['especialidad'])
+
+def citas_by_paciente_query(paciente_id):
+    """Consulta de las citas de un paciente ordenadas por fecha"""
+    return db.select(*table_columns(Cita)).where(Cita.paciente_id == paciente_id).order_by(Cita.fecha_hora, Cita.id)
+
+def parse_datetime_arg(name, default):
+    """Leer un parámetro de fecha (YYYY-MM-DD o YYYY-MM-DD HH:MM:SS)"""
+    value = request.args.get(name)
+    if not value:
+        return default
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise ValueError(f'Formato de {name} inválido. Use YYYY-MM-DD o YYYY-MM-DD HH:MM:SS')
+
+def parse_int_arg(name, default, minimum, maximum):
+    """Leer un parámetro entero dentro de un rango"""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.isdigit() or not minimum <= int(value) <= maximum:
+        raise ValueError(f'El parámetro {name} debe ser un entero entre {minimum} y {maximum}')
+    return int(value)
+
+# Crear tablas automáticamente al iniciar (desarrollo). En producción el esquema
+# se crea con `flask --app app migrar` antes de arrancar y los workers no lo revisan.
+if DB_AUTO_CREATE:
+    with app.app_context():
+        db.create_all()
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({'status': 'Citas service is running'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas del worker: latencia y SQL por ruta, pool, lecturas por nodo, compresión y consultas lentas
+
+    Devuelve JSON, o el formato de texto de Prometheus si Accept lo prefiere
+    (como hace Prometheus) o con ?format=prometheus.
+    """
+    pool = pool_stats(db.engine)
+    lecturas = read_stats()
+    compresion = compression_stats()
+    consultas = query_stats()
+    if prometheus_requested(request.headers.get('Accept'), request.args.get('format')):
+        extra = gauges('db_pool', pool)
+        for endpoint, nodes in lecturas['routes'].items():
+            extra += [('db_read_requests', float(count), {'endpoint': endpoint, 'node': node}) for node, count in nodes.items()]
+        for algorithm, stats in compresion['algorithms'].items():
+            extra += gauges('compression', stats, algorithm=algorithm)
+        extra += gauges('db_profile', consultas)
+        return Response(render_prometheus('citas', extra), content_type=PROMETHEUS_CONTENT_TYPE)
+    return jsonify({
+        'pid': os.getpid(),
+        'rutas': route_stats(),
+        'pool': pool,
+        'lecturas': lecturas,
+        'compresion': compresion,
+        'consultas': consultas
+    }), 200
+
+@app.route('/perfil', methods=['GET'])
+def get_perfil():
+    """Perfil por muestreo de los hilos del worker durante ?segundos=N, en formato collapsed
+
+    En un worker sync el muestreo corre en segundo plano y se responde 202 con
+    la URL del resultado en Location.
+    """
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'No autorizado' if error == 401 else 'No encontrado'}), error
+    try:
+        seconds = parse_seconds(request.args.get('segundos'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not blocks_worker(request.environ):
+        counts = sample(seconds)
+        save('muestreo', counts)
+        return Response(folded(counts), content_type=FOLDED_CONTENT_TYPE)
+    profile = start_background(seconds)
+    if profile is None:
+        return jsonify({'error': 'Ya hay un muestreo en curso en este worker'}), 409
+    url = url_for('get_perfil_resultado', id=profile['id'])
+    response = jsonify({'id': profile['id'], 'segundos': seconds, 'resultado': url})
+    response.headers['Location'] = url
+    response.headers['Retry-After'] = str(retry_after(profile))
+    return response, 202
+
+@app.route('/perfil/<id>', methods=['GET'])
+def get_perfil_resultado(id):
+    """Resultado de un muestreo en segundo plano (202 mientras sigue en curso)"""
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'No autorizado' if error == 401 else 'No encontrado'}), error
+    profile = background_profile(id)
+    if profile is None:
+        return jsonify({'error': 'Perfil no encontrado en este worker', 'pid': os.getpid()}), 404
+    if profile['counts'] is None:
+        response = jsonify({'id': id, 'segundos': profile['segundos'], 'resultado': request.path})
+        response.headers['Retry-After'] = str(retry_after(profile))
+        return response, 202
+    return Response(folded(profile['counts']), content_type=FOLDED_CONTENT_TYPE)
+
+@app.route('/perfil/lentas', methods=['GET'])
+def get_perfiles_lentos():
+    """Perfiles de las últimas peticiones lentas del worker (?ruta= filtra; ?formato=collapsed los une)"""
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'No autorizado' if error == 401 else 'No encontrado'}), error
+    profiles = slow_profiles(request.args.get('ruta'))
+    if request.args.get('formato') == 'collapsed':
+        return Response(''.join(profile['folded'] for profile in profiles), content_type=FOLDED_CONTENT_TYPE)
+    return jsonify({'umbral_ms': PROFILING_SLOW_REQUEST_MS, 'pid': os.getpid(), 'perfiles': profiles}), 200
+
+@app.route('/trazas', methods=['GET'])
+def get_trazas():
+    """Trazas recientes registradas por este worker"""
+    return jsonify(trace_summaries()), 200
+
+@app.route('/trazas/<trace_id>', methods=['GET'])
+def get_traza(trace_id):
+    """Spans de una traza en este worker (?formato=texto para verlos como árbol)"""
+    spans = trace_spans(trace_id)
+    if request.args.get('formato') == 'texto':
+        return Response(format_tree(spans), mimetype='text/plain')
+    return jsonify(spans), 200
+
 @app.route('/citas', methods=['GET'])
+@query_budget(2)
 def get_citas():
-    """Obtener todas las citas"""
+    """Obtener todas las citas (paginación con limit/cursor, proyección con fields o lote con ids)"""
     try:
-        citas = Cita.query.all()
-        return jsonify([cita.to_dict() for cita in citas]), 200
+        etag = list_validators(Cita)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        ids = parse_ids()
+        if ids is not None:
+            citas, missing = list_by_ids(Cita, ids)
+            response = jsonify({'citas': citas, 'no_encontradas': missing})
+        else:
+            citas, next_cursor = list_page(Cita)
+            response = paginated_response(citas, next_cursor)
+        return set_validators(response, etag), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/citas/export', methods=['GET'])
+def export_citas():
+    """Exportar todas las citas por streaming (format=ndjson o json)"""
+    return export_response(Cita)
+
+@app.route('/citas/disponibilidad', methods=['GET'])
+def get_disponibilidad():
+    """Buscar horarios libres de un médico o de los médicos de una especialidad
+
+    Parámetros: medico, especialidad, desde, hasta, duracion (minutos) y limite.
+    Con medico y especialidad, solo se busca si el médico atiende esa especialidad.
+    """
+    try:
+        medico = request.args.get('medico')
+        especialidad = request.args.get('especialidad')
+        if not medico and not especialidad:
+            return jsonify({'error': 'Indique medico o especialidad'}), 400
+        
+        ahora = datetime.utcnow().replace(microsecond=0)
+        desde = max(parse_datetime_arg('desde', ahora), ahora)
+        hasta = parse_datetime_arg('hasta', desde + timedelta(days=7))
+        duracion = parse_int_arg('duracion', DURACION_CITA_MINUTOS, 5, MAX_DURACION_MINUTOS)
+        limite = parse_int_arg('limite', 100, 1, 1000)
+        if hasta <= desde:
+            return jsonify({'error': 'hasta debe ser posterior a desde'}), 400
+        if hasta - desde > timedelta(days=DISPONIBILIDAD_MAX_DIAS):
+            return jsonify({'error': f'El rango no puede superar {DISPONIBILIDAD_MAX_DIAS} días'}), 400
+        
+        if not especialidad:
+            medicos = [medico]
+        else:
+            medicos = [nombre for nombre in availability.doctors(especialidad) if not medico or nombre == medico]
+        horarios = availability.free_slots(medicos, desde, hasta, timedelta(minutes=duracion), jornada, limite)
+        return jsonify({
+            'duracion': duracion,
+            'horarios': [
+                {'medico': slot['medico'], 'inicio': slot['inicio'].isoformat(), 'fin': slot['fin'].isoformat()}
+                for slot in horarios
+            ]
+        }), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/citas/<int:id>', methods=['GET'])
+@query_budget(1)
 def get_cita(id):
     """Obtener una cita por ID"""
     try:
         cita = Cita.query.get(id)
         if not cita:
             return jsonify({'error': 'Cita no encontrada'}), 404
-        return jsonify(cita.to_dict()), 200
+        etag, last_modified = row_validators(cita)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged:
+            return unchanged
+        return set_validators(jsonify(cita.to_dict()), etag, last_modified), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/citas/paciente/<int:paciente_id>', methods=['GET'])
+@query_budget(2)
 def get_citas_by_paciente(paciente_id):
     """Obtener todas las citas de un paciente"""
     try:
-        citas = Cita.query.filter_by(paciente_id=paciente_id).all()
-        return jsonify([cita.to_dict() for cita in citas]), 200
+        etag = list_validators(Cita, Cita.paciente_id == paciente_id, paginated=False)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        citas = row_dicts(db.session.execute(citas_by_paciente_query(paciente_id)))
+        return set_validators(jsonify(citas), etag), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/citas', methods=['POST'])
+@query_budget(3)
 def create_cita():
     """Crear una nueva cita"""
     try:
         data = request.get_json()
         
         # Validaciones
-        required_fields = ['paciente_id', 'fecha_hora', 'especialidad', 'medico']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Campo {field} es requerido'}), 400
+        values, error = validate_cita(data)
+        if error:
+            return jsonify({'error': error}), 400
         
-        # Convertir fecha y hora
-        fecha_hora = datetime.strptime(data['fecha_hora'], '%Y-%m-%d %H:%M:%S')
-        
-        # Validar que la fecha sea futura
-        if fecha_hora < datetime.utcnow():
-            return jsonify({'error': 'La fecha de la cita debe ser futura'}), 400
-        
-        # Verificar disponibilidad (mismo médico, misma hora)
-        existing = Cita.query.filter_by(
-            medico=data['medico'],
-            fecha_hora=fecha_hora,
-            estado='confirmada'
-        ).first()
-        if existing:
-            return jsonify({'error': 'Ya existe una cita confirmada para ese médico en ese horario'}), 400
+        # Verificar disponibilidad (mismo médico, horarios solapados)
+        lock_schedules([values['medico']])
+        if has_conflict(booked_intervals([values]), values):
+            return jsonify({'error': CONFLICTO_HORARIO}), 400
         
         # Crear cita
-        cita = Cita(
-            paciente_id=data['paciente_id'],
-            fecha_hora=fecha_hora,
-            especialidad=data['especialidad'],
-            medico=data['medico'],
-            motivo=data.get('motivo'),
-            estado=data.get('estado', 'pendiente'),
-            observaciones=data.get('observaciones')
-        )
+        cita = Cita(**values)
         
         db.session.add(cita)
         db.session.commit()
+        sync_availability(cita.id, values)
         
         return jsonify(cita.to_dict()), 201
-    except ValueError as e:
-        return jsonify({'error': 'Formato de fecha inválido. Use YYYY-MM-DD HH:MM:SS'}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if overlap_violation(e):
+            return jsonify({'error': CONFLICTO_CONCURRENTE}), 409
+        return jsonify({'error': str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/citas/bulk', methods=['POST'])
+def create_citas_bulk():
+    """Crear un lote de citas en una sola transacción
+
+    Acepta una lista de citas (o {"citas": [...]}) y devuelve el resultado de cada una.
+    """
+    try:
+        data = request.get_json()
+        items = data.get('citas') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Se espera una lista de citas'}), 400
+        if len(items) > MAX_BULK_SIZE:
+            return jsonify({'error': f'El lote no puede superar {MAX_BULK_SIZE} citas'}), 400
+        
+        results = [None] * len(items)
+        valid = []
+        for index, item in enumerate(items):
+            values, error = validate_cita(item)
+            if error:
+                results[index] = {'indice': index, 'status': 400, 'error': error}
+            else:
+                valid.append((index, values))
+        
+        # Verificar disponibilidad de todo el lote con una sola consulta; las citas
+        # confirmadas aceptadas se agregan al índice para detectar solapes dentro del lote
+        lock_schedules(values['medico'] for _, values in valid)
+        booked = booked_intervals([values for _, values in valid])
+        rows = []
+        for index, values in valid:
+            if has_conflict(booked, values):
+                results[index] = {'indice': index, 'status': 400, 'error': CONFLICTO_HORARIO}
+                continue
+            if values['estado'] == 'confirmada':
+                booked.setdefault(values['medico'], IntervalIndex()).add(*interval(values), index)
+            rows.append((index, values))
+        
+        # Insertar por bloques con un INSERT de varias filas por bloque
+        stmt = db.insert(Cita).returning(Cita.id, sort_by_parameter_order=True)
+        for start in range(0, len(rows), BULK_CHUNK_SIZE):
+            chunk = rows[start:start + BULK_CHUNK_SIZE]
+            ids = db.session.scalars(stmt, [values for _, values in chunk]).all()
+            for (index, _), cita_id in zip(chunk, ids):
+                results[index] = {'indice': index, 'status': 201, 'id': cita_id}
+        db.session.commit()
+        for index, values in rows:
+            sync_availability(results[index]['id'], values)
+        
+        created = len(rows)
+        return jsonify({
+            'creadas': created,
+            'errores': len(items) - created,
+            'resultados': results
+        }), 201 if created == len(items) else 207
+    except IntegrityError as e:
+        db.session.rollback()
+        if overlap_violation(e):
+            return jsonify({'error': CONFLICTO_CONCURRENTE}), 409
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @app.route('/citas/<int:id>', methods=['PUT'])
+@query_budget(5)
 def update_cita(id):
     """Actualizar una cita"""
     try:
@@ -159,15 +791,43 @@ def update_cita(id):
             if data['estado'] not in ['pendiente', 'confirmada', 'cancelada', 'completada']:
                 return jsonify({'error': 'Estado inválido'}), 400
             cita.estado = data['estado']
+        if 'duracion_minutos' in data:
+            duracion, error = parse_duracion(data['duracion_minutos'])
+            if error:
+                return jsonify({'error': error}), 400
+            cita.duracion_minutos = duracion
         if 'observaciones' in data:
             cita.observaciones = data['observaciones']
         
+        values = {
+            'estado': cita.estado,
+            'medico': cita.medico,
+            'especialidad': cita.especialidad,
+            'fecha_hora': cita.fecha_hora,
+            'duracion_minutos': cita.duracion_minutos
+        }
+        # Volver a verificar disponibilidad si cambia el horario, el médico o el estado
+        reprogramada = any(field in data for field in ('fecha_hora', 'medico', 'duracion_minutos', 'estado'))
+        if reprogramada and cita.estado in ('pendiente', 'confirmada'):
+            with db.session.no_autoflush:
+                lock_schedules([cita.medico])
+                conflict = has_conflict(booked_intervals([values], exclude_id=cita.id), values)
+            if conflict:
+                db.session.rollback()
+                return jsonify({'error': CONFLICTO_HORARIO}), 400
+        
         cita.updated_at = datetime.utcnow()
         db.session.commit()
+        sync_availability(cita.id, values)
         
         return jsonify(cita.to_dict()), 200
     except ValueError as e:
         return jsonify({'error': 'Formato de fecha inválido. Use YYYY-MM-DD HH:MM:SS'}), 400
+    except IntegrityError as e:
+        db.session.rollback()
+        if overlap_violation(e):
+            return jsonify({'error': CONFLICTO_CONCURRENTE}), 409
+        return jsonify({'error': str(e)}), 500
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -182,12 +842,68 @@ def delete_cita(id):
         
         db.session.delete(cita)
         db.session.commit()
+        sync_availability(id, None)
         
         return jsonify({'message': 'Cita eliminada correctamente'}), 200
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def endpoint_queries():
+    """Consulta principal de cada endpoint con parámetros de ejemplo, para EXPLAIN"""
+    ahora = datetime.utcnow()
+    return {
+        'GET /citas': db.select(Cita).order_by(Cita.id).limit(DEFAULT_PAGE_SIZE + 1),
+        'GET /citas?ids=': db.select(Cita).where(Cita.id.in_([1, 2, 3])),
+        'GET /citas/<id>': db.select(Cita).where(Cita.id == 1),
+        'GET /citas/paciente/<id>': citas_by_paciente_query(1),
+        'POST /citas, /citas/bulk, PUT /citas/<id> (solapes)': booked_query(
+            ['Dr. López'], ahora - timedelta(minutes=MAX_DURACION_MINUTOS), ahora + timedelta(hours=1)),
+        'GET /citas/disponibilidad (carga del índice)': booked_slots_query(ahora)
+    }
+
+@app.cli.command('verificar-esquema')
+@click.option('--crear', is_flag=True, help='Crear los índices que falten.')
+def verificar_esquema(crear):
+    """Informar índices faltantes y planes de ejecución de las consultas de cada endpoint"""
+    missing, extra = compare_indexes(db.engine, db.metadata)
+    for index in missing:
+        if crear:
+            index.create(db.engine, checkfirst=True)
+            click.echo(f'Índice creado: {index.name}')
+        else:
+            click.echo(f'Falta el índice: {index.name} ({index.table.name})')
+    for table, name in extra:
+        click.echo(f'Índice no declarado en el modelo: {name} ({table})')
+    if not missing:
+        click.echo('Todos los índices del modelo existen')
+    
+    with db.engine.connect() as connection:
+        for endpoint, stmt in endpoint_queries().items():
+            click.echo(f'\n{endpoint}')
+            for line in explain(connection, stmt):
+                click.echo(f'  {line}')
+    
+    if missing and not crear:
+        raise SystemExit(1)
+
+@app.cli.command('migrar')
+@click.option('--estado', is_flag=True, help='Solo mostrar las migraciones aplicadas y pendientes.')
+def migrar(estado):
+    """Aplicar las migraciones pendientes del esquema"""
+    if estado:
+        for version, descripcion, aplicada in migraciones.status(db.engine):
+            click.echo(f"{version:04d} {'aplicada ' if aplicada else 'pendiente'} {descripcion}")
+        return
+    try:
+        applied = migraciones.migrate(db.engine)
+    except migraciones.MigrationError as e:
+        raise click.ClickException(str(e))
+    for version, descripcion in applied:
+        click.echo(f'Aplicada {version:04d}: {descripcion}')
+    if not applied:
+        click.echo('El esquema está al día')
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5002))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,195 @@
+"""Compresión de respuestas negociada con Accept-Encoding (zstd, br, gzip)
+
+Se comprimen las respuestas JSON/NDJSON/texto de al menos
+COMPRESSION_MIN_SIZE bytes. Las respuestas por streaming (exportaciones) se
+comprimen por bloques. brotli y zstandard son opcionales: sin ellos solo se
+ofrece gzip. Las respuestas que ya traen Content-Encoding (p. ej. las que el
+gateway reenvía de un microservicio) no se vuelven a comprimir.
+"""
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # dependencia opcional
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # dependencia opcional
+    zstandard = None
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 1024))
+# Orden de preferencia del servidor cuando el cliente acepta varias
+COMPRESSION_ALGORITHMS = [name.strip() for name in os.getenv('COMPRESSION_ALGORITHMS', 'zstd,br,gzip').split(',')]
+COMPRESSION_LEVELS = {
+    'gzip': int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+    'br': int(os.getenv('COMPRESSION_BR_LEVEL', 4)),
+    'zstd': int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3))
+}
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu_seconds': 0.0})
+
+
+def available_algorithms():
+    """Algoritmos configurados cuya biblioteca está instalada, en orden de preferencia"""
+    installed = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+    return [name for name in COMPRESSION_ALGORITHMS if installed.get(name)]
+
+
+def negotiate(accept_encoding):
+    """Algoritmo a usar según Accept-Encoding, o None si el cliente no acepta ninguno"""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for name in available_algorithms():
+        if accepted.get(name, accepted.get('*', 0)) > 0:
+            return name
+    return None
+
+
+def compressible(content_type, status, content_encoding=None):
+    """Si el tipo y el estado de la respuesta admiten compresión"""
+    if content_encoding or status < 200 or status in (204, 206, 304):
+        return False
+    return (content_type or '').startswith(COMPRESSIBLE_TYPES)
+
+
+class _Compressor:
+    """Compresor incremental con la misma interfaz para los tres algoritmos"""
+
+    def __init__(self, algorithm):
+        level = COMPRESSION_LEVELS[algorithm]
+        if algorithm == 'gzip':
+            compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+            self._compress, self._finish = compressor.compress, compressor.flush
+            self._flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        elif algorithm == 'br':
+            compressor = brotli.Compressor(quality=level)
+            self._compress, self._finish, self._flush = compressor.process, compressor.finish, compressor.flush
+        else:
+            compressor = zstandard.ZstdCompressor(level=level).compressobj()
+            self._compress, self._finish = compressor.compress, compressor.flush
+            self._flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def compress(self, data):
+        return self._compress(data)
+
+    def flush(self):
+        """Lo comprimido hasta ahora, decodificable sin esperar al resto del cuerpo"""
+        return self._flush()
+
+    def finish(self):
+        return self._finish()
+
+
+def _record(algorithm, bytes_in, bytes_out, cpu_seconds):
+    with _lock:
+        stats = _stats[algorithm]
+        stats['responses'] += 1
+        stats['bytes_in'] += bytes_in
+        stats['bytes_out'] += bytes_out
+        stats['cpu_seconds'] += cpu_seconds
+
+
+def compress(algorithm, data):
+    """Comprimir un cuerpo completo"""
+    started = time.thread_time()
+    compressor = _Compressor(algorithm)
+    body = compressor.compress(data) + compressor.finish()
+    _record(algorithm, len(data), len(body), time.thread_time() - started)
+    return body
+
+
+def compress_stream(algorithm, chunks):
+    """Comprimir por bloques un cuerpo por streaming (str o bytes)
+
+    Cada bloque se vacía del compresor al recibirlo (los tres guardan datos
+    internamente), así el cliente lo recibe sin esperar al final del cuerpo.
+    """
+    compressor = _Compressor(algorithm)
+    bytes_in = bytes_out = 0
+    cpu_seconds = 0.0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            started = time.thread_time()
+            data = compressor.compress(chunk) + compressor.flush()
+            cpu_seconds += time.thread_time() - started
+            bytes_in += len(chunk)
+            bytes_out += len(data)
+            if data:
+                yield data
+        started = time.thread_time()
+        data = compressor.finish()
+        cpu_seconds += time.thread_time() - started
+        bytes_out += len(data)
+        yield data
+        _record(algorithm, bytes_in, bytes_out, cpu_seconds)
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def init_compression(app):
+    """Comprimir las respuestas de la app Flask según el Accept-Encoding de cada petición"""
+
+    @app.after_request
+    def compress_response(response):
+        if not COMPRESSION_ENABLED or request.method == 'HEAD':
+            return response
+        if not compressible(response.mimetype, response.status_code, response.headers.get('Content-Encoding')):
+            return response
+        response.vary.add('Accept-Encoding')
+        algorithm = negotiate(request.headers.get('Accept-Encoding'))
+        if algorithm is None:
+            return response
+        if response.is_streamed:
+            # Tamaño desconocido (exportaciones): se comprime salvo que Content-Length diga que es pequeña
+            if response.content_length is not None and response.content_length < COMPRESSION_MIN_SIZE:
+                return response
+            response.response = compress_stream(algorithm, response.response)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_SIZE:
+                return response
+            response.set_data(compress(algorithm, data))
+        response.headers['Content-Encoding'] = algorithm
+        # Otra representación del mismo recurso: el ETag pasa a ser débil
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def compression_stats():
+    """Respuestas comprimidas, bytes antes y después y CPU usada, por algoritmo"""
+    with _lock:
+        algorithms = {name: dict(stats, cpu_seconds=round(stats['cpu_seconds'], 6)) for name, stats in _stats.items()}
+    return {
+        'enabled': COMPRESSION_ENABLED,
+        'min_size': COMPRESSION_MIN_SIZE,
+        'available': available_algorithms(),
+        'levels': {name: COMPRESSION_LEVELS[name] for name in available_algorithms()},
+        'algorithms': algorithms
+    }
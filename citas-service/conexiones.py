@@ -0,0 +1,127 @@
+"""Configuración y métricas del pool de conexiones a la base de datos"""
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, Pool, QueuePool
+
+# Pool de conexiones (por worker)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Tiempo máximo de cada sentencia en PostgreSQL (0 = sin límite)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 0))
+# Detrás de PgBouncer (transaction pooling) el pool lo hace PgBouncer
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+_lock = threading.Lock()
+_counters = {
+    'checkouts': 0,
+    'connects': 0,
+    'invalidations': 0,
+    'waits': 0,
+    'wait_seconds': 0.0,
+    'max_wait_seconds': 0.0,
+    'timeouts': 0
+}
+
+
+def _count(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool que mide las esperas por una conexión cuando el pool está agotado"""
+
+    def __init__(self, *args, **kwargs):
+        self.max_overflow = kwargs.get('max_overflow', 10)
+        super().__init__(*args, **kwargs)
+
+    def _do_get(self):
+        exhausted = self.max_overflow > -1 and self.checkedout() >= self.size() + self.max_overflow
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            _count('timeouts')
+            raise
+        finally:
+            if exhausted:
+                waited = time.perf_counter() - started
+                with _lock:
+                    _counters['waits'] += 1
+                    _counters['wait_seconds'] += waited
+                    _counters['max_wait_seconds'] = max(_counters['max_wait_seconds'], waited)
+
+
+@event.listens_for(Pool, 'checkout')
+def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+    _count('checkouts')
+
+
+@event.listens_for(Pool, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    _count('connects')
+
+
+@event.listens_for(Pool, 'invalidate')
+def _on_invalidate(dbapi_connection, connection_record, exception):
+    # Conexiones descartadas: pre-ping fallido o error de conexión (p. ej. tras un failover)
+    _count('invalidations')
+
+
+def engine_options(database_url):
+    """SQLALCHEMY_ENGINE_OPTIONS según las variables de entorno
+
+    SQLite (desarrollo y pruebas) conserva el pool por defecto de Flask-SQLAlchemy.
+    """
+    if database_url.startswith('sqlite'):
+        return {}
+    if DB_PGBOUNCER:
+        # PgBouncer reparte las conexiones: una conexión por transacción y sin
+        # parámetros de arranque, que PgBouncer rechaza (statement_timeout se
+        # configura en el rol: ALTER ROLE ... SET statement_timeout)
+        return {'poolclass': NullPool}
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING
+    }
+    if DB_STATEMENT_TIMEOUT_MS > 0 and database_url.startswith('postgresql'):
+        options['connect_args'] = {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}'}
+    return options
+
+
+def pool_stats(engine):
+    """Estado del pool del engine y contadores acumulados del proceso"""
+    pool = engine.pool
+    with _lock:
+        stats = dict(_counters)
+    stats['wait_seconds'] = round(stats['wait_seconds'], 6)
+    stats['max_wait_seconds'] = round(stats['max_wait_seconds'], 6)
+    stats['pool_class'] = type(pool).__name__
+    stats['pgbouncer'] = DB_PGBOUNCER
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            # overflow() es negativo mientras no se han abierto todas las conexiones base
+            'overflow': max(pool.overflow(), 0),
+            'timeout': pool.timeout()
+        })
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update({
+            'max_overflow': pool.max_overflow,
+            'recycle': DB_POOL_RECYCLE,
+            'pre_ping': DB_POOL_PRE_PING,
+            'statement_timeout_ms': DB_STATEMENT_TIMEOUT_MS
+        })
+    return stats
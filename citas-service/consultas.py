@@ -0,0 +1,140 @@
+"""Registro de consultas lentas y detección de N+1 por petición
+
+Las sentencias SQL que tardan al menos SLOW_QUERY_MS se registran en el log
+de la app con sus parámetros y su plan de ejecución (EXPLAIN); /metrics solo
+muestra la sentencia, la ruta y la duración, porque los parámetros (y el
+plan, que en PostgreSQL los repite) pueden tener datos de pacientes.
+
+Cada petición cuenta sus sentencias; si pasa de su presupuesto (QUERY_BUDGET,
+o el de @query_budget en la ruta) se registra con las sentencias repetidas,
+que suelen delatar un N+1. Con QUERY_BUDGET_STRICT (los tests lo activan) la
+petición falla con QueryBudgetExceeded.
+"""
+import os
+import threading
+from collections import Counter, deque
+
+from flask import current_app, g, has_request_context, request
+
+from esquema import explain_sql
+from sentencias import on_query
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))  # 0 desactiva el registro
+SLOW_QUERY_EXPLAIN = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() == 'true'
+QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', 10))
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+MAX_PARAMS_LENGTH = 300
+RECENT_SIZE = 20
+
+_lock = threading.Lock()
+_stats = {'slow_queries': 0, 'over_budget': 0}
+_recent_slow = deque(maxlen=RECENT_SIZE)
+_recent_over_budget = deque(maxlen=RECENT_SIZE)
+
+
+class QueryBudgetExceeded(Exception):
+    """Una petición hizo más consultas SQL que su presupuesto (modo estricto)"""
+
+
+def query_budget(limit):
+    """Máximo de consultas SQL de una ruta en lugar de QUERY_BUDGET (debajo de @app.route)"""
+    def decorate(view):
+        view.query_budget = limit
+        return view
+    return decorate
+
+
+def _route():
+    if not has_request_context():
+        return None
+    return f'{request.method} {request.url_rule.rule if request.url_rule is not None else request.path}'
+
+
+def _record_slow(conn, statement, parameters, executemany, seconds):
+    plan = None
+    # Solo las lecturas: EXPLAIN de un INSERT/UPDATE en PostgreSQL no lo ejecuta, pero no aporta
+    if SLOW_QUERY_EXPLAIN and not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+        try:
+            plan = explain_sql(conn, statement, parameters)
+        except Exception as e:
+            plan = [f'EXPLAIN falló: {e}']
+    entry = {'route': _route(), 'ms': round(seconds * 1000, 3), 'statement': statement}
+    with _lock:
+        _stats['slow_queries'] += 1
+        _recent_slow.append(entry)
+    logger = current_app.logger if has_request_context() else None
+    if logger is not None:
+        logger.warning('Consulta lenta (%.1f ms) en %s: %s\n  parámetros: %s%s', entry['ms'], entry['route'],
+                       statement, repr(parameters)[:MAX_PARAMS_LENGTH],
+                       ''.join(f'\n  plan: {line}' for line in plan or []))
+
+
+_queries_profiled = False
+
+
+def _profile_queries():
+    """Contar las sentencias de la petición en curso y registrar las lentas (todas las engines)"""
+    global _queries_profiled
+    if _queries_profiled:
+        return
+    _queries_profiled = True
+
+    def end_query(conn, cursor, statement, parameters, context, executemany, seconds):
+        if has_request_context() and 'sql_statements' in g:
+            g.sql_statements.append(statement)
+        if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+            _record_slow(conn, statement, parameters, executemany, seconds)
+
+    on_query(after=end_query)
+
+
+def init_query_profiling(app):
+    """Registrar las consultas lentas y verificar el presupuesto de consultas de cada petición
+
+    El presupuesto se verifica al terminar la vista: las consultas de una
+    respuesta por streaming (exportaciones por lotes) no cuentan.
+    """
+    _profile_queries()
+    app.config.setdefault('QUERY_BUDGET_STRICT', QUERY_BUDGET_STRICT)
+
+    @app.before_request
+    def start_count():
+        g.sql_statements = []
+
+    @app.after_request
+    def check_budget(response):
+        statements = g.pop('sql_statements', None)
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', QUERY_BUDGET)
+        if statements is None or len(statements) <= budget:
+            return response
+        repeated = [(count, statement) for statement, count in Counter(statements).most_common(3) if count > 1]
+        entry = {
+            'route': _route(),
+            'queries': len(statements),
+            'budget': budget,
+            'repeated': [{'count': count, 'statement': statement} for count, statement in repeated]
+        }
+        with _lock:
+            _stats['over_budget'] += 1
+            _recent_over_budget.append(entry)
+        message = f"{entry['route']} hizo {len(statements)} consultas SQL (presupuesto {budget})"
+        if repeated:
+            message += ''.join(f'\n  {count}x {statement}' for count, statement in repeated)
+        if app.config['QUERY_BUDGET_STRICT']:
+            raise QueryBudgetExceeded(message)
+        app.logger.warning('Posible N+1: %s', message)
+        return response
+
+
+def query_stats():
+    """Umbrales, contadores y últimas consultas lentas y peticiones sobre el presupuesto"""
+    with _lock:
+        return {
+            'slow_query_ms': SLOW_QUERY_MS,
+            'budget': QUERY_BUDGET,
+            'slow_queries': _stats['slow_queries'],
+            'over_budget': _stats['over_budget'],
+            'recent_slow': list(_recent_slow),
+            'recent_over_budget': list(_recent_over_budget)
+        }
@@ -0,0 +1,195 @@
+"""Índice en memoria de los horarios ocupados de cada médico
+
+Cada médico tiene sus intervalos ocupados [inicio, fin) ordenados por
+inicio, de modo que la búsqueda de horarios libres en un rango solo
+recorre las citas de ese rango (bisect) y no toda la tabla.
+"""
+import bisect
+import heapq
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class IntervalIndex:
+    """Intervalos [inicio, fin) de un médico ordenados por inicio"""
+
+    def __init__(self):
+        self.starts = []
+        self.intervals = []
+        self.max_length = timedelta(0)
+
+    def __len__(self):
+        return len(self.intervals)
+
+    def add(self, start, end, key):
+        position = bisect.bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.intervals.insert(position, (start, end, key))
+        self.max_length = max(self.max_length, end - start)
+
+    def remove(self, key, start):
+        position = bisect.bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start:
+            if self.intervals[position][2] == key:
+                del self.starts[position]
+                del self.intervals[position]
+                return True
+            position += 1
+        return False
+
+    def overlapping(self, start, end):
+        """Intervalos que se solapan con [start, end)"""
+        # Ningún intervalo que empiece antes de start - max_length puede llegar a start
+        first = bisect.bisect_left(self.starts, start - self.max_length)
+        last = bisect.bisect_left(self.starts, end)
+        return [interval for interval in self.intervals[first:last] if interval[1] > start]
+
+    def free_slots(self, desde, hasta, duracion, jornada):
+        """Generar en orden los horarios libres de `duracion` entre desde y hasta
+
+        jornada(dia) devuelve la lista de ventanas (inicio, fin) de atención
+        de ese día. Los horarios empiezan en el inicio de la ventana o en
+        múltiplos de `duracion` a partir de él.
+        """
+        busy = self.overlapping(desde, hasta)
+        position = 0
+        day = desde.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < hasta:
+            for window_start, window_end in jornada(day):
+                slot = window_start
+                while slot + duracion <= window_end and slot + duracion <= hasta:
+                    slot_end = slot + duracion
+                    if slot < desde:
+                        slot = slot_end
+                        continue
+                    # Descartar intervalos que terminan antes del horario candidato
+                    while position < len(busy) and busy[position][1] <= slot:
+                        position += 1
+                    conflict = None
+                    candidate = position
+                    while candidate < len(busy) and busy[candidate][0] < slot_end:
+                        if busy[candidate][1] > slot:
+                            conflict = busy[candidate]
+                            break
+                        candidate += 1
+                    if conflict is None:
+                        yield slot, slot_end
+                        slot = slot_end
+                    else:
+                        # Saltar al primer múltiplo de la duración después del conflicto
+                        steps = -(-(conflict[1] - window_start) // duracion)
+                        slot = window_start + steps * duracion
+            day += timedelta(days=1)
+
+
+class AvailabilityIndex:
+    """Horarios ocupados por médico, cargados desde la base de datos
+
+    El índice se reconstruye completo cuando han pasado `ttl` segundos desde
+    la última carga (para ver las escrituras de otros workers) y se
+    actualiza de forma incremental con las escrituras de este worker.
+    doctors_loader da los pares (medico, especialidad) de todos los médicos,
+    también los que no tienen citas confirmadas (los que están libres).
+    """
+
+    def __init__(self, loader, ttl, doctors_loader=None):
+        self._loader = loader
+        self._doctors_loader = doctors_loader
+        self._ttl = ttl
+        self._lock = threading.RLock()
+        self._doctors = {}
+        self._especialidades = {}
+        self._locations = {}
+        self._loaded_at = None
+
+    def rebuild(self):
+        doctors = {}
+        especialidades = {}
+        locations = {}
+        for key, medico, especialidad, start, end in self._loader():
+            doctors.setdefault(medico, IntervalIndex()).add(start, end, key)
+            especialidades.setdefault(medico, set()).add(especialidad)
+            locations[key] = (medico, start)
+        for medico, especialidad in self._doctors_loader() if self._doctors_loader is not None else ():
+            especialidades.setdefault(medico, set()).add(especialidad)
+        with self._lock:
+            self._doctors = doctors
+            self._especialidades = especialidades
+            self._locations = locations
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self._ttl:
+            self.rebuild()
+
+    def discard(self, key):
+        """Quitar una cita del índice (cancelada, eliminada o reprogramada)"""
+        with self._lock:
+            location = self._locations.pop(key, None)
+            if location is not None:
+                medico, start = location
+                self._doctors[medico].remove(key, start)
+
+    def add(self, key, medico, especialidad, start, end):
+        """Agregar o reemplazar una cita que ocupa el horario del médico"""
+        with self._lock:
+            self.discard(key)
+            self._doctors.setdefault(medico, IntervalIndex()).add(start, end, key)
+            self.add_doctor(medico, especialidad)
+            self._locations[key] = (medico, start)
+
+    def add_doctor(self, medico, especialidad):
+        """Registrar un médico y su especialidad aunque no ocupe ningún horario"""
+        with self._lock:
+            self._especialidades.setdefault(medico, set()).add(especialidad)
+
+    def doctors(self, especialidad=None):
+        """Médicos conocidos, opcionalmente filtrados por especialidad"""
+        with self._lock:
+            self._ensure_fresh()
+            return sorted(
+                medico for medico, values in self._especialidades.items()
+                if especialidad is None or especialidad in values
+            )
+
+    def free_slots(self, medicos, desde, hasta, duracion, jornada, limite):
+        """Horarios libres de varios médicos en orden cronológico (hasta `limite`)"""
+        with self._lock:
+            self._ensure_fresh()
+            generators = [
+                self._doctor_slots(medico, desde, hasta, duracion, jornada)
+                for medico in medicos
+            ]
+            slots = []
+            for start, medico, end in heapq.merge(*generators):
+                slots.append({'medico': medico, 'inicio': start, 'fin': end})
+                if len(slots) >= limite:
+                    break
+            return slots
+
+    def _doctor_slots(self, medico, desde, hasta, duracion, jornada):
+        index = self._doctors.get(medico, IntervalIndex())
+        for start, end in index.free_slots(desde, hasta, duracion, jornada):
+            yield start, medico, end
+
+
+def working_hours(inicio, fin, dias):
+    """Función jornada(dia) con el horario de atención configurado
+
+    inicio y fin son cadenas HH:MM; dias es el conjunto de días de la
+    semana con atención (0 = lunes).
+    """
+    start = datetime.strptime(inicio, '%H:%M').time()
+    end = datetime.strptime(fin, '%H:%M').time()
+
+    def jornada(day):
+        if day.weekday() not in dias:
+            return []
+        return [(datetime.combine(day.date(), start), datetime.combine(day.date(), end))]
+
+    return jornada
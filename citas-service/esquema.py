@@ -0,0 +1,71 @@
+"""Verificación del esquema: índices declarados en los modelos y planes de ejecución"""
+from sqlalchemy import inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN de una consulta, con los mismos parámetros que usaría el endpoint"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+def explain_prefix(dialect):
+    return 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+
+
+@compiles(Explain)
+def visit_explain(element, compiler, **kw):
+    return explain_prefix(compiler.dialect) + compiler.process(element.statement, **kw)
+
+
+def plan_lines(rows):
+    # PostgreSQL devuelve una columna por línea; SQLite (id, parent, notused, detail)
+    return [row[-1] for row in rows]
+
+
+def explain(connection, statement):
+    """Plan de ejecución de una consulta como lista de líneas"""
+    result = connection.execute(Explain(statement))
+    # Las filas del plan no tienen las columnas de la consulta: se leen del cursor
+    # sin las conversiones de tipo de esas columnas
+    rows = result.cursor.fetchall()
+    result.close()
+    return plan_lines(rows)
+
+
+def explain_sql(connection, statement, parameters):
+    """Plan de una sentencia SQL ya compilada, con sus parámetros en el formato del driver
+
+    Usa un cursor propio de la conexión DBAPI, así no dispara los eventos de
+    ejecución de SQLAlchemy (se llama desde ellos).
+    """
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(explain_prefix(connection.dialect) + statement, parameters)
+        return plan_lines(cursor.fetchall())
+    finally:
+        cursor.close()
+
+
+def compare_indexes(engine, metadata):
+    """Índices declarados en los modelos que faltan en la base de datos y los que sobran
+
+    Devuelve (faltantes, sobrantes): faltantes son objetos Index, sobrantes
+    son pares (tabla, nombre). Los índices de restricciones UNIQUE no cuentan.
+    """
+    inspector = inspect(engine)
+    missing = []
+    extra = []
+    for table in metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            missing.extend(table.indexes)
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        declared = {index.name for index in table.indexes}
+        missing.extend(index for index in table.indexes if index.name not in existing)
+        unique = {constraint['name'] for constraint in inspector.get_unique_constraints(table.name)}
+        extra.extend((table.name, name) for name in sorted(existing - declared - unique) if name)
+    return missing, extra
@@ -0,0 +1,191 @@
+"""Migraciones versionadas del esquema del servicio de citas
+
+Se aplican con `flask --app app migrar` como paso único antes de arrancar
+gunicorn (ver Dockerfile), no al importar la app, así los workers no
+consultan el catálogo de la base de datos al iniciar. Las migraciones
+pendientes se aplican en orden en una sola transacción y quedan registradas
+en schema_migrations_citas (una tabla por servicio, porque en docker-compose
+comparten la base de datos). Son idempotentes para poder adoptar bases de datos
+creadas antes con init.sql o db.create_all().
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+
+# Advisory lock para que dos despliegues simultáneos no migren a la vez
+MIGRATION_LOCK_ID = 7300
+MAX_SOLAPES_LISTADOS = 20
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    """Una migración no se puede aplicar sobre los datos actuales (se revierte completa)"""
+
+MIGRACIONES = []
+
+schema_migrations = sa.Table(
+    'schema_migrations_citas', sa.MetaData(),
+    sa.Column('version', sa.Integer, primary_key=True),
+    sa.Column('descripcion', sa.String(200), nullable=False),
+    sa.Column('aplicada_en', sa.DateTime, nullable=False)
+)
+
+
+def migracion(version, descripcion):
+    """Registrar una función fn(connection) como la migración `version`"""
+    def register(func):
+        MIGRACIONES.append((version, descripcion, func))
+        MIGRACIONES.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+def applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return set(connection.scalars(sa.select(schema_migrations.c.version)))
+
+
+def status(engine):
+    """Lista de (version, descripcion, aplicada) de todas las migraciones"""
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [(version, descripcion, version in applied) for version, descripcion, _ in MIGRACIONES]
+
+
+def migrate(engine):
+    """Aplicar las migraciones pendientes y devolver las aplicadas como (version, descripcion)"""
+    applied_now = []
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(sa.text('SELECT pg_advisory_xact_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+            # Las migraciones (p. ej. crear índices) no están sujetas a DB_STATEMENT_TIMEOUT_MS
+            connection.execute(sa.text('SET LOCAL statement_timeout = 0'))
+        applied = applied_versions(connection)
+        for version, descripcion, func in MIGRACIONES:
+            if version in applied:
+                continue
+            func(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, descripcion=descripcion, aplicada_en=datetime.utcnow()))
+            applied_now.append((version, descripcion))
+    return applied_now
+
+
+# ==================== MIGRACIONES ====================
+# Las tablas se definen aquí tal como eran en cada versión, no a partir del
+# modelo actual, para que las migraciones antiguas no cambien con el modelo.
+
+citas_v1 = sa.Table(
+    'citas', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('paciente_id', sa.Integer, nullable=False),
+    sa.Column('fecha_hora', sa.DateTime, nullable=False),
+    sa.Column('especialidad', sa.String(100), nullable=False),
+    sa.Column('medico', sa.String(100), nullable=False),
+    sa.Column('motivo', sa.Text),
+    sa.Column('estado', sa.String(20)),
+    sa.Column('observaciones', sa.Text),
+    sa.Column('created_at', sa.DateTime),
+    sa.Column('updated_at', sa.DateTime)
+)
+
+
+@migracion(1, 'Crear tabla citas')
+def crear_tabla_citas(connection):
+    citas_v1.create(connection, checkfirst=True)
+
+
+@migracion(2, 'Agregar duracion_minutos a citas')
+def agregar_duracion(connection):
+    columns = {column['name'] for column in sa.inspect(connection).get_columns('citas')}
+    if 'duracion_minutos' not in columns:
+        connection.execute(sa.text(
+            'ALTER TABLE citas ADD COLUMN duracion_minutos INTEGER NOT NULL DEFAULT 30'))
+
+
+@migracion(3, 'Índices compuestos y parciales de citas')
+def indices_citas(connection):
+    confirmada = sa.text("estado = 'confirmada'")
+    indexes = [
+        sa.Index('idx_citas_medico_fecha_confirmadas', citas_v1.c.medico, citas_v1.c.fecha_hora,
+                 postgresql_where=confirmada, sqlite_where=confirmada),
+        sa.Index('idx_citas_fecha_confirmadas', citas_v1.c.fecha_hora,
+                 postgresql_where=confirmada, sqlite_where=confirmada),
+        sa.Index('idx_citas_paciente_fecha', citas_v1.c.paciente_id, citas_v1.c.fecha_hora)
+    ]
+    for index in indexes:
+        index.create(connection, checkfirst=True)
+    for name in ('idx_citas_paciente_id', 'idx_citas_fecha_hora', 'idx_citas_estado', 'idx_citas_medico'):
+        connection.execute(sa.text(f'DROP INDEX IF EXISTS {name}'))
+
+
+citas_v2 = sa.table(
+    'citas',
+    sa.column('id', sa.Integer),
+    sa.column('medico', sa.String),
+    sa.column('fecha_hora', sa.DateTime),
+    sa.column('duracion_minutos', sa.Integer),
+    sa.column('estado', sa.String),
+    sa.column('updated_at', sa.DateTime)
+)
+
+
+def solapes_confirmados(connection):
+    """Pares (id conservada, id que se le solapa) de citas confirmadas del mismo médico
+
+    Recorre las confirmadas por médico y fecha (índice idx_citas_medico_fecha_confirmadas);
+    la segunda cita de cada par es la que hay que corregir para que las demás no se solapen.
+    """
+    rows = connection.execution_options(stream_results=True).execute(
+        sa.select(citas_v2.c.id, citas_v2.c.medico, citas_v2.c.fecha_hora, citas_v2.c.duracion_minutos)
+        .where(citas_v2.c.estado == 'confirmada')
+        .order_by(citas_v2.c.medico, citas_v2.c.fecha_hora, citas_v2.c.id)
+    )
+    pairs = []
+    medico = fin = conservada = None
+    for id, medico_cita, inicio, duracion in rows:
+        if medico_cita != medico:
+            medico, fin, conservada = medico_cita, None, None
+        if fin is not None and inicio < fin:
+            pairs.append((conservada, id))
+            continue
+        fin, conservada = inicio + timedelta(minutes=duracion), id
+    return pairs
+
+
+@migracion(4, 'Restricción de exclusión citas_sin_solape (PostgreSQL)')
+def restriccion_sin_solape(connection):
+    """Sin la restricción la base pudo guardar citas confirmadas solapadas, y con ellas el ALTER falla
+
+    Si las hay, la migración se detiene listándolas, salvo con SOLAPES_A_PENDIENTE=true,
+    que pasa a 'pendiente' la cita que se solapa con una anterior del mismo médico.
+    El control se hace en todas las bases, así SQLite guarda los mismos datos.
+    """
+    pairs = solapes_confirmados(connection)
+    if pairs and os.getenv('SOLAPES_A_PENDIENTE', 'false').lower() != 'true':
+        listed = ', '.join(f'{id} con {conservada}' for conservada, id in pairs[:MAX_SOLAPES_LISTADOS])
+        more = f' y {len(pairs) - MAX_SOLAPES_LISTADOS} más' if len(pairs) > MAX_SOLAPES_LISTADOS else ''
+        raise MigrationError(
+            f'Hay {len(pairs)} citas confirmadas que se solapan con otra del mismo médico: {listed}{more}. '
+            "Corríjalas o vuelva a migrar con SOLAPES_A_PENDIENTE=true para pasarlas a 'pendiente'.")
+    ids = [id for _, id in pairs]
+    for start in range(0, len(ids), 500):
+        connection.execute(citas_v2.update().where(citas_v2.c.id.in_(ids[start:start + 500]))
+                           .values(estado='pendiente', updated_at=datetime.utcnow()))
+    if ids:
+        logger.warning("Citas confirmadas solapadas pasadas a 'pendiente': %s", ', '.join(map(str, ids)))
+    if connection.dialect.name != 'postgresql':
+        return
+    exists = connection.scalar(sa.text("SELECT 1 FROM pg_constraint WHERE conname = 'citas_sin_solape'"))
+    if exists:
+        return
+    connection.execute(sa.text('CREATE EXTENSION IF NOT EXISTS btree_gist'))
+    connection.execute(sa.text(
+        'ALTER TABLE citas ADD CONSTRAINT citas_sin_solape EXCLUDE USING gist ('
+        ' medico WITH =,'
+        ' tsrange(fecha_hora, fecha_hora + make_interval(mins => duracion_minutos)) WITH &&'
+        " ) WHERE (estado = 'confirmada')"
+    ))
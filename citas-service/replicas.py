@@ -0,0 +1,81 @@
+"""Enrutamiento de lecturas a réplicas de la base de datos
+
+Con DATABASE_READ_URL (una o varias URLs separadas por comas) las
+peticiones GET usan una réplica elegida al azar y las escrituras siguen en
+DATABASE_URL. Tras una escritura el servicio devuelve una cookie de corta
+duración (DB_READ_PRIMARY_SECONDS, mayor que el retraso de replicación
+esperado) y mientras el cliente la envíe sus lecturas van a la primaria,
+así ve sus propias escrituras aunque las réplicas vayan atrasadas.
+"""
+import os
+import random
+import threading
+from collections import Counter, defaultdict
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session
+
+DATABASE_READ_URLS = [url.strip() for url in os.getenv('DATABASE_READ_URL', '').split(',') if url.strip()]
+DB_READ_PRIMARY_SECONDS = int(os.getenv('DB_READ_PRIMARY_SECONDS', 5))
+
+PRIMARY = 'primaria'
+READ_METHODS = ('GET', 'HEAD')
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+_lock = threading.Lock()
+_served = defaultdict(Counter)
+
+
+def replica_binds():
+    """SQLALCHEMY_BINDS con una entrada por réplica (replica_0, replica_1, ...)"""
+    return {f'replica_{n}': url for n, url in enumerate(DATABASE_READ_URLS)}
+
+
+class RoutingSession(Session):
+    """Sesión que usa la réplica elegida para la petición en curso
+
+    Las escrituras (flush) y las peticiones sin réplica asignada usan la
+    primaria o el bind del modelo, como la sesión de Flask-SQLAlchemy.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            node = None if self._flushing else g.get('read_node')
+            _record_node(node or PRIMARY)
+            if node is not None:
+                return self._db.engines[node]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _record_node(node):
+    """Contar el nodo que atiende la petición (en su primera consulta, también con streaming)"""
+    if g.get('db_node') is None:
+        g.db_node = node
+        with _lock:
+            _served[request.endpoint][node] += 1
+
+
+def init_read_routing(app, cookie_name):
+    """Elegir el nodo de lectura de cada petición y marcar al cliente tras una escritura"""
+
+    @app.before_request
+    def choose_read_node():
+        if DATABASE_READ_URLS and request.method in READ_METHODS and not request.cookies.get(cookie_name):
+            g.read_node = f'replica_{random.randrange(len(DATABASE_READ_URLS))}'
+
+    @app.after_request
+    def mark_recent_write(response):
+        if DATABASE_READ_URLS and request.method in WRITE_METHODS and response.status_code < 400:
+            response.set_cookie(cookie_name, '1', max_age=DB_READ_PRIMARY_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+
+def read_stats():
+    """Peticiones por ruta y nodo de la base de datos que las atendió"""
+    with _lock:
+        routes = {endpoint: dict(nodes) for endpoint, nodes in _served.items()}
+    return {
+        'replicas': len(DATABASE_READ_URLS),
+        'read_primary_seconds': DB_READ_PRIMARY_SECONDS,
+        'routes': routes
+    }
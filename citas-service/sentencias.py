@@ -0,0 +1,42 @@
+"""Un solo par de listeners de SQLAlchemy para todas las sentencias
+
+Métricas, trazas y consultas lentas registran aquí sus funciones en lugar de
+instalar cada uno sus before/after_cursor_execute sobre Engine: el tiempo de
+cada sentencia se toma una vez y se pasa a todas.
+"""
+import time
+
+_before = []
+_after = []
+_installed = False
+
+
+def on_query(before=None, after=None):
+    """Llamar before(conn, cursor, statement, parameters, context, executemany) antes de cada
+    sentencia y after(..., seconds) después, con la duración medida una sola vez (todas las engines)"""
+    if before is not None:
+        _before.append(before)
+    if after is not None:
+        _after.append(after)
+    _install()
+
+
+def _install():
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    @event.listens_for(Engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        for callback in _before:
+            callback(conn, cursor, statement, parameters, context, executemany)
+        context._sentencia_inicio = time.perf_counter()
+
+    @event.listens_for(Engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context._sentencia_inicio
+        for callback in _after:
+            callback(conn, cursor, statement, parameters, context, executemany, seconds)
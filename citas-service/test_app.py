@@ -1,17 +1,22 @@
 import pytest
 import sys
 import os
+import time
 from datetime import datetime, timedelta
 
 # Agregar el directorio del servicio al path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Las trazas vienen desactivadas; se activan antes de importar la app para probarlas
+os.environ.setdefault('TRACING_ENABLED', 'true')
 
-from app import app, db, Cita
+from app import app, db, Cita, availability
 
 @pytest.fixture
 def client():
     """Cliente de prueba para Flask"""
     app.config['TESTING'] = True
+    # Las rutas que pasen de su presupuesto de consultas SQL hacen fallar el test
+    app.config['QUERY_BUDGET_STRICT'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     
     with app.test_client() as client:
@@ -184,3 +189,617 @@ def test_get_all_citas(client, sample_cita):
     assert response.status_code == 200
     data = response.get_json()
     assert len(data) == 2
+
+def test_get_citas_paginadas(client, sample_cita):
+    """Test paginación por cursor de las citas"""
+    for dias in range(1, 4):
+        sample_cita['fecha_hora'] = (datetime.utcnow() + timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+        client.post('/citas', json=sample_cita)
+    
+    response = client.get('/citas?limit=2')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data) == 2
+    assert response.headers['X-Next-Cursor'] == str(data[-1]['id'])
+    assert 'rel="next"' in response.headers['Link']
+    
+    response = client.get(f'/citas?limit=2&cursor={data[-1]["id"]}')
+    data = response.get_json()
+    assert len(data) == 1
+    assert 'Link' not in response.headers
+
+def test_get_citas_fields(client, sample_cita):
+    """Test proyección de campos en el listado de citas"""
+    client.post('/citas', json=sample_cita)
+    response = client.get('/citas?fields=medico,fecha_hora')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert set(data[0].keys()) == {'id', 'medico', 'fecha_hora'}
+
+def test_get_citas_parametros_invalidos(client):
+    """Test listado de citas con parámetros inválidos"""
+    assert client.get('/citas?limit=0').status_code == 400
+    assert client.get('/citas?cursor=abc').status_code == 400
+    assert client.get('/citas?fields=inexistente').status_code == 400
+
+def test_export_citas(client, sample_cita):
+    """Test exportación de citas en NDJSON y JSON"""
+    client.post('/citas', json=sample_cita)
+    sample_cita['fecha_hora'] = (datetime.utcnow() + timedelta(days=14)).strftime('%Y-%m-%d %H:%M:%S')
+    client.post('/citas', json=sample_cita)
+    
+    response = client.get('/citas/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 2
+    
+    response = client.get('/citas/export?format=json')
+    assert len(response.get_json()) == 2
+    
+    assert client.get('/citas/export?format=xml').status_code == 400
+
+def test_create_citas_bulk(client, sample_cita):
+    """Test creación masiva de citas"""
+    citas = []
+    for dias in range(1, 4):
+        cita = sample_cita.copy()
+        cita['fecha_hora'] = (datetime.utcnow() + timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+        citas.append(cita)
+    
+    response = client.post('/citas/bulk', json=citas)
+    assert response.status_code == 201
+    data = response.get_json()
+    assert data['creadas'] == 3
+    assert all(resultado['status'] == 201 for resultado in data['resultados'])
+    assert len(client.get('/citas').get_json()) == 3
+
+def test_create_citas_bulk_conflictos(client, sample_cita):
+    """Test creación masiva con errores de validación y horarios ocupados"""
+    sample_cita['estado'] = 'confirmada'
+    client.post('/citas', json=sample_cita)
+    
+    libre = sample_cita.copy()
+    libre['fecha_hora'] = (datetime.utcnow() + timedelta(days=20)).strftime('%Y-%m-%d %H:%M:%S')
+    repetida = libre.copy()
+    
+    response = client.post('/citas/bulk', json={'citas': [sample_cita, {'paciente_id': 1}, libre, repetida]})
+    assert response.status_code == 207
+    data = response.get_json()
+    assert data['creadas'] == 1
+    assert [resultado['status'] for resultado in data['resultados']] == [400, 400, 201, 400]
+    assert 'confirmada' in data['resultados'][0]['error']
+    assert 'confirmada' in data['resultados'][3]['error']
+
+def test_create_citas_bulk_vacio(client):
+    """Test creación masiva sin citas"""
+    response = client.post('/citas/bulk', json=[])
+    assert response.status_code == 400
+
+def test_get_citas_por_ids(client, sample_cita):
+    """Test obtener varias citas por id en una sola petición"""
+    ids = []
+    for dias in range(1, 3):
+        sample_cita['fecha_hora'] = (datetime.utcnow() + timedelta(days=dias)).strftime('%Y-%m-%d %H:%M:%S')
+        ids.append(client.post('/citas', json=sample_cita).get_json()['id'])
+    
+    response = client.get(f'/citas?ids={ids[1]},999,{ids[0]}')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert [cita['id'] for cita in data['citas']] == [ids[1], ids[0]]
+    assert data['no_encontradas'] == [999]
+    
+    assert client.get('/citas?ids=1,a').status_code == 400
+
+def test_get_cita_condicional(client, sample_cita):
+    """Test GET condicional de una cita con ETag y Last-Modified"""
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    
+    response = client.get(f'/citas/{cita_id}')
+    etag = response.headers['ETag']
+    assert response.headers['Last-Modified']
+    
+    response = client.get(f'/citas/{cita_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    
+    client.put(f'/citas/{cita_id}', json={'estado': 'confirmada'})
+    response = client.get(f'/citas/{cita_id}', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+def test_get_citas_condicional(client, sample_cita):
+    """Test GET condicional de los listados de citas"""
+    client.post('/citas', json=sample_cita)
+    
+    response = client.get('/citas/paciente/1')
+    etag = response.headers['ETag']
+    assert client.get('/citas/paciente/1', headers={'If-None-Match': etag}).status_code == 304
+    
+    sample_cita['fecha_hora'] = (datetime.utcnow() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    client.post('/citas', json=sample_cita)
+    assert client.get('/citas/paciente/1', headers={'If-None-Match': etag}).status_code == 200
+
+def test_get_citas_condicional_tras_borrar(client, sample_cita):
+    """Test que un listado no da 304 después de borrar una de sus citas"""
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    sample_cita['fecha_hora'] = (datetime.utcnow() + timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S')
+    client.post('/citas', json=sample_cita)
+    
+    response = client.get('/citas')
+    etag = response.headers['ETag']
+    # Sin Last-Modified el cliente no puede pedir el listado solo con If-Modified-Since
+    assert 'Last-Modified' not in response.headers
+    
+    client.delete(f'/citas/{cita_id}')
+    assert client.get('/citas', headers={'If-None-Match': etag}).status_code == 200
+    response = client.get('/citas', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 1
+
+def test_get_disponibilidad(client, sample_cita):
+    """Test búsqueda de horarios libres de un médico"""
+    availability.invalidate()
+    dia = (datetime.utcnow() + timedelta(days=14)).date()
+    while dia.weekday() != 0:
+        dia += timedelta(days=1)
+    sample_cita['fecha_hora'] = f'{dia} 08:30:00'
+    sample_cita['estado'] = 'confirmada'
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    
+    response = client.get(f'/citas/disponibilidad?medico=Dr. López&desde={dia}&limite=3')
+    assert response.status_code == 200
+    horarios = response.get_json()['horarios']
+    assert [h['inicio'] for h in horarios] == [f'{dia}T08:00:00', f'{dia}T09:00:00', f'{dia}T09:30:00']
+    
+    client.delete(f'/citas/{cita_id}')
+    response = client.get(f'/citas/disponibilidad?especialidad=Medicina General&desde={dia}&limite=2')
+    assert [h['inicio'] for h in response.get_json()['horarios']] == [f'{dia}T08:00:00', f'{dia}T08:30:00']
+
+def test_get_disponibilidad_medicos_libres(client, sample_cita):
+    """Test que la búsqueda por especialidad incluye a los médicos sin citas confirmadas"""
+    dia = (datetime.utcnow() + timedelta(days=14)).date()
+    while dia.weekday() != 0:
+        dia += timedelta(days=1)
+    # Una cita cancelada: el médico existe pero tiene toda la agenda libre
+    client.post('/citas', json=dict(sample_cita, medico='Dra. Libre', especialidad='Pediatría',
+                                    fecha_hora=f'{dia} 09:00:00', estado='cancelada'))
+    client.post('/citas', json=dict(sample_cita, fecha_hora=f'{dia} 08:00:00', estado='confirmada'))
+    availability.invalidate()
+    
+    response = client.get(f'/citas/disponibilidad?especialidad=Pediatría&desde={dia}&limite=2')
+    assert [(h['medico'], h['inicio']) for h in response.get_json()['horarios']] == [
+        ('Dra. Libre', f'{dia}T08:00:00'), ('Dra. Libre', f'{dia}T08:30:00')]
+    
+    # Con medico y especialidad, el médico tiene que atender esa especialidad
+    response = client.get(f'/citas/disponibilidad?medico=Dr. López&especialidad=Pediatría&desde={dia}')
+    assert response.get_json()['horarios'] == []
+    response = client.get(f'/citas/disponibilidad?medico=Dr. López&especialidad=Medicina General&desde={dia}&limite=1')
+    assert [(h['medico'], h['inicio']) for h in response.get_json()['horarios']] == [('Dr. López', f'{dia}T08:30:00')]
+
+def test_get_disponibilidad_parametros_invalidos(client):
+    """Test validación de parámetros de disponibilidad"""
+    assert client.get('/citas/disponibilidad').status_code == 400
+    assert client.get('/citas/disponibilidad?medico=X&desde=mañana').status_code == 400
+    assert client.get('/citas/disponibilidad?medico=X&duracion=0').status_code == 400
+    assert client.get('/citas/disponibilidad?medico=X&duracion=600').status_code == 400
+
+def test_get_disponibilidad_duracion_maxima(client, monkeypatch):
+    """Test que la duración máxima de la búsqueda es la misma que la de las citas"""
+    import app as citas_app
+    
+    monkeypatch.setattr(citas_app, 'MAX_DURACION_MINUTOS', 600)
+    response = client.get('/citas/disponibilidad?medico=X&duracion=600')
+    assert response.status_code == 200
+    assert response.get_json()['duracion'] == 600
+    monkeypatch.setattr(citas_app, 'MAX_DURACION_MINUTOS', 60)
+    assert client.get('/citas/disponibilidad?medico=X&duracion=90').status_code == 400
+    assert client.get('/citas/disponibilidad?medico=X&desde=2099-01-02&hasta=2099-01-01').status_code == 400
+
+def test_create_cita_solapada(client, sample_cita):
+    """Test rechazo de citas que se solapan con una cita confirmada del mismo médico"""
+    dia = (datetime.utcnow() + timedelta(days=10)).strftime('%Y-%m-%d')
+    sample_cita.update(fecha_hora=f'{dia} 10:00:00', estado='confirmada', duracion_minutos=60)
+    response = client.post('/citas', json=sample_cita)
+    assert response.status_code == 201
+    assert response.get_json()['duracion_minutos'] == 60
+    
+    sample_cita.update(fecha_hora=f'{dia} 10:45:00', duracion_minutos=30)
+    assert client.post('/citas', json=sample_cita).status_code == 400
+    sample_cita.update(fecha_hora=f'{dia} 09:45:00')
+    assert client.post('/citas', json=sample_cita).status_code == 400
+    sample_cita.update(fecha_hora=f'{dia} 11:00:00')
+    assert client.post('/citas', json=sample_cita).status_code == 201
+    sample_cita.update(fecha_hora=f'{dia} 12:00:00', duracion_minutos=0)
+    assert client.post('/citas', json=sample_cita).status_code == 400
+
+def test_update_cita_solapada(client, sample_cita):
+    """Test que reprogramar una cita vuelve a verificar la disponibilidad"""
+    dia = (datetime.utcnow() + timedelta(days=10)).strftime('%Y-%m-%d')
+    sample_cita.update(fecha_hora=f'{dia} 10:00:00', estado='confirmada')
+    client.post('/citas', json=sample_cita)
+    sample_cita.update(fecha_hora=f'{dia} 11:00:00')
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    
+    response = client.put(f'/citas/{cita_id}', json={'fecha_hora': f'{dia} 10:15:00'})
+    assert response.status_code == 400
+    assert client.get(f'/citas/{cita_id}').get_json()['fecha_hora'] == f'{dia}T11:00:00'
+    
+    assert client.put(f'/citas/{cita_id}', json={'duracion_minutos': 45}).status_code == 200
+    assert client.put(f'/citas/{cita_id}', json={'fecha_hora': f'{dia} 10:30:00'}).status_code == 200
+
+def test_create_citas_bulk_solapadas(client, sample_cita):
+    """Test detección de solapes dentro del mismo lote"""
+    dia = (datetime.utcnow() + timedelta(days=10)).strftime('%Y-%m-%d')
+    lote = [
+        dict(sample_cita, fecha_hora=f'{dia} 10:00:00', estado='confirmada', duracion_minutos=45),
+        dict(sample_cita, fecha_hora=f'{dia} 10:30:00', estado='confirmada'),
+        dict(sample_cita, fecha_hora=f'{dia} 10:45:00', estado='confirmada'),
+        dict(sample_cita, fecha_hora=f'{dia} 10:30:00', medico='Dra. Ruiz', estado='confirmada')
+    ]
+    response = client.post('/citas/bulk', json=lote)
+    assert response.status_code == 207
+    assert [r['status'] for r in response.get_json()['resultados']] == [201, 400, 201, 201]
+
+def test_verificar_esquema(client):
+    """Test del comando que informa índices faltantes y planes de ejecución"""
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['verificar-esquema'])
+    assert result.exit_code == 0
+    assert 'Todos los índices del modelo existen' in result.output
+    assert 'GET /citas/paciente/<id>' in result.output
+    
+    with app.app_context():
+        db.session.execute(db.text('DROP INDEX idx_citas_paciente_fecha'))
+        db.session.commit()
+    result = runner.invoke(args=['verificar-esquema'])
+    assert result.exit_code == 1
+    assert 'Falta el índice: idx_citas_paciente_fecha' in result.output
+    
+    result = runner.invoke(args=['verificar-esquema', '--crear'])
+    assert 'Índice creado: idx_citas_paciente_fecha' in result.output
+
+def test_migraciones():
+    """Test que las migraciones crean el esquema del modelo y se aplican una sola vez"""
+    import sqlalchemy as sa
+    import migraciones
+    
+    engine = sa.create_engine('sqlite://')
+    applied = migraciones.migrate(engine)
+    assert [version for version, _ in applied] == [version for version, _, _ in migraciones.MIGRACIONES]
+    assert migraciones.migrate(engine) == []
+    
+    inspector = sa.inspect(engine)
+    assert {column['name'] for column in inspector.get_columns('citas')} == set(Cita.__table__.columns.keys())
+    assert {index['name'] for index in inspector.get_indexes('citas')} == {index.name for index in Cita.__table__.indexes}
+
+def test_migracion_citas_solapadas(monkeypatch):
+    """Test que la migración de la restricción sin solapes se detiene ante citas confirmadas solapadas"""
+    import sqlalchemy as sa
+    import migraciones
+    
+    # Base creada con db.create_all() antes de que se controlaran los solapes
+    engine = sa.create_engine('sqlite://')
+    Cita.__table__.create(engine)
+    inicio = datetime(2030, 1, 7, 9, 0)
+    with engine.begin() as connection:
+        connection.execute(Cita.__table__.insert(), [
+            {'id': 1, 'paciente_id': 1, 'fecha_hora': inicio, 'especialidad': 'X', 'medico': 'Dr. A',
+             'duracion_minutos': 60, 'estado': 'confirmada'},
+            {'id': 2, 'paciente_id': 2, 'fecha_hora': inicio + timedelta(minutes=30), 'especialidad': 'X',
+             'medico': 'Dr. A', 'duracion_minutos': 30, 'estado': 'confirmada'},
+            {'id': 3, 'paciente_id': 3, 'fecha_hora': inicio + timedelta(minutes=60), 'especialidad': 'X',
+             'medico': 'Dr. A', 'duracion_minutos': 30, 'estado': 'confirmada'},
+            {'id': 4, 'paciente_id': 4, 'fecha_hora': inicio, 'especialidad': 'X', 'medico': 'Dr. B',
+             'duracion_minutos': 30, 'estado': 'confirmada'}
+        ])
+    
+    with pytest.raises(migraciones.MigrationError, match='1 citas confirmadas.*: 2 con 1'):
+        migraciones.migrate(engine)
+    # La transacción se revierte completa: ninguna migración queda registrada
+    assert all(not aplicada for _, _, aplicada in migraciones.status(engine))
+    
+    monkeypatch.setenv('SOLAPES_A_PENDIENTE', 'true')
+    assert 4 in [version for version, _ in migraciones.migrate(engine)]
+    with engine.connect() as connection:
+        estados = dict(connection.execute(sa.text('SELECT id, estado FROM citas')).all())
+    assert estados == {1: 'confirmada', 2: 'pendiente', 3: 'confirmada', 4: 'confirmada'}
+
+def test_metrics_pool(client):
+    """Test de las métricas del pool de conexiones"""
+    client.get('/citas')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    pool = response.get_json()['pool']
+    assert pool['checkouts'] >= 1
+    assert {'connects', 'invalidations', 'waits', 'timeouts', 'pool_class'} <= set(pool)
+
+def test_pool_esperas(tmp_path):
+    """Test que el pool instrumentado cuenta las esperas y los timeouts"""
+    import sqlalchemy as sa
+    from conexiones import InstrumentedQueuePool, pool_stats
+    
+    engine = sa.create_engine(f'sqlite:///{tmp_path}/pool.db', poolclass=InstrumentedQueuePool,
+                              pool_size=1, max_overflow=0, pool_timeout=0.05)
+    before = pool_stats(engine)
+    with engine.connect():
+        with pytest.raises(sa.exc.TimeoutError):
+            engine.connect()
+        stats = pool_stats(engine)
+        assert stats['checked_out'] == 1
+    assert stats['waits'] == before['waits'] + 1
+    assert stats['timeouts'] == before['timeouts'] + 1
+    assert stats['max_wait_seconds'] >= 0.05
+
+def test_lecturas_en_replica(client, sample_cita, tmp_path, monkeypatch):
+    """Test que los GET van a la réplica salvo justo después de una escritura del mismo cliente"""
+    import sqlalchemy as sa
+    import replicas
+    
+    replica = sa.create_engine(f'sqlite:///{tmp_path}/replica.db')
+    db.metadata.create_all(replica)
+    monkeypatch.setattr(replicas, 'DATABASE_READ_URLS', [str(replica.url)])
+    with app.app_context():
+        db.engines['replica_0'] = replica
+    try:
+        cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+        assert client.get_cookie('leer_primaria_citas') is not None
+        # Con la cookie de escritura reciente la lectura va a la primaria
+        assert client.get(f'/citas/{cita_id}').status_code == 200
+        
+        # Sin ella va a la réplica (vacía en esta prueba)
+        client.delete_cookie('leer_primaria_citas')
+        assert client.get(f'/citas/{cita_id}').status_code == 404
+        
+        routes = client.get('/metrics').get_json()['lecturas']['routes']
+        assert routes['get_cita']['primaria'] >= 1
+        assert routes['get_cita']['replica_0'] >= 1
+    finally:
+        with app.app_context():
+            del db.engines['replica_0']
+
+@pytest.mark.parametrize('serializer', ['orjson', 'std'])
+def test_listados_como_to_dict(client, sample_cita, serializer):
+    """Test que los listados leídos como tuplas se serializan igual que to_dict()"""
+    from serializacion import IsoJSONProvider, OrjsonProvider
+    
+    provider = app.json
+    app.json = OrjsonProvider(app) if serializer == 'orjson' else IsoJSONProvider(app)
+    try:
+        cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+        with app.app_context():
+            expected = db.session.get(Cita, cita_id).to_dict()
+        assert client.get('/citas').get_json() == [expected]
+        assert client.get(f'/citas?ids={cita_id}').get_json()['citas'] == [expected]
+        assert client.get(f'/citas/paciente/{sample_cita["paciente_id"]}').get_json() == [expected]
+        assert client.get('/citas/export?format=json').get_json() == [expected]
+        assert client.get('/citas?fields=fecha_hora').get_json() == [{'id': cita_id, 'fecha_hora': expected['fecha_hora']}]
+    finally:
+        app.json = provider
+
+def test_compresion_listado(client, sample_cita):
+    """Test que los listados grandes se comprimen según Accept-Encoding y los pequeños no"""
+    import gzip
+    
+    for offset in range(40):
+        cita = dict(sample_cita, fecha_hora=(datetime.now() + timedelta(days=1, hours=offset)).strftime('%Y-%m-%d %H:%M:%S'))
+        client.post('/citas', json=cita)
+    plain = client.get('/citas')
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    
+    response = client.get('/citas', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+    assert int(response.headers['Content-Length']) < len(plain.data)
+    # ETag débil en la versión comprimida; la comparación débil sigue dando 304
+    assert response.headers['ETag'].startswith('W/')
+    assert client.get('/citas', headers={'Accept-Encoding': 'gzip', 'If-None-Match': response.headers['ETag']}).status_code == 304
+    
+    small = client.get('/citas?limit=1', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+    assert 'Content-Encoding' not in client.get('/citas', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+
+def test_compresion_export(client, sample_cita):
+    """Test que la exportación por streaming se comprime por bloques"""
+    import gzip
+    
+    client.post('/citas', json=sample_cita)
+    plain = client.get('/citas/export').data
+    response = client.get('/citas/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain
+
+def test_compresion_export_primer_bloque(client, sample_cita, monkeypatch):
+    """Test que cada bloque comprimido de la exportación se puede leer sin esperar al resto"""
+    import json
+    import zlib
+    import compresion
+    import app as citas_app
+    
+    monkeypatch.setattr(citas_app, 'EXPORT_BATCH_SIZE', 1)
+    monkeypatch.setattr(compresion, 'COMPRESSION_MIN_SIZE', 0)
+    for hora in ('09:00:00', '10:00:00'):
+        client.post('/citas', json=dict(sample_cita, fecha_hora=sample_cita['fecha_hora'][:11] + hora))
+    
+    decoders = {'gzip': lambda: zlib.decompressobj(31).decompress}
+    if compresion.brotli is not None:
+        decoders['br'] = lambda: compresion.brotli.Decompressor().process
+    if compresion.zstandard is not None:
+        decoders['zstd'] = lambda: compresion.zstandard.ZstdDecompressor().decompressobj().decompress
+    for algorithm, decoder in decoders.items():
+        response = client.get('/citas/export', headers={'Accept-Encoding': algorithm}, buffered=False)
+        assert response.headers['Content-Encoding'] == algorithm
+        try:
+            primero = decoder()(next(iter(response.response))).decode()
+        finally:
+            response.close()
+        assert primero.endswith('\n') and json.loads(primero)['fecha_hora'].endswith('09:00:00')
+
+def test_metrics_por_ruta(client, sample_cita):
+    """Test de la latencia, los códigos de estado y las consultas SQL por ruta"""
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    client.get(f'/citas/{cita_id}')
+    client.get('/citas/999999')
+    
+    rutas = client.get('/metrics').get_json()['rutas']
+    por_id = rutas['GET /citas/<int:id>']
+    assert por_id['status']['200'] >= 1 and por_id['status']['404'] >= 1
+    assert por_id['latency_ms']['count'] >= 2
+    assert por_id['latency_ms']['p50'] <= por_id['latency_ms']['p99']
+    assert rutas['POST /citas']['db']['queries'] >= 1
+    assert rutas['POST /citas']['db']['time_ms']['count'] >= 1
+
+def test_metrics_prometheus(client):
+    """Test del formato de texto de Prometheus según Accept"""
+    client.get('/citas')
+    accept = 'application/openmetrics-text;version=1.0.0;q=0.75,text/plain;version=0.0.4;q=0.5,*/*;q=0.1'
+    response = client.get('/metrics', headers={'Accept': accept})
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_requests_total{app="citas",route="/citas",method="GET",status="200"}' in text
+    assert 'http_request_duration_seconds_bucket{app="citas",route="/citas",method="GET",le="+Inf"}' in text
+    assert 'db_queries_per_request_count{app="citas",route="/citas",method="GET"}' in text
+    assert 'db_pool_checkouts{app="citas"}' in text
+    assert client.get('/metrics?format=prometheus').mimetype == 'text/plain'
+
+def test_trazas_traceparent(client, sample_cita):
+    """Test que la petición continúa la traza del traceparent recibido y registra SQL y serialización"""
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    response = client.post('/citas', json=sample_cita,
+                           headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'})
+    assert response.headers['X-Trace-Id'] == trace_id
+    
+    spans = client.get(f'/trazas/{trace_id}').get_json()
+    server = next(span for span in spans if span['kind'] == 'server')
+    assert server['name'] == 'POST /citas'
+    assert server['parent_id'] == '00f067aa0ba902b7'
+    assert server['attributes']['http.status_code'] == 201
+    names = {span['name'] for span in spans}
+    assert {'db.query', 'db.commit', 'json.serialize'} <= names
+    assert all(span['service'] == 'citas' for span in spans)
+    commit = next(span for span in spans if span['name'] == 'db.commit')
+    assert any(span['parent_id'] == commit['span_id'] and 'INSERT' in span['attributes']['db.statement']
+               for span in spans)
+    assert 'POST /citas' in client.get(f'/trazas/{trace_id}?formato=texto').get_data(as_text=True)
+    # Una traza nueva por petición sin traceparent
+    assert client.get('/citas').headers['X-Trace-Id'] != trace_id
+
+def test_consultas_lentas(client, sample_cita, monkeypatch, caplog):
+    """Test que las consultas sobre el umbral se registran en el log con parámetros y plan de ejecución"""
+    import consultas
+    
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    monkeypatch.setattr(consultas, 'SLOW_QUERY_MS', 0.000001)
+    with caplog.at_level('WARNING'):
+        client.get(f'/citas/{cita_id}')
+    assert 'Consulta lenta' in caplog.text
+    assert f'parámetros: ({cita_id},' in caplog.text
+    assert 'plan: ' in caplog.text
+    
+    lenta = consultas.query_stats()['recent_slow'][-1]
+    assert lenta['route'] == 'GET /citas/<int:id>'
+    assert lenta['statement'].lstrip().startswith('SELECT')
+    assert set(lenta) == {'route', 'ms', 'statement'}
+
+def test_consultas_lentas_sin_parametros_en_metrics(client, sample_cita, monkeypatch):
+    """Test que /metrics no expone los valores de las consultas lentas"""
+    import consultas
+    
+    monkeypatch.setattr(consultas, 'SLOW_QUERY_MS', 0.000001)
+    # El medico va como parámetro en el INSERT y en la consulta de solapes
+    client.post('/citas', json={**sample_cita, 'medico': 'Dr. Secreto 7731', 'motivo': 'Motivo 7731'})
+    monkeypatch.setattr(consultas, 'SLOW_QUERY_MS', 0)
+    
+    response = client.get('/metrics')
+    assert response.get_json()['consultas']['recent_slow']
+    assert b'7731' not in response.data
+
+def test_presupuesto_consultas(client, sample_cita, monkeypatch):
+    """Test que una ruta sobre su presupuesto de consultas falla en modo estricto y se registra si no"""
+    import consultas
+    
+    cita_id = client.post('/citas', json=sample_cita).get_json()['id']
+    monkeypatch.setattr(app.view_functions['get_cita'], 'query_budget', 0)
+    with pytest.raises(consultas.QueryBudgetExceeded, match=r'GET /citas/<int:id> hizo 1 consultas SQL \(presupuesto 0\)'):
+        client.get(f'/citas/{cita_id}')
+    
+    app.config['QUERY_BUDGET_STRICT'] = False
+    over_budget = consultas.query_stats()['over_budget']
+    assert client.get(f'/citas/{cita_id}').status_code == 200
+    stats = client.get('/metrics').get_json()['consultas']
+    assert stats['over_budget'] == over_budget + 1
+    assert stats['recent_over_budget'][-1]['queries'] == 1
+
+def test_perfil_protegido(client, monkeypatch):
+    """Test que /perfil no existe sin activar y exige el token"""
+    import perfilado
+    
+    assert client.get('/perfil?segundos=0.05').status_code == 404
+    monkeypatch.setattr(perfilado, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(perfilado, 'PROFILING_TOKEN', 's3cr3t')
+    assert client.get('/perfil?segundos=0.05').status_code == 401
+    assert client.get('/perfil?segundos=0.05', headers={'Authorization': 'Bearer otro'}).status_code == 401
+    assert client.get('/perfil?segundos=600', headers={'Authorization': 'Bearer s3cr3t'}).status_code == 400
+    
+    multithread = {'wsgi.multithread': True}
+    response = client.get('/perfil?segundos=0.05', headers={'Authorization': 'Bearer s3cr3t'},
+                          environ_overrides=multithread)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    for line in response.get_data(as_text=True).splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) >= 1 and ';' in stack
+
+def test_perfil_worker_sync(client, monkeypatch):
+    """Test que en un worker sync (wsgi.multithread falso, como el cliente de pruebas) el muestreo
+    corre en segundo plano y el resultado se consulta en /perfil/<id>"""
+    import perfilado
+    
+    monkeypatch.setattr(perfilado, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(perfilado, 'PROFILING_TOKEN', 's3cr3t')
+    auth = {'Authorization': 'Bearer s3cr3t'}
+    response = client.get('/perfil?segundos=0.2', headers=auth)
+    assert response.status_code == 202
+    url = response.headers['Location']
+    assert response.get_json()['resultado'] == url
+    assert int(response.headers['Retry-After']) >= 1
+    # Solo un muestreo a la vez por worker
+    assert client.get('/perfil?segundos=0.2', headers=auth).status_code == 409
+    
+    # El worker sigue atendiendo mientras tanto, y su hilo queda en el perfil
+    response = client.get(url, headers=auth)
+    assert response.status_code == 202
+    assert client.get(url).status_code == 401
+    deadline = time.time() + 5
+    while response.status_code == 202 and time.time() < deadline:
+        client.get('/citas')
+        response = client.get(url, headers=auth)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert 'test_perfil_worker_sync' in response.get_data(as_text=True)
+    assert client.get('/perfil/0-0', headers=auth).status_code == 404
+
+def test_perfil_peticiones_lentas():
+    """Test que solo se conserva el perfil de las peticiones que superan el umbral"""
+    import threading
+    import time
+    import perfilado
+    
+    def calcular():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+    
+    profiler = perfilado.SlowRequestProfiler(threshold_ms=20, interval_ms=1)
+    profiler.begin('GET /rapida')
+    profiler.end(0.001)
+    worker = threading.Thread(target=lambda: (profiler.begin('GET /lenta'), calcular(), profiler.end(0.05)))
+    worker.start()
+    worker.join()
+    
+    assert [profile['route'] for profile in profiler.profiles] == ['GET /lenta']
+    assert profiler.profiles[0]['muestras'] > 0
+    assert ';calcular (' in profiler.profiles[0]['folded']
+    assert profiler.profiles[0]['folded'].startswith('GET /lenta;')
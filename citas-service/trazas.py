@@ -0,0 +1,375 @@
+"""Trazas distribuidas con propagación W3C traceparent
+
+Cada petición abre un span de servidor con la ruta, continuando la traza del
+gateway si llega la cabecera traceparent. Dentro se anotan como spans hijos
+las llamadas a los microservicios (gateway), las consultas SQL, los commits y
+la serialización JSON (servicios). Los spans terminados se exportan en
+memoria (GET /trazas) o a un archivo JSON lines (TRACING_FILE), sin
+necesidad de un colector externo.
+
+Uso sin servidor: python trazas.py trazas.jsonl <trace_id>
+"""
+import contextvars
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from flask import g, request
+
+# Desactivadas por defecto: /trazas no pide autenticación y muestra sentencias SQL e ids
+TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+# Fracción de trazas nuevas que se registran (las que llegan con traceparent siguen su flag)
+TRACING_SAMPLE_RATIO = float(os.getenv('TRACING_SAMPLE_RATIO', 1.0))
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'memoria')  # memoria, archivo o ninguno
+TRACING_FILE = os.getenv('TRACING_FILE', 'trazas.jsonl')
+TRACING_BUFFER_SIZE = int(os.getenv('TRACING_BUFFER_SIZE', 5000))
+MAX_STATEMENT_LENGTH = 500
+# Rutas de operación que no se trazan (Prometheus, health checks, consulta de trazas y perfilado)
+UNTRACED_PATHS = ('/metrics', '/health', '/trazas', '/perfil')
+
+TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})')
+
+_current = contextvars.ContextVar('span_actual', default=None)
+
+
+class Span:
+    """Operación con inicio, duración, atributos y su posición en la traza"""
+    __slots__ = ('service', 'name', 'kind', 'trace_id', 'span_id', 'parent_id', 'sampled',
+                 'attributes', 'start', '_started', 'duration')
+
+    def __init__(self, service, name, kind, trace_id, parent_id, sampled, attributes):
+        self.service = service
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = f'{random.getrandbits(64):016x}'
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.attributes = attributes
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'service': self.service,
+            'name': self.name,
+            'kind': self.kind,
+            'start': self.start,
+            'duration_ms': round(self.duration * 1000, 3),
+            'attributes': self.attributes
+        }
+
+
+class _NoopSpan:
+    """Span que no registra nada (trazas desactivadas)"""
+    trace_id = None
+
+    def set(self, key, value):
+        pass
+
+    def traceparent(self):
+        return None
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+# ==================== EXPORTADORES ====================
+
+class MemoryExporter:
+    """Últimos TRACING_BUFFER_SIZE spans del proceso"""
+
+    def __init__(self, size):
+        self._spans = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span.to_dict())
+
+    def spans(self, trace_id=None):
+        with self._lock:
+            return [span for span in self._spans if trace_id is None or span['trace_id'] == trace_id]
+
+
+class FileExporter:
+    """Spans como JSON lines en un archivo (todos los workers escriben en el mismo)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+        self._pid = None
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                # Un archivo abierto por proceso, en modo append para no pisar a otros workers
+                self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+                self._pid = os.getpid()
+            self._file.write(line)
+
+    def spans(self, trace_id=None):
+        return [span for span in read_file(self.path) if trace_id is None or span['trace_id'] == trace_id]
+
+
+def read_file(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+if TRACING_EXPORTER == 'archivo':
+    exporter = FileExporter(TRACING_FILE)
+elif TRACING_EXPORTER == 'memoria':
+    exporter = MemoryExporter(TRACING_BUFFER_SIZE)
+else:
+    exporter = None
+
+# ==================== SPANS ====================
+
+def parse_traceparent(value):
+    """(trace_id, parent_id, sampled) de una cabecera traceparent válida, si no None"""
+    match = TRACEPARENT.match((value or '').strip().lower())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or parent_id == '0' * 16:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+def current_span():
+    return _current.get()
+
+
+def activate(span):
+    """Hacer de span el span actual; devuelve el token para deactivate()"""
+    return _current.set(span)
+
+
+def deactivate(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # El token es de otro contexto (p. ej. una respuesta por streaming)
+        _current.set(None)
+
+
+def start_span(name, kind='internal', remote=None, attributes=None, service=None):
+    """Crear un span hijo del actual (o de remote=(trace_id, parent_id, sampled)) sin activarlo
+
+    Los spans de servidor indican el servicio; los hijos heredan el del span actual.
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    parent = _current.get()
+    if parent is NOOP_SPAN:
+        parent = None
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    elif parent is not None:
+        trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+    else:
+        trace_id, parent_id, sampled = f'{random.getrandbits(128):032x}', None, random.random() < TRACING_SAMPLE_RATIO
+    service = service or (parent.service if parent is not None else 'app')
+    return Span(service, name, kind, trace_id, parent_id, sampled, attributes or {})
+
+
+def end_span(span, error=None):
+    if span is NOOP_SPAN or span.duration is not None:
+        return
+    span.duration = time.perf_counter() - span._started
+    if error is not None:
+        span.set('error', repr(error))
+    if span.sampled and exporter is not None:
+        exporter.export(span)
+
+
+@contextmanager
+def span(name, kind='internal', **attributes):
+    """Span hijo del actual, activo mientras dura el bloque (nada si no hay una traza en curso)"""
+    if _current.get() is None:
+        yield NOOP_SPAN
+        return
+    current = start_span(name, kind, attributes=attributes)
+    token = activate(current)
+    try:
+        yield current
+    except Exception as e:
+        end_span(current, e)
+        raise
+    finally:
+        deactivate(token)
+        end_span(current)
+
+
+# ==================== FLASK Y SQLALCHEMY ====================
+
+_queries_traced = False
+
+
+def _trace_queries():
+    """Spans de cada consulta SQL y de cada commit de la sesión"""
+    global _queries_traced
+    if _queries_traced:
+        return
+    _queries_traced = True
+    # Solo los servicios usan SQLAlchemy; el gateway no lo instala ni tiene sentencias.py
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    from sqlalchemy.orm import Session
+
+    from sentencias import on_query
+
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            context._traza_span = start_span('db.query', 'client', attributes={
+                'db.system': conn.dialect.name,
+                'db.statement': statement[:MAX_STATEMENT_LENGTH]
+            })
+
+    def end_query(conn, cursor, statement, parameters, context, executemany, seconds):
+        query_span = getattr(context, '_traza_span', None)
+        if query_span is not None:
+            query_span.set('db.rows', cursor.rowcount)
+            end_span(query_span)
+
+    on_query(start_query, end_query)
+
+    @event.listens_for(Engine, 'handle_error')
+    def failed_query(exception_context):
+        query_span = getattr(exception_context.execution_context, '_traza_span', None)
+        if query_span is not None:
+            end_span(query_span, exception_context.original_exception)
+
+    # El commit incluye el flush: los INSERT/UPDATE quedan como hijos de db.commit
+    @event.listens_for(Session, 'before_commit')
+    def start_commit(session):
+        if _current.get() is not None:
+            commit_span = start_span('db.commit')
+            session.info['traza_commit'] = (commit_span, activate(commit_span))
+
+    def end_commit(session, error=None):
+        commit_span, token = session.info.pop('traza_commit', (None, None))
+        if commit_span is not None:
+            deactivate(token)
+            end_span(commit_span, error)
+
+    event.listen(Session, 'after_commit', end_commit)
+    event.listen(Session, 'after_rollback', lambda session: end_commit(session, 'rollback'))
+
+
+def init_tracing(app, service, database=False):
+    """Abrir un span de servidor por petición, continuando el traceparent recibido
+
+    La respuesta incluye X-Trace-Id para buscar la traza en /trazas/<trace_id>.
+    """
+    if not TRACING_ENABLED:
+        return
+    if database:
+        _trace_queries()
+
+    @app.before_request
+    def start_request_span():
+        if request.path.startswith(UNTRACED_PATHS):
+            return
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        request_span = start_span(f'{request.method} {route}', 'server',
+                                  remote=parse_traceparent(request.headers.get('traceparent')),
+                                  attributes={'http.method': request.method, 'http.route': route,
+                                              'http.target': request.full_path.rstrip('?')},
+                                  service=service)
+        g.trace_span = request_span
+        g.trace_token = activate(request_span)
+
+    @app.after_request
+    def tag_response(response):
+        request_span = g.get('trace_span')
+        if request_span is not None:
+            request_span.set('http.status_code', response.status_code)
+            response.headers['X-Trace-Id'] = request_span.trace_id
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        request_span = g.pop('trace_span', None)
+        if request_span is None:
+            return
+        deactivate(g.pop('trace_token'))
+        end_span(request_span, exc)
+
+
+# ==================== CONSULTA ====================
+
+def trace_summaries(limit=50):
+    """Trazas más recientes del exportador con su span raíz local"""
+    traces = OrderedDict()
+    for span_dict in reversed(exporter.spans() if exporter is not None else []):
+        summary = traces.setdefault(span_dict['trace_id'], {'trace_id': span_dict['trace_id'], 'spans': 0})
+        summary['spans'] += 1
+        if span_dict['kind'] == 'server':
+            summary.update(name=span_dict['name'], start=span_dict['start'], duration_ms=span_dict['duration_ms'])
+    return list(traces.values())[:limit]
+
+
+def trace_spans(trace_id):
+    """Spans de una traza ordenados por inicio"""
+    spans = exporter.spans(trace_id) if exporter is not None else []
+    return sorted(spans, key=lambda span_dict: span_dict['start'])
+
+
+def merge_spans(*groups):
+    """Unir los spans de varios procesos sin repetidos (p. ej. con un mismo TRACING_FILE), ordenados por inicio"""
+    spans = {}
+    for group in groups:
+        for span_dict in group:
+            spans.setdefault(span_dict['span_id'], span_dict)
+    return sorted(spans.values(), key=lambda span_dict: span_dict['start'])
+
+
+def format_tree(spans):
+    """Traza como árbol de texto con la duración y el desfase de cada span"""
+    if not spans:
+        return ''
+    children = {}
+    ids = {span_dict['span_id'] for span_dict in spans}
+    for span_dict in sorted(spans, key=lambda item: item['start']):
+        parent = span_dict['parent_id'] if span_dict['parent_id'] in ids else None
+        children.setdefault(parent, []).append(span_dict)
+    origin = min(span_dict['start'] for span_dict in spans)
+    lines = []
+
+    def walk(parent, depth):
+        for span_dict in children.get(parent, []):
+            detail = span_dict['attributes'].get('db.statement', '').split('\n')[0][:80]
+            lines.append(f"{(span_dict['start'] - origin) * 1000:>9.1f} ms {span_dict['duration_ms']:>9.1f} ms  "
+                         f"{'  ' * depth}[{span_dict['service']}] {span_dict['name']} {detail}".rstrip())
+            walk(span_dict['span_id'], depth + 1)
+
+    walk(None, 0)
+    return '\n'.join(lines) + '\n'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('Uso: python trazas.py <archivo.jsonl> <trace_id>')
+    print(format_tree([span for span in read_file(sys.argv[1]) if span['trace_id'] == sys.argv[2]]), end='')
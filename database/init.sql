@@ -29,6 +29,7 @@ CREATE TABLE IF NOT EXISTS citas (
     fecha_hora TIMESTAMP NOT NULL,
     especialidad VARCHAR(100) NOT NULL,
     medico VARCHAR(100) NOT NULL,
+    duracion_minutos INTEGER NOT NULL DEFAULT 30,
     motivo TEXT,
     estado VARCHAR(20) DEFAULT 'pendiente',
     observaciones TEXT,
@@ -37,12 +38,22 @@ CREATE TABLE IF NOT EXISTS citas (
     CONSTRAINT fk_paciente FOREIGN KEY (paciente_id) REFERENCES pacientes(id) ON DELETE CASCADE
 );
 
--- Índices para mejorar el rendimiento
+-- Los cambios de esquema de una base existente (duracion_minutos y la restricción
+-- citas_sin_solape, que revisa antes si hay citas confirmadas solapadas) los aplica
+-- `flask --app app migrar` en citas-service; ver migraciones.py
+
+-- Índices para mejorar el rendimiento (los mismos que declara el modelo Cita;
+-- `flask --app app verificar-esquema` en citas-service informa los que falten)
 CREATE INDEX IF NOT EXISTS idx_pacientes_cedula ON pacientes(cedula);
-CREATE INDEX IF NOT EXISTS idx_citas_paciente_id ON citas(paciente_id);
-CREATE INDEX IF NOT EXISTS idx_citas_fecha_hora ON citas(fecha_hora);
-CREATE INDEX IF NOT EXISTS idx_citas_estado ON citas(estado);
-CREATE INDEX IF NOT EXISTS idx_citas_medico ON citas(medico);
+CREATE INDEX IF NOT EXISTS idx_citas_medico_fecha_confirmadas ON citas(medico, fecha_hora) WHERE estado = 'confirmada';
+CREATE INDEX IF NOT EXISTS idx_citas_fecha_confirmadas ON citas(fecha_hora) WHERE estado = 'confirmada';
+CREATE INDEX IF NOT EXISTS idx_citas_paciente_fecha ON citas(paciente_id, fecha_hora);
+
+-- Índices de una columna reemplazados por los anteriores
+DROP INDEX IF EXISTS idx_citas_paciente_id;
+DROP INDEX IF EXISTS idx_citas_fecha_hora;
+DROP INDEX IF EXISTS idx_citas_estado;
+DROP INDEX IF EXISTS idx_citas_medico;
 
 -- Datos de ejemplo (opcional)
 INSERT INTO pacientes (nombre, apellido, cedula, fecha_nacimiento, telefono, email, direccion)
@@ -1,9 +1,26 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, json, stream_with_context, url_for
+import click
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from itertools import islice
+import csv
+import hashlib
+import io
 import os
 
+from conexiones import engine_options, pool_stats
+import migraciones
+from replicas import RoutingSession, init_read_routing, read_stats, replica_binds
+from serializacion import json_provider
+from compresion import compression_stats, init_compression
+from metricas import PROMETHEUS_CONTENT_TYPE, gauges, init_metrics, prometheus_requested, render_prometheus, route_stats
+from trazas import format_tree, init_tracing, trace_spans, trace_summaries
+from perfilado import (FOLDED_CONTENT_TYPE, PROFILING_SLOW_REQUEST_MS, authorize, background_profile, blocks_worker, folded,
+                       init_profiling, parse_seconds, retry_after, sample, save, slow_profiles, start_background)
+from consultas import init_query_profiling, query_budget, query_stats
+
 app = Flask(__name__)
+app.json = json_provider(app)
 
 # Configuración de la base de datos
 DATABASE_URL = os.getenv(
@@ -12,8 +29,36 @@ DATABASE_URL = os.getenv(
 )
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URL)
+app.config['SQLALCHEMY_BINDS'] = replica_binds()
+DB_AUTO_CREATE = os.getenv('DB_AUTO_CREATE', 'true').lower() == 'true'
+
+# Paginación por cursor (keyset sobre id)
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+MAX_IDS = int(os.getenv('MAX_IDS', 500))
+
+# Exportación completa por streaming (filas leídas por lotes con cursor del servidor)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_FORMATS = {'ndjson': 'application/x-ndjson', 'json': 'application/json'}
 
-db = SQLAlchemy(app)
+# Importación masiva de pacientes
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 500))
+IMPORT_CONFLICT_MODES = ('error', 'skip', 'update')
+IMPORT_SUMMARY_KEYS = {
+    'creado': 'creados',
+    'actualizado': 'actualizados',
+    'omitido': 'omitidos',
+    'error': 'errores'
+}
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+init_read_routing(app, cookie_name='leer_primaria_pacientes')
+init_compression(app)
+init_metrics(app, database=True)
+init_tracing(app, 'pacientes', database=True)
+init_query_profiling(app)
+init_profiling(app)
 
 # Modelo de Paciente
 class Paciente(db.Model):
@@ -44,77 +89,557 @@ class Paciente(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
 
-# Crear tablas automáticamente al iniciar
-with app.app_context():
-    db.create_all()
+def table_columns(model, fields=None):
+    """Columnas a seleccionar como tuplas: las de fields o la tabla completa"""
+    table = model.__table__
+    return [table.c[name] for name in fields] if fields else [table]
+
+def row_dicts(rows):
+    """Filas de la consulta como diccionarios, sin crear objetos del modelo
+
+    Las fechas quedan como date/datetime y el proveedor JSON de la app las
+    codifica en ISO 8601, igual que to_dict().
+    """
+    return [row._asdict() for row in rows]
+
+def parse_list_args(model):
+    """Leer los parámetros limit, cursor y fields de un listado"""
+    limit = request.args.get('limit')
+    cursor = request.args.get('cursor')
+    fields = request.args.get('fields')
+
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= MAX_PAGE_SIZE:
+            raise ValueError(f'El parámetro limit debe ser un entero entre 1 y {MAX_PAGE_SIZE}')
+        limit = int(limit)
+    if cursor is not None:
+        if not cursor.isdigit():
+            raise ValueError('El parámetro cursor debe ser un entero')
+        cursor = int(cursor)
+        if limit is None:
+            limit = DEFAULT_PAGE_SIZE
+    if fields is not None:
+        fields = [name.strip() for name in fields.split(',') if name.strip()]
+        invalid = [name for name in fields if name not in model.__table__.columns]
+        if not fields:
+            raise ValueError('El parámetro fields no puede estar vacío')
+        if invalid:
+            raise ValueError(f'Campos inválidos: {", ".join(invalid)}')
+        # El id siempre se incluye porque es la clave del cursor
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+    return limit, cursor, fields
+
+def list_page(model):
+    """Listar filas con paginación keyset sobre id y proyección de columnas en SQL
+
+    Devuelve la lista de diccionarios y el cursor de la siguiente página
+    (None si no hay más filas o si no se pidió paginación).
+    """
+    limit, cursor, fields = parse_list_args(model)
+
+    query = db.select(*table_columns(model, fields))
+    if cursor is not None:
+        query = query.where(model.id > cursor)
+    if limit is not None:
+        query = query.order_by(model.id).limit(limit + 1)
+
+    rows = db.session.execute(query).all()
+    next_cursor = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    return row_dicts(rows), next_cursor
+
+def parse_ids():
+    """Leer el parámetro ids=1,2,3 como lista de enteros sin repetidos"""
+    value = request.args.get('ids')
+    if value is None:
+        return None
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part.isdigit():
+            raise ValueError('El parámetro ids debe ser una lista de enteros separados por coma')
+        if int(part) not in ids:
+            ids.append(int(part))
+    if not 1 <= len(ids) <= MAX_IDS:
+        raise ValueError(f'El parámetro ids debe tener entre 1 y {MAX_IDS} valores')
+    return ids
+
+def list_by_ids(model, ids):
+    """Obtener varias filas por id con una sola consulta WHERE id IN (...)
+
+    Devuelve las filas en el orden pedido y los ids que no existen.
+    """
+    fields = parse_list_args(model)[2]
+    rows = db.session.execute(db.select(*table_columns(model, fields)).where(model.id.in_(ids))).all()
+    found = {item['id']: item for item in row_dicts(rows)}
+    return [found[id] for id in ids if id in found], [id for id in ids if id not in found]
+
+def make_etag(*parts):
+    """ETag fuerte a partir de los valores que identifican la versión de un recurso"""
+    return hashlib.sha1(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+def row_validators(row):
+    """ETag y Last-Modified de una fila a partir de su id y updated_at"""
+    return make_etag(row.id, row.updated_at), row.updated_at
+
+def list_validators(model, *criteria, paginated=True):
+    """ETag de un listado a partir de count y max(updated_at)
+
+    Se calcula sobre las mismas filas que devolvería el listado (filtros,
+    ids o página pedida), sin cargarlas ni serializarlas. Los listados no
+    llevan Last-Modified: max(updated_at) no cambia al borrar una fila y
+    If-Modified-Since daría 304 con datos viejos; el count del ETag sí.
+    """
+    stmt = db.select(model.id, model.updated_at).where(*criteria)
+    if paginated:
+        ids = parse_ids()
+        limit, cursor, _ = parse_list_args(model)
+        if ids is not None:
+            stmt = stmt.where(model.id.in_(ids))
+        else:
+            if cursor is not None:
+                stmt = stmt.where(model.id > cursor)
+            if limit is not None:
+                stmt = stmt.order_by(model.id).limit(limit + 1)
+    rows = stmt.subquery()
+    count, last_modified = db.session.execute(
+        db.select(db.func.count(), db.func.max(rows.c.updated_at))
+    ).one()
+    return make_etag(count, last_modified, request.query_string.decode())
+
+def not_modified(etag, last_modified=None):
+    """Respuesta 304 si la petición condicional coincide con la versión actual, si no None"""
+    if request.if_none_match:
+        # Comparación débil: las respuestas comprimidas llevan el ETag como W/"..."
+        matches = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        matches = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        matches = False
+    if not matches:
+        return None
+    return set_validators(Response(status=304), etag, last_modified)
+
+def set_validators(response, etag, last_modified=None):
+    """Agregar ETag y Last-Modified a la respuesta"""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+def paginated_response(items, next_cursor):
+    """Respuesta JSON con enlace a la siguiente página en la cabecera Link"""
+    response = jsonify(items)
+    if next_cursor is not None:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for(request.endpoint, **args)}>; rel="next"'
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+def export_response(model):
+    """Exportar toda la tabla como NDJSON o arreglo JSON por bloques
+
+    Las filas se leen con yield_per, así la memoria no depende del tamaño de la tabla.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Formato inválido. Use {" o ".join(EXPORT_FORMATS)}'}), 400
+
+    def generate():
+        stmt = db.select(*table_columns(model)).order_by(model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+        partitions = db.session.execute(stmt).partitions()
+        if fmt == 'ndjson':
+            for rows in partitions:
+                yield ''.join(json.dumps(item) + '\n' for item in row_dicts(rows))
+            return
+        separator = ''
+        yield '['
+        for rows in partitions:
+            yield separator + ','.join(json.dumps(item) for item in row_dicts(rows))
+            separator = ','
+        yield ']'
+
+    return Response(stream_with_context(generate()), mimetype=EXPORT_FORMATS[fmt])
+
+# Campos que una fila de la importación puede omitir
+OPTIONAL_COLUMNS = ('telefono', 'email', 'direccion')
+
+def validate_paciente(data):
+    """Validar los datos de un paciente nuevo
+
+    Devuelve (valores de las columnas, None) o (None, mensaje de error).
+    """
+    if not isinstance(data, dict):
+        return None, 'Los datos del paciente deben ser un objeto JSON'
+    
+    required_fields = ['nombre', 'apellido', 'cedula', 'fecha_nacimiento']
+    for field in required_fields:
+        if field not in data:
+            return None, f'Campo {field} es requerido'
+    
+    # Convertir fecha de nacimiento
+    try:
+        fecha_nacimiento = datetime.strptime(data['fecha_nacimiento'], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None, 'Formato de fecha inválido. Use YYYY-MM-DD'
+    
+    return {
+        'nombre': data['nombre'],
+        'apellido': data['apellido'],
+        'cedula': data['cedula'],
+        'fecha_nacimiento': fecha_nacimiento,
+        'telefono': data.get('telefono'),
+        'email': data.get('email'),
+        'direccion': data.get('direccion')
+    }, None
+
+def import_rows():
+    """Iterador de filas a importar según el tipo de contenido de la petición
+
+    Admite un arreglo JSON (o {"pacientes": [...]}), un cuerpo text/csv o un
+    archivo CSV en el campo "archivo" de un formulario multipart.
+    """
+    if request.mimetype == 'application/json':
+        data = request.get_json(silent=True)
+        items = data.get('pacientes') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError('Se espera una lista de pacientes')
+        return iter(items)
+    if request.mimetype == 'text/csv':
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig')
+    elif 'archivo' in request.files:
+        stream = io.TextIOWrapper(request.files['archivo'].stream, encoding='utf-8-sig')
+    else:
+        raise ValueError('Envíe un arreglo JSON, un cuerpo text/csv o un archivo CSV en el campo archivo')
+    # Las celdas vacías del CSV cuentan como campos ausentes, igual que en el JSON
+    return ({key: value for key, value in row.items() if key is not None and value not in ('', None)}
+            for row in csv.DictReader(stream))
+
+def read_chunk(rows, size):
+    """Leer hasta size filas a importar
+
+    Devuelve (filas, error): error es el UnicodeDecodeError o csv.Error que
+    cortó la lectura de un CSV (las filas leídas antes se conservan).
+    """
+    chunk = []
+    try:
+        for row in islice(rows, size):
+            chunk.append(row)
+    except (UnicodeDecodeError, csv.Error) as e:
+        return chunk, e
+    return chunk, None
+
+def upsert_statement(on_conflict, columns=OPTIONAL_COLUMNS):
+    """INSERT con ON CONFLICT (cedula) según el dialecto de la base de datos
+
+    Con on_conflict=update el SET incluye los campos requeridos y, de los
+    opcionales, solo los de columns.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return db.insert(Paciente)
+    stmt = insert(Paciente)
+    if on_conflict == 'update':
+        updated = {name: stmt.excluded[name] for name in ('nombre', 'apellido', 'fecha_nacimiento', *columns)}
+        updated['updated_at'] = datetime.utcnow()
+        return stmt.on_conflict_do_update(index_elements=['cedula'], set_=updated)
+    return stmt.on_conflict_do_nothing(index_elements=['cedula'])
+
+def import_chunk(chunk, first_row, on_conflict, seen):
+    """Importar un bloque de filas y devolver el resultado de cada una
+
+    La unicidad de las cédulas del bloque se comprueba con una sola consulta IN.
+    """
+    report = [None] * len(chunk)
+    valid = []
+    for offset, item in enumerate(chunk):
+        values, error = validate_paciente(item)
+        if not error and values['cedula'] in seen:
+            error = 'Cédula duplicada en el lote'
+        if error:
+            report[offset] = {'fila': first_row + offset, 'resultado': 'error', 'error': error}
+            continue
+        seen.add(values['cedula'])
+        valid.append((offset, values))
+
+    cedulas = [values['cedula'] for _, values in valid]
+    existing = set()
+    if cedulas:
+        existing = set(db.session.scalars(db.select(Paciente.cedula).where(Paciente.cedula.in_(cedulas))))
+
+    rows = []
+    for offset, values in valid:
+        if values['cedula'] in existing and on_conflict != 'update':
+            if on_conflict == 'skip':
+                result = {'resultado': 'omitido'}
+            else:
+                result = {'resultado': 'error', 'error': 'Ya existe un paciente con esa cédula'}
+            report[offset] = {'fila': first_row + offset, 'cedula': values['cedula'], **result}
+            continue
+        rows.append((offset, values))
+
+    if rows:
+        # Una fila que actualiza solo reemplaza los campos opcionales que trae (no vacíos): las
+        # filas se agrupan por esos campos y cada grupo va en un solo executemany
+        groups = {}
+        for _, values in rows:
+            columns = OPTIONAL_COLUMNS
+            if on_conflict == 'update':
+                columns = tuple(name for name in OPTIONAL_COLUMNS if values[name] not in (None, ''))
+            groups.setdefault(columns, []).append(values)
+        for columns, group in groups.items():
+            db.session.execute(upsert_statement(on_conflict, columns), group)
+        ids = dict(db.session.execute(
+            db.select(Paciente.cedula, Paciente.id).where(
+                Paciente.cedula.in_([values['cedula'] for _, values in rows])
+            )
+        ).all())
+        for offset, values in rows:
+            cedula = values['cedula']
+            report[offset] = {
+                'fila': first_row + offset,
+                'cedula': cedula,
+                'resultado': 'actualizado' if cedula in existing else 'creado',
+                'id': ids.get(cedula)
+            }
+    return report
+
+# Crear tablas automáticamente al iniciar (desarrollo). En producción el esquema
+# se crea con `flask --app app migrar` antes de arrancar y los workers no lo revisan.
+if DB_AUTO_CREATE:
+    with app.app_context():
+        db.create_all()
 
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
     return jsonify({'status': 'Pacientes service is running'}), 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas del worker: latencia y SQL por ruta, pool, lecturas por nodo, compresión y consultas lentas
+
+    Devuelve JSON, o el formato de texto de Prometheus si Accept lo prefiere
+    (como hace Prometheus) o con ?format=prometheus.
+    """
+    pool = pool_stats(db.engine)
+    lecturas = read_stats()
+    compresion = compression_stats()
+    consultas = query_stats()
+    if prometheus_requested(request.headers.get('Accept'), request.args.get('format')):
+        extra = gauges('db_pool', pool)
+        for endpoint, nodes in lecturas['routes'].items():
+            extra += [('db_read_requests', float(count), {'endpoint': endpoint, 'node': node}) for node, count in nodes.items()]
+        for algorithm, stats in compresion['algorithms'].items():
+            extra += gauges('compression', stats, algorithm=algorithm)
+        extra += gauges('db_profile', consultas)
+        return Response(render_prometheus('pacientes', extra), content_type=PROMETHEUS_CONTENT_TYPE)
+    return jsonify({
+        'pid': os.getpid(),
+        'rutas': route_stats(),
+        'pool': pool,
+        'lecturas': lecturas,
+        'compresion': compresion,
+        'consultas': consultas
+    }), 200
+
+@app.route('/perfil', methods=['GET'])
+def get_perfil():
+    """Perfil por muestreo de los hilos del worker durante ?segundos=N, en formato collapsed
+
+    En un worker sync el muestreo corre en segundo plano y se responde 202 con
+    la URL del resultado en Location.
+    """
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'No autorizado' if error == 401 else 'No encontrado'}), error
+    try:
+        seconds = parse_seconds(request.args.get('segundos'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not blocks_worker(request.environ):
+        counts = sample(seconds)
+        save('muestreo', counts)
+        return Response(folded(counts), content_type=FOLDED_CONTENT_TYPE)
+    profile = start_background(seconds)
+    if profile is None:
+        return jsonify({'error': 'Ya hay un muestreo en curso en este worker'}), 409
+    url = url_for('get_perfil_resultado', id=profile['id'])
+    response = jsonify({'id': profile['id'], 'segundos': seconds, 'resultado': url})
+    response.headers['Location'] = url
+    response.headers['Retry-After'] = str(retry_after(profile))
+    return response, 202
+
+@app.route('/perfil/<id>', methods=['GET'])
+def get_perfil_resultado(id):
+    """Resultado de un muestreo en segundo plano (202 mientras sigue en curso)"""
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'No autorizado' if error == 401 else 'No encontrado'}), error
+    profile = background_profile(id)
+    if profile is None:
+        return jsonify({'error': 'Perfil no encontrado en este worker', 'pid': os.getpid()}), 404
+    if profile['counts'] is None:
+        response = jsonify({'id': id, 'segundos': profile['segundos'], 'resultado': request.path})
+        response.headers['Retry-After'] = str(retry_after(profile))
+        return response, 202
+    return Response(folded(profile['counts']), content_type=FOLDED_CONTENT_TYPE)
+
+@app.route('/perfil/lentas', methods=['GET'])
+def get_perfiles_lentos():
+    """Perfiles de las últimas peticiones lentas del worker (?ruta= filtra; ?formato=collapsed los une)"""
+    error = authorize(request.headers.get('Authorization'))
+    if error:
+        return jsonify({'error': 'No autorizado' if error == 401 else 'No encontrado'}), error
+    profiles = slow_profiles(request.args.get('ruta'))
+    if request.args.get('formato') == 'collapsed':
+        return Response(''.join(profile['folded'] for profile in profiles), content_type=FOLDED_CONTENT_TYPE)
+    return jsonify({'umbral_ms': PROFILING_SLOW_REQUEST_MS, 'pid': os.getpid(), 'perfiles': profiles}), 200
+
+@app.route('/trazas', methods=['GET'])
+def get_trazas():
+    """Trazas recientes registradas por este worker"""
+    return jsonify(trace_summaries()), 200
+
+@app.route('/trazas/<trace_id>', methods=['GET'])
+def get_traza(trace_id):
+    """Spans de una traza en este worker (?formato=texto para verlos como árbol)"""
+    spans = trace_spans(trace_id)
+    if request.args.get('formato') == 'texto':
+        return Response(format_tree(spans), mimetype='text/plain')
+    return jsonify(spans), 200
+
 @app.route('/pacientes', methods=['GET'])
+@query_budget(2)
 def get_pacientes():
-    """Obtener todos los pacientes"""
+    """Obtener todos los pacientes (paginación con limit/cursor, proyección con fields o lote con ids)"""
     try:
-        pacientes = Paciente.query.all()
-        return jsonify([paciente.to_dict() for paciente in pacientes]), 200
+        etag = list_validators(Paciente)
+        unchanged = not_modified(etag)
+        if unchanged:
+            return unchanged
+        ids = parse_ids()
+        if ids is not None:
+            pacientes, missing = list_by_ids(Paciente, ids)
+            response = jsonify({'pacientes': pacientes, 'no_encontrados': missing})
+        else:
+            pacientes, next_cursor = list_page(Paciente)
+            response = paginated_response(pacientes, next_cursor)
+        return set_validators(response, etag), 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pacientes/export', methods=['GET'])
+def export_pacientes():
+    """Exportar todos los pacientes por streaming (format=ndjson o json)"""
+    return export_response(Paciente)
+
 @app.route('/pacientes/<int:id>', methods=['GET'])
+@query_budget(1)
 def get_paciente(id):
     """Obtener un paciente por ID"""
     try:
         paciente = Paciente.query.get(id)
         if not paciente:
             return jsonify({'error': 'Paciente no encontrado'}), 404
-        return jsonify(paciente.to_dict()), 200
+        etag, last_modified = row_validators(paciente)
+        unchanged = not_modified(etag, last_modified)
+        if unchanged:
+            return unchanged
+        return set_validators(jsonify(paciente.to_dict()), etag, last_modified), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/pacientes', methods=['POST'])
+@query_budget(3)
 def create_paciente():
     """Crear un nuevo paciente"""
     try:
         data = request.get_json()
         
         # Validaciones
-        required_fields = ['nombre', 'apellido', 'cedula', 'fecha_nacimiento']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'error': f'Campo {field} es requerido'}), 400
+        values, error = validate_paciente(data)
+        if error:
+            return jsonify({'error': error}), 400
         
         # Verificar si ya existe un paciente con esa cédula
-        existing = Paciente.query.filter_by(cedula=data['cedula']).first()
+        existing = Paciente.query.filter_by(cedula=values['cedula']).first()
         if existing:
             return jsonify({'error': 'Ya existe un paciente con esa cédula'}), 400
         
-        # Convertir fecha de nacimiento
-        fecha_nacimiento = datetime.strptime(data['fecha_nacimiento'], '%Y-%m-%d').date()
-        
         # Crear paciente
-        paciente = Paciente(
-            nombre=data['nombre'],
-            apellido=data['apellido'],
-            cedula=data['cedula'],
-            fecha_nacimiento=fecha_nacimiento,
-            telefono=data.get('telefono'),
-            email=data.get('email'),
-            direccion=data.get('direccion')
-        )
+        paciente = Paciente(**values)
         
         db.session.add(paciente)
         db.session.commit()
         
         return jsonify(paciente.to_dict()), 201
-    except ValueError as e:
-        return jsonify({'error': 'Formato de fecha inválido. Use YYYY-MM-DD'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pacientes/bulk', methods=['POST'])
+def import_pacientes():
+    """Importar pacientes en lote desde JSON o CSV
+
+    on_conflict indica qué hacer con las cédulas existentes: error (por defecto),
+    skip u update. El reporte por fila se devuelve por streaming en NDJSON.
+    """
+    on_conflict = request.args.get('on_conflict', 'error')
+    if on_conflict not in IMPORT_CONFLICT_MODES:
+        return jsonify({'error': f'on_conflict inválido. Use {", ".join(IMPORT_CONFLICT_MODES)}'}), 400
+    try:
+        rows = import_rows()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def generate():
+        summary = {'creados': 0, 'actualizados': 0, 'omitidos': 0, 'errores': 0}
+        seen = set()
+        row_number = 0
+        while True:
+            chunk, read_error = read_chunk(rows, BULK_CHUNK_SIZE)
+            if chunk:
+                try:
+                    report = import_chunk(chunk, row_number, on_conflict, seen)
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    report = [
+                        {'fila': row_number + offset, 'resultado': 'error', 'error': str(e)}
+                        for offset in range(len(chunk))
+                    ]
+                row_number += len(chunk)
+                lines = []
+                for item in report:
+                    summary[IMPORT_SUMMARY_KEYS[item['resultado']]] += 1
+                    lines.append(json.dumps(item) + '\n')
+                yield ''.join(lines)
+            if read_error is not None:
+                # Un CSV que no es UTF-8 o está mal formado no se puede seguir leyendo:
+                # se reporta el error y se termina con el resumen de lo importado
+                summary['errores'] += 1
+                yield json.dumps({'fila': row_number, 'resultado': 'error',
+                                  'error': f'CSV ilegible (se espera UTF-8): {read_error}'}) + '\n'
+                break
+            if not chunk:
+                break
+        yield json.dumps({'resumen': summary}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 @app.route('/pacientes/<int:id>', methods=['PUT'])
+@query_budget(4)
 def update_paciente(id):
     """Actualizar un paciente"""
     try:
@@ -129,8 +654,8 @@ def update_paciente(id):
             paciente.nombre = data['nombre']
         if 'apellido' in data:
             paciente.apellido = data['apellido']
-        if 'cedula' in data:
-            # Verificar que no exista otra cédula igual
+        if 'cedula' in data and data['cedula'] != paciente.cedula:
+            # Verificar que no exista otra cédula igual (solo si cambia: una consulta menos)
             existing = Paciente.query.filter_by(cedula=data['cedula']).first()
             if existing and existing.id != id:
                 return jsonify({'error': 'Ya existe un paciente con esa cédula'}), 400
@@ -170,6 +695,20 @@ def delete_paciente(id):
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@app.cli.command('migrar')
+@click.option('--estado', is_flag=True, help='Solo mostrar las migraciones aplicadas y pendientes.')
+def migrar(estado):
+    """Aplicar las migraciones pendientes del esquema"""
+    if estado:
+        for version, descripcion, aplicada in migraciones.status(db.engine):
+            click.echo(f"{version:04d} {'aplicada ' if aplicada else 'pendiente'} {descripcion}")
+        return
+    applied = migraciones.migrate(db.engine)
+    for version, descripcion in applied:
+        click.echo(f'Aplicada {version:04d}: {descripcion}')
+    if not applied:
+        click.echo('El esquema está al día')
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,89 @@
+"""Migraciones versionadas del esquema del servicio de pacientes
+
+Se aplican con `flask --app app migrar` como paso único antes de arrancar
+gunicorn (ver Dockerfile), no al importar la app, así los workers no
+consultan el catálogo de la base de datos al iniciar. Las migraciones
+pendientes se aplican en orden en una sola transacción y quedan registradas
+en schema_migrations_pacientes (una tabla por servicio, porque en docker-compose
+comparten la base de datos). Son idempotentes para poder adoptar bases de datos
+creadas antes con init.sql o db.create_all().
+"""
+from datetime import datetime
+
+import sqlalchemy as sa
+
+# Advisory lock para que dos despliegues simultáneos no migren a la vez
+MIGRATION_LOCK_ID = 7200
+
+MIGRACIONES = []
+
+schema_migrations = sa.Table(
+    'schema_migrations_pacientes', sa.MetaData(),
+    sa.Column('version', sa.Integer, primary_key=True),
+    sa.Column('descripcion', sa.String(200), nullable=False),
+    sa.Column('aplicada_en', sa.DateTime, nullable=False)
+)
+
+
+def migracion(version, descripcion):
+    """Registrar una función fn(connection) como la migración `version`"""
+    def register(func):
+        MIGRACIONES.append((version, descripcion, func))
+        MIGRACIONES.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+def applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return set(connection.scalars(sa.select(schema_migrations.c.version)))
+
+
+def status(engine):
+    """Lista de (version, descripcion, aplicada) de todas las migraciones"""
+    with engine.begin() as connection:
+        applied = applied_versions(connection)
+    return [(version, descripcion, version in applied) for version, descripcion, _ in MIGRACIONES]
+
+
+def migrate(engine):
+    """Aplicar las migraciones pendientes y devolver las aplicadas como (version, descripcion)"""
+    applied_now = []
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(sa.text('SELECT pg_advisory_xact_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+            # Las migraciones (p. ej. crear índices) no están sujetas a DB_STATEMENT_TIMEOUT_MS
+            connection.execute(sa.text('SET LOCAL statement_timeout = 0'))
+        applied = applied_versions(connection)
+        for version, descripcion, func in MIGRACIONES:
+            if version in applied:
+                continue
+            func(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, descripcion=descripcion, aplicada_en=datetime.utcnow()))
+            applied_now.append((version, descripcion))
+    return applied_now
+
+
+# ==================== MIGRACIONES ====================
+# Las tablas se definen aquí tal como eran en cada versión, no a partir del
+# modelo actual, para que las migraciones antiguas no cambien con el modelo.
+
+pacientes_v1 = sa.Table(
+    'pacientes', sa.MetaData(),
+    sa.Column('id', sa.Integer, primary_key=True),
+    sa.Column('nombre', sa.String(100), nullable=False),
+    sa.Column('apellido', sa.String(100), nullable=False),
+    sa.Column('cedula', sa.String(20), unique=True, nullable=False),
+    sa.Column('fecha_nacimiento', sa.Date, nullable=False),
+    sa.Column('telefono', sa.String(20)),
+    sa.Column('email', sa.String(120)),
+    sa.Column('direccion', sa.String(200)),
+    sa.Column('created_at', sa.DateTime),
+    sa.Column('updated_at', sa.DateTime)
+)
+
+
+@migracion(1, 'Crear tabla pacientes')
+def crear_tabla_pacientes(connection):
+    pacientes_v1.create(connection, checkfirst=True)
@@ -0,0 +1,237 @@
+"""Perfilado por muestreo en el proceso, para ver dónde gasta CPU un worker
+
+Desactivado por defecto: con PROFILING_ENABLED=true y PROFILING_TOKEN se
+habilitan dos modos, ambos con salida en formato "collapsed" (una pila por
+línea con su número de muestras) que leen flamegraph.pl y speedscope.
+
+- GET /perfil?segundos=N: muestrea las pilas de todos los hilos del proceso
+  durante N segundos. Con workers de varios hilos o asíncronos responde con
+  el perfil. Un worker sync de gunicorn atiende una petición a la vez: ahí el
+  muestreo corre en un hilo aparte, que ve al worker atender las peticiones
+  siguientes, y la respuesta es 202 con la URL del resultado (/perfil/<id>).
+- PROFILING_SLOW_REQUEST_MS: un hilo de muestreo recorre las pilas de las
+  peticiones en curso y guarda el perfil de las que tardan más que el umbral
+  (GET /perfil/lentas y, con PROFILING_DIR, un archivo .folded por petición).
+
+Desactivado no se instala ningún hook ni hilo.
+"""
+import hmac
+import itertools
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
+
+from flask import g, request
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', 5))
+PROFILING_MAX_SECONDS = float(os.getenv('PROFILING_MAX_SECONDS', 60))
+PROFILING_SLOW_REQUEST_MS = float(os.getenv('PROFILING_SLOW_REQUEST_MS', 0))  # 0 desactiva
+PROFILING_DIR = os.getenv('PROFILING_DIR')
+SLOW_PROFILES_SIZE = 20
+BACKGROUND_PROFILES_SIZE = 20
+FOLDED_CONTENT_TYPE = 'text/plain; charset=utf-8'
+
+_labels = {}
+
+
+def _label(code):
+    """Nombre de un marco: función (directorio/archivo:línea)"""
+    label = _labels.get(code)
+    if label is None:
+        path = code.co_filename
+        short = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        label = _labels[code] = f'{code.co_name} ({short}:{code.co_firstlineno})'.replace(';', ',')
+    return label
+
+
+def fold(frame, root):
+    """Pila de un marco en formato collapsed, de la raíz al marco actual"""
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.append(root)
+    return ';'.join(reversed(labels))
+
+
+def folded(counts):
+    """Texto collapsed: "raíz;...;marco muestras" por línea, de la pila más frecuente a la menos"""
+    return ''.join(f'{stack} {count}\n' for stack, count in counts.most_common())
+
+
+def authorize(authorization):
+    """Código de error para la cabecera Authorization (404 si el perfilado está desactivado), o None"""
+    if not PROFILING_ENABLED or not PROFILING_TOKEN:
+        return 404
+    scheme, _, token = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode(), PROFILING_TOKEN.encode()):
+        return 401
+    return None
+
+
+def blocks_worker(environ):
+    """Si muestrear en la petición bloquearía el worker: sin wsgi.multithread (worker sync) atiende una a la vez"""
+    return not environ.get('wsgi.multithread', False)
+
+
+def parse_seconds(value, default=10):
+    """Duración pedida en ?segundos=, entre 0 y PROFILING_MAX_SECONDS"""
+    try:
+        seconds = float(value) if value is not None else default
+    except ValueError:
+        raise ValueError('segundos debe ser un número')
+    if not 0 < seconds <= PROFILING_MAX_SECONDS:
+        raise ValueError(f'segundos debe estar entre 0 y {PROFILING_MAX_SECONDS:g}')
+    return seconds
+
+
+def sample(seconds, interval=None, exclude=()):
+    """Muestrear las pilas de los hilos del proceso (salvo el propio y exclude) durante seconds"""
+    interval = (interval or PROFILING_INTERVAL_MS) / 1000
+    own = threading.get_ident()
+    counts = Counter()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident != own and ident not in exclude:
+                counts[fold(frame, names.get(ident, str(ident)))] += 1
+        time.sleep(interval)
+    return counts
+
+
+_background = OrderedDict()  # id -> muestreo en segundo plano, los más recientes al final
+_background_lock = threading.Lock()
+_background_ids = itertools.count(1)
+
+
+def start_background(seconds):
+    """Muestrear en un hilo aparte; devuelve el muestreo, o None si ya hay uno en curso"""
+    with _background_lock:
+        if any(profile['counts'] is None for profile in _background.values()):
+            return None
+        id = f'{os.getpid()}-{next(_background_ids)}'
+        profile = _background[id] = {'id': id, 'segundos': seconds, 'fin': time.time() + seconds, 'counts': None}
+        while len(_background) > BACKGROUND_PROFILES_SIZE:
+            _background.popitem(last=False)
+    threading.Thread(target=_run_background, args=(profile,), name='perfilado-muestreo', daemon=True).start()
+    return profile
+
+
+def _run_background(profile):
+    counts = sample(profile['segundos'])
+    save('muestreo', counts)
+    profile['counts'] = counts
+
+
+def background_profile(id):
+    """Muestreo en segundo plano de este proceso por id, o None"""
+    with _background_lock:
+        return _background.get(id)
+
+
+def retry_after(profile):
+    """Segundos que faltan para que termine un muestreo en segundo plano (al menos 1)"""
+    return max(1, math.ceil(profile['fin'] - time.time()))
+
+
+def save(name, counts):
+    """Escribir un perfil en PROFILING_DIR (si está configurado) y devolver la ruta"""
+    if not PROFILING_DIR:
+        return None
+    os.makedirs(PROFILING_DIR, exist_ok=True)
+    path = os.path.join(PROFILING_DIR, f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}-{name}.folded")
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(folded(counts))
+    return path
+
+
+class SlowRequestProfiler:
+    """Muestreo de las peticiones en curso; conserva el perfil de las que superan el umbral"""
+
+    def __init__(self, threshold_ms, interval_ms):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.profiles = deque(maxlen=SLOW_PROFILES_SIZE)
+        self._active = {}  # id del hilo -> (ruta, muestras)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Un hilo por proceso: los workers de gunicorn se crean con fork después de importar la app
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='perfilado', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                    continue
+                for ident, (route, counts) in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts[fold(frame, route)] += 1
+
+    def begin(self, route):
+        with self._lock:
+            self._ensure_thread()
+            self._active[threading.get_ident()] = (route, Counter())
+            self._wake.set()
+
+    def end(self, seconds):
+        with self._lock:
+            route, counts = self._active.pop(threading.get_ident(), (None, None))
+        if counts is None or seconds < self.threshold:
+            return
+        self.profiles.append({
+            'route': route,
+            'ms': round(seconds * 1000, 3),
+            'pid': os.getpid(),
+            'fecha': datetime.utcnow().replace(microsecond=0).isoformat(),
+            'muestras': sum(counts.values()),
+            'archivo': save(route.replace(' ', '_').replace('/', '_'), counts),
+            'folded': folded(counts)
+        })
+
+
+slow_profiler = None
+if PROFILING_ENABLED and PROFILING_SLOW_REQUEST_MS > 0:
+    slow_profiler = SlowRequestProfiler(PROFILING_SLOW_REQUEST_MS, PROFILING_INTERVAL_MS)
+
+
+def slow_profiles(route=None):
+    """Perfiles de las últimas peticiones lentas del proceso, opcionalmente de una ruta"""
+    profiles = list(slow_profiler.profiles) if slow_profiler is not None else []
+    return [profile for profile in profiles if route in (None, profile['route'])]
+
+
+def init_profiling(app):
+    """Con PROFILING_SLOW_REQUEST_MS, muestrear cada petición y guardar el perfil de las lentas"""
+    if slow_profiler is None:
+        return
+
+    @app.before_request
+    def start_profile():
+        if request.path.startswith('/perfil'):
+            return
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        g.profile_started = time.perf_counter()
+        slow_profiler.begin(f'{request.method} {route}')
+
+    @app.teardown_request
+    def end_profile(exc):
+        started = g.pop('profile_started', None)
+        if started is not None:
+            slow_profiler.end(time.perf_counter() - started)
@@ -0,0 +1,60 @@
+"""Proveedores JSON de la app: orjson si está instalado, si no el de Flask
+
+Ambos codifican date y datetime en ISO 8601, así las filas de la base de
+datos (tuplas o diccionarios con los valores tal cual) se serializan sin
+convertir cada fecha en Python. Se elige con JSON_SERIALIZER (orjson o std).
+"""
+import os
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider, JSONProvider
+
+from trazas import span
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional
+    orjson = None
+
+JSON_SERIALIZER = os.getenv('JSON_SERIALIZER', 'orjson')
+
+
+def _default(value):
+    """Tipos que el codificador no conoce: fechas en ISO 8601 y el resto como Flask"""
+    if isinstance(value, date):
+        return value.isoformat()
+    return DefaultJSONProvider.default(value)
+
+
+class IsoJSONProvider(DefaultJSONProvider):
+    """Proveedor de Flask (json de la biblioteca estándar) con fechas en ISO 8601"""
+    default = staticmethod(_default)
+
+    def response(self, *args, **kwargs):
+        with span('json.serialize', serializer='std'):
+            return super().response(*args, **kwargs)
+
+
+class OrjsonProvider(JSONProvider):
+    """Proveedor basado en orjson, que codifica las fechas de forma nativa"""
+    # Claves ordenadas, igual que el proveedor por defecto de Flask
+    option = orjson.OPT_SORT_KEYS if orjson is not None else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        with span('json.serialize', serializer='orjson'):
+            body = orjson.dumps(obj, default=_default, option=self.option)
+        return self._app.response_class(body, mimetype='application/json')
+
+
+def json_provider(app):
+    """Proveedor JSON configurado para la app"""
+    if JSON_SERIALIZER == 'orjson' and orjson is not None:
+        return OrjsonProvider(app)
+    return IsoJSONProvider(app)
@@ -1,10 +1,14 @@
 import pytest
+import json
 import sys
 import os
+import time
 from datetime import datetime, timedelta
 
 # Agregar el directorio del servicio al path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# Las trazas vienen desactivadas; se activan antes de importar la app para probarlas
+os.environ.setdefault('TRACING_ENABLED', 'true')
 
 from app import app, db, Paciente
 
@@ -12,6 +16,8 @@ from app import app, db, Paciente
 def client():
     """Cliente de prueba para Flask"""
     app.config['TESTING'] = True
+    # Las rutas que pasen de su presupuesto de consultas SQL hacen fallar el test
+    app.config['QUERY_BUDGET_STRICT'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
     
     with app.test_client() as client:
@@ -146,3 +152,319 @@ def test_get_all_pacientes(client, sample_paciente):
     assert response.status_code == 200
     data = response.get_json()
     assert len(data) == 2
+
+def test_get_pacientes_paginados(client, sample_paciente):
+    """Test paginación por cursor de los pacientes"""
+    for cedula in ['111', '222', '333']:
+        sample_paciente['cedula'] = cedula
+        client.post('/pacientes', json=sample_paciente)
+    
+    response = client.get('/pacientes?limit=2')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert len(data) == 2
+    assert response.headers['X-Next-Cursor'] == str(data[-1]['id'])
+    
+    response = client.get(f'/pacientes?limit=2&cursor={data[-1]["id"]}')
+    data = response.get_json()
+    assert len(data) == 1
+    assert 'Link' not in response.headers
+
+def test_get_pacientes_fields(client, sample_paciente):
+    """Test proyección de campos en el listado de pacientes"""
+    client.post('/pacientes', json=sample_paciente)
+    response = client.get('/pacientes?fields=nombre,fecha_nacimiento')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data[0] == {'id': data[0]['id'], 'nombre': 'Juan', 'fecha_nacimiento': '1990-05-15'}
+
+def test_get_pacientes_parametros_invalidos(client):
+    """Test listado de pacientes con parámetros inválidos"""
+    assert client.get('/pacientes?limit=5000').status_code == 400
+    assert client.get('/pacientes?fields=password').status_code == 400
+
+def test_export_pacientes(client, sample_paciente):
+    """Test exportación de pacientes en NDJSON y JSON"""
+    client.post('/pacientes', json=sample_paciente)
+    
+    response = client.get('/pacientes/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(response.get_data(as_text=True).splitlines()) == 1
+    
+    response = client.get('/pacientes/export?format=json')
+    assert response.get_json()[0]['cedula'] == sample_paciente['cedula']
+
+def leer_reporte(response):
+    """Convertir el reporte NDJSON de una importación en una lista"""
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+def test_import_pacientes_json(client, sample_paciente):
+    """Test importación masiva de pacientes desde JSON"""
+    client.post('/pacientes', json=sample_paciente)
+    nuevo = sample_paciente.copy()
+    nuevo['cedula'] = '555'
+    
+    response = client.post('/pacientes/bulk', json=[sample_paciente, nuevo, nuevo, {'nombre': 'X'}])
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    reporte = leer_reporte(response)
+    assert [fila['resultado'] for fila in reporte[:-1]] == ['error', 'creado', 'error', 'error']
+    assert reporte[-1]['resumen'] == {'creados': 1, 'actualizados': 0, 'omitidos': 0, 'errores': 3}
+
+def test_import_pacientes_on_conflict(client, sample_paciente):
+    """Test importación masiva con on_conflict skip y update"""
+    client.post('/pacientes', json=sample_paciente)
+    cambiado = dict(sample_paciente, telefono='3110000000')
+    
+    reporte = leer_reporte(client.post('/pacientes/bulk?on_conflict=skip', json=[cambiado]))
+    assert reporte[0]['resultado'] == 'omitido'
+    
+    reporte = leer_reporte(client.post('/pacientes/bulk?on_conflict=update', json=[cambiado]))
+    assert reporte[0]['resultado'] == 'actualizado'
+    data = client.get(f'/pacientes/{reporte[0]["id"]}').get_json()
+    assert data['telefono'] == '3110000000'
+    
+    assert client.post('/pacientes/bulk?on_conflict=otro', json=[cambiado]).status_code == 400
+
+def test_import_pacientes_update_conserva_opcionales(client, sample_paciente):
+    """Test que una fila que actualiza sin telefono (omitido o celda vacía) conserva el guardado"""
+    paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+    otro = dict(sample_paciente, cedula='555', telefono='3005555555')
+    otro_id = client.post('/pacientes', json=otro).get_json()['id']
+    
+    sin_telefono = {key: value for key, value in sample_paciente.items() if key != 'telefono'}
+    reporte = leer_reporte(client.post('/pacientes/bulk?on_conflict=update',
+                                       json=[dict(sin_telefono, email='nuevo@email.com'),
+                                             dict(otro, telefono='3119999999')]))
+    assert [fila['resultado'] for fila in reporte[:-1]] == ['actualizado', 'actualizado']
+    data = client.get(f'/pacientes/{paciente_id}').get_json()
+    assert data['telefono'] == '3001234567'
+    assert data['email'] == 'nuevo@email.com'
+    assert client.get(f'/pacientes/{otro_id}').get_json()['telefono'] == '3119999999'
+    
+    contenido = (
+        'nombre,apellido,cedula,fecha_nacimiento,telefono,email,direccion\n'
+        'Juan,Pérez,1234567890,1990-05-15,,,Calle 1\n'
+    )
+    reporte = leer_reporte(client.post('/pacientes/bulk?on_conflict=update', data=contenido, content_type='text/csv'))
+    assert reporte[0]['resultado'] == 'actualizado'
+    data = client.get(f'/pacientes/{paciente_id}').get_json()
+    assert (data['telefono'], data['email'], data['direccion']) == ('3001234567', 'nuevo@email.com', 'Calle 1')
+
+def test_import_pacientes_csv(client):
+    """Test importación masiva de pacientes desde CSV"""
+    contenido = (
+        'nombre,apellido,cedula,fecha_nacimiento,telefono\n'
+        'Ana,Ruiz,777,1992-03-04,\n'
+        'Luis,Mora,888,fecha-mala,3001112233\n'
+    )
+    response = client.post('/pacientes/bulk', data=contenido, content_type='text/csv')
+    reporte = leer_reporte(response)
+    assert [fila['resultado'] for fila in reporte[:-1]] == ['creado', 'error']
+    assert len(client.get('/pacientes').get_json()) == 1
+
+def test_import_pacientes_csv_celdas_vacias(client, sample_paciente):
+    """Test que las celdas vacías del CSV cuentan como ausentes y POST /pacientes conserva su validación"""
+    contenido = (
+        'nombre,apellido,cedula,fecha_nacimiento,telefono\n'
+        'Ana,Ruiz,777,1992-03-04,\n'
+        'Luis,,888,1990-01-01,3001112233\n'
+    )
+    reporte = leer_reporte(client.post('/pacientes/bulk', data=contenido, content_type='text/csv'))
+    assert reporte[1]['error'] == 'Campo apellido es requerido'
+    assert client.get(f"/pacientes/{reporte[0]['id']}").get_json()['telefono'] is None
+    
+    # Un POST individual guarda las cadenas vacías tal cual, como siempre
+    response = client.post('/pacientes', json=dict(sample_paciente, telefono=''))
+    assert response.status_code == 201
+    assert response.get_json()['telefono'] == ''
+
+def test_import_pacientes_csv_no_utf8(client):
+    """Test que un CSV que no es UTF-8 se reporta como error y el reporte termina con el resumen"""
+    contenido = 'nombre,apellido,cedula,fecha_nacimiento\nJosé,Peña,777,1992-03-04\n'.encode('latin-1')
+    response = client.post('/pacientes/bulk', data=contenido, content_type='text/csv')
+    assert response.status_code == 200
+    reporte = leer_reporte(response)
+    assert reporte[-2]['resultado'] == 'error'
+    assert reporte[-1]['resumen']['errores'] == 1
+    with app.app_context():
+        assert Paciente.query.count() == 0
+
+def test_import_pacientes_csv_error_tras_primer_bloque(client, monkeypatch):
+    """Test que un byte inválido después del primer bloque conserva lo importado y envía el resumen"""
+    import app as app_module
+    
+    monkeypatch.setattr(app_module, 'BULK_CHUNK_SIZE', 150)
+    filas = ''.join(f'Paciente,Carga,{n:010d},1990-01-01\n' for n in range(300))
+    contenido = ('nombre,apellido,cedula,fecha_nacimiento\n' + filas).encode() + 'Peña,Mal,x,1990-01-01\n'.encode('latin-1')
+    response = client.post('/pacientes/bulk', data=contenido, content_type='text/csv')
+    reporte = leer_reporte(response)
+    resumen = reporte[-1]['resumen']
+    assert resumen['creados'] >= 150
+    assert resumen['errores'] == 1
+    assert 'CSV ilegible' in reporte[-2]['error']
+    with app.app_context():
+        assert Paciente.query.count() == resumen['creados']
+
+def test_get_pacientes_por_ids(client, sample_paciente):
+    """Test obtener varios pacientes por id en una sola petición"""
+    paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+    
+    response = client.get(f'/pacientes?ids={paciente_id},42&fields=nombre')
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['pacientes'] == [{'id': paciente_id, 'nombre': 'Juan'}]
+    assert data['no_encontrados'] == [42]
+    
+    assert client.get('/pacientes?ids=').status_code == 400
+
+def test_get_paciente_condicional(client, sample_paciente):
+    """Test GET condicional de un paciente y del listado"""
+    paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+    
+    etag = client.get(f'/pacientes/{paciente_id}').headers['ETag']
+    assert client.get(f'/pacientes/{paciente_id}', headers={'If-None-Match': etag}).status_code == 304
+    
+    etag_lista = client.get('/pacientes').headers['ETag']
+    assert client.get('/pacientes', headers={'If-None-Match': etag_lista}).status_code == 304
+    
+    client.put(f'/pacientes/{paciente_id}', json={'telefono': '3000000000'})
+    assert client.get(f'/pacientes/{paciente_id}', headers={'If-None-Match': etag}).status_code == 200
+    assert client.get('/pacientes', headers={'If-None-Match': etag_lista}).status_code == 200
+
+def test_get_pacientes_condicional_tras_borrar(client, sample_paciente):
+    """Test que el listado no da 304 después de borrar uno de sus pacientes"""
+    paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+    client.post('/pacientes', json={**sample_paciente, 'cedula': '9876543210', 'email': 'otro@email.com'})
+    
+    response = client.get('/pacientes')
+    etag = response.headers['ETag']
+    assert 'Last-Modified' not in response.headers
+    
+    client.delete(f'/pacientes/{paciente_id}')
+    assert client.get('/pacientes', headers={'If-None-Match': etag}).status_code == 200
+    response = client.get('/pacientes', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+    assert len(response.get_json()) == 1
+
+def test_migraciones():
+    """Test que las migraciones crean el esquema del modelo y se aplican una sola vez"""
+    import sqlalchemy as sa
+    import migraciones
+    
+    engine = sa.create_engine('sqlite://')
+    assert [version for version, _ in migraciones.migrate(engine)] == [1]
+    assert migraciones.migrate(engine) == []
+    
+    columns = {column['name'] for column in sa.inspect(engine).get_columns('pacientes')}
+    assert columns == set(Paciente.__table__.columns.keys())
+
+def test_metrics_pool(client):
+    """Test de las métricas del pool de conexiones"""
+    client.get('/pacientes')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    pool = response.get_json()['pool']
+    assert pool['checkouts'] >= 1
+    assert {'connects', 'invalidations', 'waits', 'timeouts', 'pool_class'} <= set(pool)
+
+@pytest.mark.parametrize('serializer', ['orjson', 'std'])
+def test_listados_como_to_dict(client, sample_paciente, serializer):
+    """Test que los listados leídos como tuplas se serializan igual que to_dict()"""
+    from serializacion import IsoJSONProvider, OrjsonProvider
+    
+    provider = app.json
+    app.json = OrjsonProvider(app) if serializer == 'orjson' else IsoJSONProvider(app)
+    try:
+        paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+        with app.app_context():
+            expected = db.session.get(Paciente, paciente_id).to_dict()
+        assert client.get('/pacientes').get_json() == [expected]
+        assert client.get(f'/pacientes?ids={paciente_id}').get_json()['pacientes'] == [expected]
+        assert client.get('/pacientes/export?format=json').get_json() == [expected]
+        assert client.get('/pacientes?fields=fecha_nacimiento').get_json() == [
+            {'id': paciente_id, 'fecha_nacimiento': expected['fecha_nacimiento']}]
+    finally:
+        app.json = provider
+
+def test_compresion_listado(client, sample_paciente):
+    """Test de la compresión negociada de los listados y sus métricas"""
+    import gzip
+    
+    for n in range(30):
+        client.post('/pacientes', json=dict(sample_paciente, cedula=f'17{n:08d}', email=f'paciente{n}@email.com'))
+    plain = client.get('/pacientes')
+    response = client.get('/pacientes', headers={'Accept-Encoding': 'identity;q=0.5, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(response.data) == plain.data
+    assert 'Content-Encoding' not in client.get('/pacientes?limit=1', headers={'Accept-Encoding': 'gzip'}).headers
+    
+    stats = client.get('/metrics').get_json()['compresion']
+    assert stats['algorithms']['gzip']['bytes_out'] < stats['algorithms']['gzip']['bytes_in']
+
+def test_metrics_por_ruta(client, sample_paciente):
+    """Test de las métricas por ruta en JSON y en formato Prometheus"""
+    client.post('/pacientes', json=sample_paciente)
+    client.get('/pacientes')
+    
+    rutas = client.get('/metrics').get_json()['rutas']
+    assert rutas['GET /pacientes']['status']['200'] >= 1
+    assert rutas['GET /pacientes']['db']['queries_per_request']['count'] >= 1
+    
+    text = client.get('/metrics?format=prometheus').get_data(as_text=True)
+    assert 'http_requests_total{app="pacientes",route="/pacientes",method="POST",status="201"}' in text
+    assert '# TYPE db_query_duration_seconds histogram' in text
+
+def test_trazas_traceparent(client, sample_paciente):
+    """Test que la petición continúa la traza del traceparent recibido y registra SQL y serialización"""
+    trace_id = '4bf92f3577b34da6a3ce929d0e0e4736'
+    paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+    response = client.get(f'/pacientes/{paciente_id}',
+                          headers={'traceparent': f'00-{trace_id}-00f067aa0ba902b7-01'})
+    assert response.headers['X-Trace-Id'] == trace_id
+    
+    spans = client.get(f'/trazas/{trace_id}').get_json()
+    server = next(span for span in spans if span['kind'] == 'server')
+    assert server['name'] == 'GET /pacientes/<int:id>'
+    assert server['parent_id'] == '00f067aa0ba902b7'
+    assert {'db.query', 'json.serialize'} <= {span['name'] for span in spans}
+    assert all(span['trace_id'] == trace_id for span in spans)
+
+def test_presupuesto_consultas(client, sample_paciente, monkeypatch):
+    """Test que actualizar sin cambiar la cédula no la vuelve a buscar y que el presupuesto se verifica"""
+    import consultas
+    
+    paciente_id = client.post('/pacientes', json=sample_paciente).get_json()['id']
+    # get + UPDATE + recarga tras el commit, sin la búsqueda por cédula
+    monkeypatch.setattr(app.view_functions['update_paciente'], 'query_budget', 3)
+    response = client.put(f'/pacientes/{paciente_id}', json={'cedula': sample_paciente['cedula'], 'telefono': '3000000000'})
+    assert response.status_code == 200
+    
+    with pytest.raises(consultas.QueryBudgetExceeded):
+        client.put(f'/pacientes/{paciente_id}', json={'cedula': '5555555555'})
+
+def test_perfil_protegido(client, monkeypatch):
+    """Test que /perfil y /perfil/lentas no existen sin activar y exigen el token"""
+    import perfilado
+    
+    assert client.get('/perfil/lentas').status_code == 404
+    monkeypatch.setattr(perfilado, 'PROFILING_ENABLED', True)
+    monkeypatch.setattr(perfilado, 'PROFILING_TOKEN', 's3cr3t')
+    assert client.get('/perfil/lentas', headers={'Authorization': 'Bearer otro'}).status_code == 401
+    response = client.get('/perfil/lentas', headers={'Authorization': 'Bearer s3cr3t'})
+    assert response.status_code == 200
+    assert response.get_json()['perfiles'] == []
+    response = client.get('/perfil?segundos=0.05', headers={'Authorization': 'Bearer s3cr3t'},
+                          environ_overrides={'wsgi.multithread': True})
+    assert response.mimetype == 'text/plain'
+    # Worker sync: el muestreo corre en segundo plano
+    response = client.get('/perfil?segundos=0.05', headers={'Authorization': 'Bearer s3cr3t'})
+    assert response.status_code == 202
+    url = response.headers['Location']
+    deadline = time.time() + 5
+    while client.get(url, headers={'Authorization': 'Bearer s3cr3t'}).status_code == 202 and time.time() < deadline:
+        time.sleep(0.05)
+    response = client.get(url, headers={'Authorization': 'Bearer s3cr3t'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'